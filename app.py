@@ -38,6 +38,9 @@ def start_channel(channel_name: str):
             threading.Thread(target=linkai_client.start, args=(channel,)).start()
         except Exception as e:
             pass
+    if channel_name in ["wechatmp", "wechatmp_service", "wechatcom_app"]:
+        from service.ocr_service import warmup_ocr_service
+        warmup_ocr_service()
     channel.startup()
 
 
@@ -4,11 +4,12 @@ import time
 import os
 import json
 import datetime
+import threading
 
 import openai
 import openai.error
 import requests
-from common import const
+from common import const, http_client
 from bot.bot import Bot
 from bot.chatgpt.chat_gpt_session import ChatGPTSession
 from bot.openai.open_ai_image import OpenAIImage
@@ -16,7 +17,7 @@ from bot.session_manager import SessionManager
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
 from common.log import logger
-from common.token_bucket import TokenBucket
+from common.token_bucket import TokenBucket, TokenBucketRegistry
 from config import conf, load_config
 from bot.baidu.baidu_wenxin_session import BaiduWenxinSession
 
@@ -31,8 +32,9 @@ class ChatGPTBot(Bot, OpenAIImage):
         proxy = conf().get("proxy")
         if proxy:
             openai.proxy = proxy
-        if conf().get("rate_limit_chatgpt"):
-            self.tb4chatgpt = TokenBucket(conf().get("rate_limit_chatgpt", 20))
+        # 限流器在首次使用时按配置创建，#reconf开启或修改限额后无需重建bot
+        self.rate_limiters = {}  # 配置项 -> (限额, 限流器)
+        self.rate_limiters_lock = threading.Lock()
         # 加载配置
         model = conf().get("model") or "gpt-3.5-turbo"
         self.sessions = SessionManager(ChatGPTSession, model=model)
@@ -85,49 +87,24 @@ class ChatGPTBot(Bot, OpenAIImage):
             logger.info("[CHATGPT] query={}".format(query))
 
             session_id = context["session_id"]
-            reply = None
-            clear_memory_commands = conf().get("clear_memory_commands", ["#清除记忆"])
-            if query in clear_memory_commands:
-                self.sessions.clear_session(session_id)
-                reply = Reply(ReplyType.INFO, "记忆已清除")
-            elif query == "#清除所有":
-                self.sessions.clear_all_session()
-                reply = Reply(ReplyType.INFO, "所有人记忆已清除")
-            elif query == "#更新配置":
-                load_config()
-                reply = Reply(ReplyType.INFO, "配置已更新")
+            reply = self._handle_command(query, session_id)
             if reply:
                 return reply
+            api_key, model, new_args = self._request_args(context)
+
+            if not self._check_rate_limit(session_id, query, api_key, model):
+                return Reply(ReplyType.ERROR, "提问太快啦，请休息一下再问我吧")
+
             session = self.sessions.session_query(query, session_id)
             logger.debug("[CHATGPT] session query={}".format(session.messages))
 
-            api_key = context.get("openai_api_key")
-            model = context.get("gpt_model")
-            new_args = None
-            if model:
-                new_args = self.args.copy()
-                new_args["model"] = model
+            if context.get("stream"):
+                # 流式回复，由渠道边接收边发送，结束后再写入会话
+                return Reply(ReplyType.TEXT_STREAM, self.reply_text_stream(session, api_key, args=new_args))
 
             # 恢复到非流式调用和处理逻辑
             reply_content = self.reply_text(session, api_key, args=new_args, context=context) # 恢复调用 reply_text 获取完整回复
-            logger.debug(
-                "[CHATGPT] new_query={}, session_id={}, reply_cont={}, completion_tokens={}".format(
-                    session.messages,
-                    session_id,
-                    reply_content["content"],
-                    reply_content["completion_tokens"],
-                )
-            )
-            if reply_content["completion_tokens"] == 0 and len(reply_content["content"]) > 0:
-                reply = Reply(ReplyType.ERROR, reply_content["content"])
-            elif reply_content["completion_tokens"] > 0:
-                # 在非流式模式下，将完整回复添加到 session
-                self.sessions.session_reply(reply_content["content"], session_id, reply_content["total_tokens"])
-                reply = Reply(ReplyType.TEXT, reply_content["content"])
-            else:
-                reply = Reply(ReplyType.ERROR, reply_content["content"])
-                logger.debug("[CHATGPT] reply {} used 0 tokens.".format(reply_content))
-            return reply # 返回 Reply 对象
+            return self._build_text_reply(session, reply_content)
 
         elif context.type == ContextType.IMAGE_CREATE:
             ok, retstring = self.create_img(query, 0)
@@ -141,7 +118,141 @@ class ChatGPTBot(Bot, OpenAIImage):
             reply = Reply(ReplyType.ERROR, "Bot不支持处理{}类型的消息".format(context.type))
             return reply
 
-    def reply_text(self, session, api_key=None, args=None, context=None):
+    async def areply(self, query, context=None):
+        """
+        异步回复文字消息，等待模型回复时不占用线程，供AsyncChatChannel直接await
+        只处理非流式的文字消息，其他类型由渠道在线程池中调用reply
+        """
+        logger.info("[CHATGPT] async query={}".format(query))
+        session_id = context["session_id"]
+        reply = self._handle_command(query, session_id)
+        if reply:
+            return reply
+        api_key, model, new_args = self._request_args(context)
+        if not await self._acheck_rate_limit(session_id, query, api_key, model):
+            return Reply(ReplyType.ERROR, "提问太快啦，请休息一下再问我吧")
+        session = self.sessions.session_query(query, session_id)
+        reply_content = await self.areply_text(session, api_key, args=new_args)
+        return self._build_text_reply(session, reply_content)
+
+    def _handle_command(self, query, session_id):
+        """
+        处理清除记忆等指令，不是指令时返回None
+        """
+        clear_memory_commands = conf().get("clear_memory_commands", ["#清除记忆"])
+        if query in clear_memory_commands:
+            self.sessions.clear_session(session_id)
+            return Reply(ReplyType.INFO, "记忆已清除")
+        elif query == "#清除所有":
+            self.sessions.clear_all_session()
+            return Reply(ReplyType.INFO, "所有人记忆已清除")
+        elif query == "#更新配置":
+            load_config()
+            return Reply(ReplyType.INFO, "配置已更新")
+        return None
+
+    def _request_args(self, context):
+        """
+        :return: (api_key, 模型, 覆盖默认值的请求参数)
+        """
+        api_key = context.get("openai_api_key")
+        model = context.get("gpt_model")
+        new_args = None
+        if model:
+            new_args = self.args.copy()
+            new_args["model"] = model
+        return api_key, model or self.args["model"], new_args
+
+    def _build_text_reply(self, session, reply_content):
+        logger.debug(
+            "[CHATGPT] new_query={}, session_id={}, reply_cont={}, completion_tokens={}".format(
+                session.messages,
+                session.session_id,
+                reply_content["content"],
+                reply_content["completion_tokens"],
+            )
+        )
+        if reply_content["completion_tokens"] == 0 and len(reply_content["content"]) > 0:
+            reply = Reply(ReplyType.ERROR, reply_content["content"])
+        elif reply_content["completion_tokens"] > 0:
+            # 在非流式模式下，将完整回复添加到 session
+            self.sessions.session_reply(reply_content["content"], session.session_id, reply_content["total_tokens"])
+            reply = Reply(ReplyType.TEXT, reply_content["content"])
+        else:
+            reply = Reply(ReplyType.ERROR, reply_content["content"])
+            logger.debug("[CHATGPT] reply {} used 0 tokens.".format(reply_content))
+        return reply # 返回 Reply 对象
+
+    def _get_rate_limiter(self, key):
+        """
+        获取配置项key对应的限流器，未开启该限流时返回None
+        限额被修改后重新创建限流器
+        """
+        limit = conf().get(key)
+        if not limit:
+            return None
+        entry = self.rate_limiters.get(key)
+        if entry is None or entry[0] != limit:
+            with self.rate_limiters_lock:
+                entry = self.rate_limiters.get(key)
+                if entry is None or entry[0] != limit:
+                    wait_seconds = conf().get("rate_limit_wait_seconds", 10)
+                    if key == "rate_limit_chatgpt":
+                        limiter = TokenBucket(limit, timeout=wait_seconds)
+                    elif key == "rate_limit_chatgpt_user":
+                        # 单个用户的调用次数限制，不等待
+                        limiter = TokenBucketRegistry(limit, timeout=0)
+                    else:
+                        # 按预估的prompt token数限流，避免个别用户的长会话耗尽上游的TPM配额
+                        limiter = TokenBucketRegistry(limit, timeout=wait_seconds)
+                    entry = (limit, limiter)
+                    self.rate_limiters[key] = entry
+        return entry[1]
+
+    def _rate_limit_buckets(self, session_id, query, api_key, model):
+        """
+        依次生成本次调用需要扣除令牌的 (令牌桶, 令牌数, 超限日志)：单用户、全局调用次数、TPM
+        """
+        tb4user = self._get_rate_limiter("rate_limit_chatgpt_user")
+        if tb4user:
+            yield tb4user.get_bucket(session_id), 1, "[CHATGPT] user rate limit exceeded, session_id={}".format(session_id)
+        tb4chatgpt = self._get_rate_limiter("rate_limit_chatgpt")
+        if tb4chatgpt:
+            yield tb4chatgpt, 1, "[CHATGPT] rate limit exceeded"
+        tb4tpm = self._get_rate_limiter("rate_limit_chatgpt_tpm")
+        if tb4tpm:
+            # 会话的token数已增量维护，直接用作本次请求的预估token数
+            prompt_tokens = self.sessions.build_session(session_id).calc_tokens() + len(query)
+            yield tb4tpm.get_bucket((api_key, model)), prompt_tokens, "[CHATGPT] tpm limit exceeded, model={}, prompt_tokens={}".format(model, prompt_tokens)
+
+    def _check_rate_limit(self, session_id, query, api_key, model):
+        """
+        依次检查单用户、全局调用次数和TPM限制，某项未通过时退还前面已扣除的令牌
+        :return: 是否允许本次调用
+        """
+        acquired = []
+        for bucket, weight, message in self._rate_limit_buckets(session_id, query, api_key, model):
+            if not bucket.get_token(weight):
+                logger.warning(message)
+                for acquired_bucket, acquired_weight in acquired:
+                    acquired_bucket.refund(acquired_weight)
+                return False
+            acquired.append((bucket, weight))
+        return True
+
+    async def _acheck_rate_limit(self, session_id, query, api_key, model):
+        """_check_rate_limit的异步版本，等待令牌时不阻塞事件循环"""
+        acquired = []
+        for bucket, weight, message in self._rate_limit_buckets(session_id, query, api_key, model):
+            if not await bucket.aget_token(weight):
+                logger.warning(message)
+                for acquired_bucket, acquired_weight in acquired:
+                    acquired_bucket.refund(acquired_weight)
+                return False
+            acquired.append((bucket, weight))
+        return True
+
+    def _merge_args(self, args=None):
         # 使用默认参数，如果没有提供
         default_args = {
             "model": conf().get("model") or "gpt-3.5-turbo",
@@ -150,16 +261,16 @@ class ChatGPTBot(Bot, OpenAIImage):
             "top_p": conf().get("top_p", 1.0),
             "frequency_penalty": conf().get("frequency_penalty", 0.0),
             "presence_penalty": conf().get("presence_penalty", 0.0),
-            # 移除 stream=True 参数
-            # "stream": True,
         }
 
         # 合并默认参数和提供的参数
         if args:
             for key, value in args.items():
                 default_args[key] = value
+        return default_args
 
-        args = default_args
+    def reply_text(self, session, api_key=None, args=None, context=None):
+        args = self._merge_args(args)
 
         # 记录会话消息
         logger.info(f"[CHATGPT] 会话ID: {session.session_id}")
@@ -217,6 +328,75 @@ class ChatGPTBot(Bot, OpenAIImage):
 
             return {"content": error_message, "completion_tokens": 0, "total_tokens": 0}
 
+    async def areply_text(self, session, api_key=None, args=None):
+        """reply_text的异步版本"""
+        args = self._merge_args(args)
+        logger.info(f"[CHATGPT] 异步请求, 会话ID: {session.session_id}, 会话消息数量: {len(session.messages)}, model: {args.get('model')}")
+        if api_key is not None:
+            openai.api_key = api_key
+        api_base = conf().get("open_ai_api_base")
+        if api_base:
+            openai.api_base = api_base
+        try:
+            response = await openai.ChatCompletion.acreate(**args, messages=session.messages)
+            reply = response.choices[0].message.content
+            usage = response.usage
+            logger.info(f"[CHATGPT] Reply: {reply[:100]}...")
+            logger.info(f"[CHATGPT] Usage: {usage}")
+            return {
+                "content": reply,
+                "completion_tokens": usage.completion_tokens,
+                "total_tokens": usage.total_tokens,
+            }
+        except Exception as e:
+            logger.error(f"[CHATGPT] Exception: {e}")
+            logger.exception(e)
+            return {"content": f"AI 回复生成出错: {e}", "completion_tokens": 0, "total_tokens": 0}
+
+    def reply_text_stream(self, session, api_key=None, args=None):
+        """
+        流式调用模型，逐段返回增量文本，完整回复在结束后写入会话
+        :return: 增量文本的生成器，出错时最后一段为错误信息
+        """
+        args = self._merge_args(args)
+        logger.info(f"[CHATGPT] 流式请求, 会话ID: {session.session_id}, 会话消息数量: {len(session.messages)}")
+
+        if api_key is not None:
+            openai.api_key = api_key
+        api_base = conf().get("open_ai_api_base")
+        if api_base:
+            openai.api_base = api_base
+
+        reply = ""
+        start_time = time.time()
+        first_delta_time = None
+        try:
+            response = openai.ChatCompletion.create(
+                **args,
+                messages=session.messages,
+                stream=True,
+            )
+            for chunk in response:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.get("content")
+                if not delta:
+                    continue
+                if first_delta_time is None:
+                    first_delta_time = time.time()
+                    logger.info(f"[CHATGPT] 首段回复耗时: {first_delta_time - start_time:.2f}s")
+                reply += delta
+                yield delta
+        except Exception as e:
+            logger.error(f"[CHATGPT] Stream exception: {e}")
+            logger.exception(e)
+            yield ("\n" if reply else "") + f"AI 回复生成出错: {e}"
+            return
+
+        logger.info(f"[CHATGPT] Stream reply: {reply[:100]}..., 总耗时: {time.time() - start_time:.2f}s")
+        if reply:
+            self.sessions.session_reply(reply, session.session_id)
+
 
 class AzureChatGPTBot(ChatGPTBot):
     def __init__(self):
@@ -238,13 +418,13 @@ class AzureChatGPTBot(ChatGPTBot):
             headers = {"api-key": api_key, "Content-Type": "application/json"}
             try:
                 body = {"prompt": query, "size": conf().get("image_create_size", "256x256"),"n": 1}
-                submission = requests.post(url, headers=headers, json=body)
+                submission = http_client.post(url, headers=headers, json=body)
                 operation_location = submission.headers['operation-location']
                 status = ""
                 while (status != "succeeded"):
                     if retry_count > 3:
                         return False, "图片生成失败"
-                    response = requests.get(operation_location, headers=headers)
+                    response = http_client.get(operation_location, headers=headers)
                     status = response.json()['status']
                     retry_count += 1
                 image_url = response.json()['result']['data'][0]['url']
@@ -263,7 +443,7 @@ class AzureChatGPTBot(ChatGPTBot):
             headers = {"api-key": api_key, "Content-Type": "application/json"}
             try:
                 body = {"prompt": query, "size": conf().get("image_create_size", "1024x1024"), "quality": conf().get("dalle3_image_quality", "standard")}
-                response = requests.post(url, headers=headers, json=body)
+                response = http_client.post(url, headers=headers, json=body, timeout=(5, 180))
                 response.raise_for_status()  # 检查请求是否成功
                 data = response.json()
 
@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 from bot.session_manager import Session
 from common.log import logger
 from common import const
@@ -11,22 +13,47 @@ from common import const
     ]
 """
 
+# 每次回复前的固定开销 <|start|>assistant<|message|>
+REPLY_PRIMING_TOKENS = 3
+
 
 class ChatGPTSession(Session):
+    """
+    每条消息的令牌数在添加时计算一次，与消息一一对应保存在self.token_counts中，
+    会话总令牌数随消息的添加和丢弃增量维护，不再重复编码整个会话历史
+    """
+
     def __init__(self, session_id, system_prompt=None, model="gpt-3.5-turbo"):
         super().__init__(session_id, system_prompt)
         self.model = model
         self.reset()
 
+    def reset(self):
+        self.messages = []
+        self.token_counts = []
+        self.total_tokens = num_tokens_from_messages([], self.model)
+        self.append_message("system", self.system_prompt)
+
+    def add_query(self, query):
+        self.append_message("user", query)
+
+    def add_reply(self, reply):
+        self.append_message("assistant", reply)
+
     def append_message(self, role, content):
         """
         添加消息到会话历史
         :param role: 角色，可以是 "system", "user", "assistant"
         :param content: 消息内容
         """
-        self.messages.append({"role": role, "content": content})
-        logger.debug(f"[ChatGPTSession] 添加消息: role={role}, content={content[:30]}...")
-        logger.debug(f"[ChatGPTSession] 当前会话消息数量: {len(self.messages)}")
+        message = {"role": role, "content": content}
+        tokens = num_tokens_from_message(message, self.model)
+        self._sync_token_counts()
+        self.messages.append(message)
+        self.token_counts.append(tokens)
+        self.total_tokens += tokens
+        logger.debug(f"[ChatGPTSession] 添加消息: role={role}, content={content[:30]}..., tokens={tokens}")
+        logger.debug(f"[ChatGPTSession] 当前会话消息数量: {len(self.messages)}, 令牌数: {self.total_tokens}")
 
     def get_messages(self):
         """
@@ -40,85 +67,106 @@ class ChatGPTSession(Session):
         """
         丢弃超过最大令牌数的旧消息
         :param max_tokens: 最大令牌数
-        :param llm: 语言模型，用于计算令牌数
+        :param llm: 未使用，保留参数以兼容旧的调用方式
         :return: 当前会话的令牌数
         """
-        # 保留系统消息
-        system_messages = [msg for msg in self.messages if msg["role"] == "system"]
-        other_messages = [msg for msg in self.messages if msg["role"] != "system"]
-        
-        # 如果没有超过最大令牌数，则不需要丢弃
-        if len(other_messages) <= 2:  # 至少保留最新的一问一答
-            return sum(len(msg["content"]) for msg in self.messages) // 4  # 粗略估计token数
-        
-        # 从最旧的消息开始丢弃，直到令牌数小于最大令牌数
-        while len(other_messages) > 2:
-            # 丢弃最旧的一问一答
-            if len(other_messages) >= 2:
-                other_messages = other_messages[2:]
-            else:
-                break
-            
-            # 重建消息列表
-            self.messages = system_messages + other_messages
-            
-            # 粗略估计当前令牌数
-            current_tokens = sum(len(msg["content"]) for msg in self.messages) // 4
-            
-            # 如果当前令牌数小于最大令牌数，则停止丢弃
-            if current_tokens < max_tokens:
-                break
-        
-        # 返回粗略估计的令牌数
-        return sum(len(msg["content"]) for msg in self.messages) // 4
+        self._sync_token_counts()
+        # 系统消息在会话开头，保留
+        start = 0
+        while start < len(self.messages) and self.messages[start]["role"] == "system":
+            start += 1
+
+        # 从最旧的一问一答开始丢弃，至少保留最新的一问一答
+        end = start
+        total = self.total_tokens
+        while total > max_tokens and len(self.messages) - end > 2:
+            total -= self.token_counts[end] + self.token_counts[end + 1]
+            end += 2
+        if end > start:
+            del self.messages[start:end]
+            del self.token_counts[start:end]
+            self.total_tokens = total
+            logger.debug(f"[ChatGPTSession] 丢弃{end - start}条旧消息, 当前令牌数: {total}")
+        return self.total_tokens
 
     def calc_tokens(self):
-        return num_tokens_from_messages(self.messages, self.model)
+        self._sync_token_counts()
+        return self.total_tokens
 
+    # 调用方直接修改了self.messages时重新计算，正常情况下不会执行
+    def _sync_token_counts(self):
+        if len(self.token_counts) == len(self.messages):
+            return
+        self.token_counts = [num_tokens_from_message(message, self.model) for message in self.messages]
+        self.total_tokens = sum(self.token_counts) + num_tokens_from_messages([], self.model)
 
-# refer to https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
-def num_tokens_from_messages(messages, model):
-    """Returns the number of tokens used by a list of messages."""
 
+def _token_model(model):
+    """
+    返回计算令牌数时使用的模型，None表示按字符数计算
+    """
     if model in ["wenxin", "xunfei"] or model.startswith(const.GEMINI):
-        return num_tokens_by_character(messages)
-
-    import tiktoken
-
+        return None
     if model in ["gpt-3.5-turbo-0301", "gpt-35-turbo", "gpt-3.5-turbo-1106", "moonshot", const.LINKAI_35]:
-        return num_tokens_from_messages(messages, model="gpt-3.5-turbo")
+        return "gpt-3.5-turbo"
     elif model in ["gpt-4-0314", "gpt-4-0613", "gpt-4-32k", "gpt-4-32k-0613", "gpt-3.5-turbo-0613",
                    "gpt-3.5-turbo-16k", "gpt-3.5-turbo-16k-0613", "gpt-35-turbo-16k", "gpt-4-turbo-preview",
                    "gpt-4-1106-preview", const.GPT4_TURBO_PREVIEW, const.GPT4_VISION_PREVIEW, const.GPT4_TURBO_01_25,
                    const.GPT_4o, const.GPT_4O_0806, const.GPT_4o_MINI, const.LINKAI_4o, const.LINKAI_4_TURBO]:
-        return num_tokens_from_messages(messages, model="gpt-4")
+        return "gpt-4"
     elif model.startswith("claude-3"):
-        return num_tokens_from_messages(messages, model="gpt-3.5-turbo")
+        return "gpt-3.5-turbo"
+    if model not in ["gpt-3.5-turbo", "gpt-4"]:
+        logger.debug(f"num_tokens_from_messages() is not implemented for model {model}. Returning num tokens assuming gpt-3.5-turbo.")
+        return "gpt-3.5-turbo"
+    return model
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(model):
+    """
+    每个模型只创建一次编码器，tiktoken未安装时返回None
+    """
     try:
-        encoding = tiktoken.encoding_for_model(model)
+        import tiktoken
+    except ImportError:
+        logger.warning("[ChatGPTSession] tiktoken not installed, count tokens by characters")
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
     except KeyError:
         logger.debug("Warning: model not found. Using cl100k_base encoding.")
-        encoding = tiktoken.get_encoding("cl100k_base")
-    if model == "gpt-3.5-turbo":
+        return tiktoken.get_encoding("cl100k_base")
+
+
+# refer to https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
+def num_tokens_from_message(message, model):
+    """Returns the number of tokens used by a single message, excluding the reply priming tokens."""
+    token_model = _token_model(model)
+    encoding = _get_encoding(token_model) if token_model else None
+    if encoding is None:
+        return len(message["content"])
+    if token_model == "gpt-3.5-turbo":
         tokens_per_message = 4  # every message follows <|start|>{role/name}\n{content}<|end|>\n
         tokens_per_name = -1  # if there's a name, the role is omitted
-    elif model == "gpt-4":
+    else:
         tokens_per_message = 3
         tokens_per_name = 1
-    else:
-        logger.debug(f"num_tokens_from_messages() is not implemented for model {model}. Returning num tokens assuming gpt-3.5-turbo.")
-        return num_tokens_from_messages(messages, model="gpt-3.5-turbo")
-    num_tokens = 0
-    for message in messages:
-        num_tokens += tokens_per_message
-        for key, value in message.items():
-            num_tokens += len(encoding.encode(value))
-            if key == "name":
-                num_tokens += tokens_per_name
-    num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
+    num_tokens = tokens_per_message
+    for key, value in message.items():
+        num_tokens += len(encoding.encode(value))
+        if key == "name":
+            num_tokens += tokens_per_name
     return num_tokens
 
 
+def num_tokens_from_messages(messages, model):
+    """Returns the number of tokens used by a list of messages."""
+    if _token_model(model) is None:
+        return num_tokens_by_character(messages)
+    return sum(num_tokens_from_message(message, model) for message in messages) + REPLY_PRIMING_TOKENS
+
+
 def num_tokens_by_character(messages):
     """Returns the number of tokens used by a list of messages."""
     tokens = 0
@@ -1,7 +1,19 @@
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from cache.cache import CACHE_DIR, KVStore
 from common.expired_dict import ExpiredDict
 from common.log import logger
 from config import conf
 
+# 所有会话存储，用于统计会话数和内存占用
+_stores = {}
+_stores_lock = threading.Lock()
+
 
 class Session(object):
     def __init__(self, session_id, system_prompt=None):
@@ -36,9 +48,160 @@ class Session(object):
         raise NotImplementedError
 
 
+class SessionStore(object):
+    """
+    会话存储，内存中按最近使用顺序保存会话
+    - 超过expires_in_seconds未使用的会话过期删除
+    - 超过max_entries时最久未使用的会话转存到磁盘，用户再次发消息时加载回内存
+    转存的会话只保存会话对象的属性(JSON)，加载时不调用构造函数直接恢复属性
+    """
+
+    def __init__(self, session_class, max_entries, expires_in_seconds):
+        self.session_class = session_class
+        self.name = session_class.__name__
+        self.max_entries = max_entries
+        self.expires_in_seconds = expires_in_seconds
+        self._data = OrderedDict()  # session_id -> (session, last_access)
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.loads = 0
+        self.spills = 0
+        self.expirations = 0
+        with _stores_lock:
+            _stores[self.name] = self
+
+    def get(self, session_id):
+        """
+        获取会话，内存中没有时从磁盘加载，都没有返回None
+        """
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(session_id)
+            if item is not None:
+                session, last_access = item
+                if now - last_access <= self.expires_in_seconds:
+                    self._data[session_id] = (session, now)
+                    self._data.move_to_end(session_id)
+                    self.hits += 1
+                    return session
+                del self._data[session_id]
+                self.expirations += 1
+                return None
+            session = self._load(session_id)
+            if session is not None:
+                self.loads += 1
+                self.__setitem__(session_id, session)
+            return session
+
+    def __setitem__(self, session_id, session):
+        now = time.monotonic()
+        spilled = []
+        with self._lock:
+            self._data[session_id] = (session, now)
+            self._data.move_to_end(session_id)
+            # 按最近使用排序，过期的会话都在最前面
+            while self._data:
+                oldest_id, (oldest, last_access) = next(iter(self._data.items()))
+                if now - last_access > self.expires_in_seconds:
+                    del self._data[oldest_id]
+                    self.expirations += 1
+                elif len(self._data) > self.max_entries:
+                    del self._data[oldest_id]
+                    spilled.append((oldest_id, oldest, last_access))
+                else:
+                    break
+            for oldest_id, oldest, last_access in spilled:
+                self._spill(oldest_id, oldest, self.expires_in_seconds - (now - last_access))
+
+    def __len__(self):
+        return len(self._data)
+
+    def pop(self, session_id):
+        with self._lock:
+            item = self._data.pop(session_id, None)
+            _get_spill_store().delete(self._disk_key(session_id))
+        return item[0] if item else None
+
+    def clear(self):
+        store = _get_spill_store()
+        with self._lock:
+            self._data.clear()
+            for key in store.keys(self._disk_key("")):
+                store.delete(key)
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            sessions = [session for session, _ in self._data.values()]
+            stats = {
+                "resident": len(sessions),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "loads": self.loads,
+                "spills": self.spills,
+                "expirations": self.expirations,
+            }
+        stats["spilled"] = len(_get_spill_store().keys(self._disk_key("")))
+        stats["messages"] = sum(len(session.messages) for session in sessions)
+        stats["approx_memory_kb"] = round(sum(_approx_size(session) for session in sessions) / 1024, 1)
+        return stats
+
+    def _disk_key(self, session_id):
+        return "session:{}:{}".format(self.name, session_id)
+
+    def _spill(self, session_id, session, ttl):
+        if ttl <= 0:
+            self.expirations += 1
+            return
+        try:
+            state = json.loads(json.dumps(session.__dict__, ensure_ascii=False))
+        except (TypeError, ValueError) as e:
+            logger.warning("[SessionManager] session {} can not be spilled to disk, dropped: {}".format(session_id, e))
+            return
+        _get_spill_store().set(self._disk_key(session_id), state, ttl)
+        self.spills += 1
+
+    def _load(self, session_id):
+        store = _get_spill_store()
+        key = self._disk_key(session_id)
+        state = store.get(key)
+        if state is None:
+            return None
+        store.delete(key)
+        session = self.session_class.__new__(self.session_class)
+        session.__dict__.update(state)
+        logger.debug("[SessionManager] session {} loaded from disk".format(session_id))
+        return session
+
+
+def _approx_size(session):
+    size = sys.getsizeof(session.messages)
+    for message in session.messages:
+        size += sys.getsizeof(message) + sum(sys.getsizeof(value) for value in message.values())
+    return size
+
+
+_spill_store = None
+_spill_store_lock = threading.Lock()
+
+
+def _get_spill_store():
+    global _spill_store
+    if _spill_store is None:
+        with _spill_store_lock:
+            if _spill_store is None:
+                _spill_store = KVStore(os.path.join(CACHE_DIR, "sessions.log"))
+    return _spill_store
+
+
+def get_session_metrics() -> dict:
+    with _stores_lock:
+        stores = dict(_stores)
+    return {name: store.get_metrics() for name, store in stores.items()}
+
+
 class SessionManager(object):
     def __init__(self, session_class, system_prompt=None, model=None):
-        self.sessions = {}
+        self.sessions = SessionStore(session_class, conf().get("session_max_entries", 1000), conf().get("expires_in_seconds", 3600))
         self.session_class = session_class
         if system_prompt is None and model:
             system_prompt = conf().get("character_desc", "")
@@ -48,16 +211,21 @@ class SessionManager(object):
                 logger.info("[SessionManager] No system prompt")
         self.system_prompt = system_prompt
         
-    def build_session(self, session_id):
+    def build_session(self, session_id, system_prompt=None):
         """
         构建会话
         :param session_id: 会话ID
+        :param system_prompt: 不为None时重新设置会话的系统提示词
         :return: 会话对象
         """
-        if session_id not in self.sessions:
+        session = self.sessions.get(session_id)
+        if session is None:
             logger.debug(f"[SessionManager] 创建新会话: {session_id}")
-            self.sessions[session_id] = self.session_class(session_id, self.system_prompt)
-        return self.sessions[session_id]
+            session = self.session_class(session_id, self.system_prompt)
+            self.sessions[session_id] = session
+        if system_prompt is not None:
+            session.set_system_prompt(system_prompt)
+        return session
         
     def session_query(self, query, session_id):
         """
@@ -69,6 +237,14 @@ class SessionManager(object):
         session = self.build_session(session_id)
         logger.debug(f"[SessionManager] 会话查询前消息数量: {len(session.messages)}")
         session.append_message("user", query)
+        # 会话超过conversation_max_tokens时丢弃最旧的问答，未实现discard_exceeding的会话不裁剪
+        if type(session).discard_exceeding is not Session.discard_exceeding:
+            try:
+                max_tokens = conf().get("conversation_max_tokens", 1000)
+                total_tokens = session.discard_exceeding(max_tokens, None)
+                logger.debug(f"[SessionManager] 会话令牌数: {total_tokens}, 上限: {max_tokens}")
+            except Exception as e:
+                logger.warning(f"[SessionManager] 裁剪会话历史异常: {e}")
         logger.debug(f"[SessionManager] 会话查询后消息数量: {len(session.messages)}")
         logger.debug(f"[SessionManager] 会话消息: {session.messages}")
         return session
@@ -93,9 +269,8 @@ class SessionManager(object):
         清除会话
         :param session_id: 会话ID
         """
-        if session_id in self.sessions:
+        if self.sessions.pop(session_id) is not None:
             logger.debug(f"[SessionManager] 清除会话: {session_id}")
-            del self.sessions[session_id]
             
     def clear_all_session(self):
         """
@@ -1,12 +1,14 @@
 from bot.bot_factory import create_bot
-from bridge.context import Context
-from bridge.reply import Reply
+from bridge.context import Context, ContextType
+from bridge.reply import Reply, ReplyType
 from common import const
 from common.log import logger
+from common.reply_cache import get_reply_cache, make_key
 from common.singleton import singleton
 from config import conf
 from translate.factory import create_translator
 from voice.factory import create_voice
+from voice.tts_cache import get_tts_cache, make_tts_key
 
 
 @singleton
@@ -80,13 +82,77 @@ class Bridge(object):
         return self.btype[typename]
 
     def fetch_reply_content(self, query, context: Context) -> Reply:
-        return self.get_bot("chat").reply(query, context)
+        bot = self.get_bot("chat")
+        cache = get_reply_cache()
+        if cache is None or not context or not context.get("reply_cache") or context.type != ContextType.TEXT:
+            return bot.reply(query, context)
+        return self._fetch_cached_reply(bot, cache, query, context)
+
+    def _fetch_cached_reply(self, bot, cache, query, context: Context) -> Reply:
+        """
+        context["reply_cache"]为True表示回复适合缓存，key由(模型, 系统提示词, 会话历史+本次提问, 采样参数)计算，
+        会话历史或请求参数不同的提问不会命中同一条缓存
+        context["reply_cache_ignore_history"]为True时key不包含会话历史，用于回复基本只取决于提问内容的场景(如聊天记录截图分析)，
+        同样的提问在会话中再次出现时也能命中
+        命中时仍把问答写入会话，保持会话历史完整
+        """
+        sessions = getattr(bot, "sessions", None)
+        session_id = context.get("session_id")
+        if sessions:
+            session = sessions.build_session(session_id)
+            system_prompt = session.system_prompt
+            history = [] if context.get("reply_cache_ignore_history") else list(session.messages)
+            messages = history + [{"role": "user", "content": query}]
+        else:
+            system_prompt = conf().get("character_desc", "")
+            messages = [{"role": "user", "content": query}]
+        params = self._reply_args(bot, context)
+        key = make_key(params.get("model"), system_prompt, messages, params)
+        content = cache.get(key)
+        if content is not None:
+            logger.info("[Bridge] reply cache hit, session_id={}".format(session_id))
+            if sessions:
+                sessions.session_query(query, session_id)
+                sessions.session_reply(content, session_id)
+            return Reply(ReplyType.TEXT, content)
+        reply = bot.reply(query, context)
+        # 流式回复边生成边发送，结束时无法区分正常回复和错误信息，不缓存
+        if reply and reply.type == ReplyType.TEXT:
+            cache.set(key, reply.content)
+        return reply
+
+    @staticmethod
+    def _reply_args(bot, context: Context) -> dict:
+        """
+        bot实际请求时使用的参数(模型、采样参数)，与bot.reply中合并参数的方式保持一致
+        """
+        if hasattr(bot, "_request_args") and hasattr(bot, "_merge_args"):
+            _, _, new_args = bot._request_args(context)
+            return bot._merge_args(new_args)
+        args = dict(getattr(bot, "args", None) or {})
+        args["model"] = context.get("gpt_model") or args.get("model") or conf().get("model")
+        return args
 
     def fetch_voice_to_text(self, voiceFile) -> Reply:
         return self.get_bot("voice_to_text").voiceToText(voiceFile)
 
     def fetch_text_to_voice(self, text) -> Reply:
-        return self.get_bot("text_to_voice").textToVoice(text)
+        bot = self.get_bot("text_to_voice")
+        cache = get_tts_cache()
+        if cache is None or not text or len(text) > conf().get("tts_cache_max_text_length", 500):
+            return bot.textToVoice(text)
+        key = make_tts_key(bot, text)
+        voice_file = cache.get(key)
+        if voice_file:
+            logger.info("[Bridge] tts cache hit, voice file={}".format(voice_file))
+            return Reply(ReplyType.VOICE, voice_file)
+        reply = bot.textToVoice(text)
+        if reply and reply.type == ReplyType.VOICE:
+            try:
+                cache.put(key, reply.content)
+            except Exception as e:
+                logger.warning("[Bridge] tts cache put failed: {}".format(e))
+        return reply
 
     def fetch_translate(self, text, from_lang="", to_lang="en") -> Reply:
         return self.get_bot("translate").translate(text, from_lang, to_lang)
@@ -17,6 +17,7 @@ class ReplyType(Enum):
     TEXT_ = 11  # 强制文本
     VIDEO = 12
     MINIAPP = 13  # 小程序
+    TEXT_STREAM = 14  # 流式文本，content为增量文本的迭代器
 
     def __str__(self):
         return self.name
@@ -1,36 +1,185 @@
 import json
 import os
+import time
 from threading import Lock
 
+from common.log import logger
+
 # 缓存文件路径（与本模块同级目录下）
 CACHE_DIR = os.path.dirname(os.path.abspath(__file__))
+# 追加写日志，每行一条JSON记录: {"k": key, "v": value, "e": 过期时间戳} 或删除标记 {"k": key, "d": 1}
+CACHE_LOG_FILE = os.path.join(CACHE_DIR, "cache.log")
+# 旧版整文件JSON缓存，首次启动时迁移到日志文件
 CACHE_FILE = os.path.join(CACHE_DIR, "cache.json")
-cache_lock = Lock()
-
-# 加载缓存数据
-def load_cache():
-    if not os.path.exists(CACHE_FILE):
-        with open(CACHE_FILE, "w", encoding="utf-8") as f:
-            json.dump({}, f)
-        return {}
-    with open(CACHE_FILE, "r", encoding="utf-8") as f:
+
+# 旧版缓存中的消息去重标记没有过期时间，迁移时统一设置过期时间
+PROCESSED_KEY_PREFIX = "wx_processed_"
+MIGRATED_PROCESSED_TTL = 24 * 3600
+
+# 日志中的无效记录(被覆盖、删除或过期)超过该数量，且超过有效记录数时进行压缩
+COMPACT_MIN_GARBAGE = 1000
+# 距离上次压缩超过该时间(秒)，有无效记录就进行压缩
+COMPACT_INTERVAL = 3600
+
+
+class KVStore:
+    """
+    追加写的键值存储，内存中保存全部有效数据，读操作不访问磁盘
+    每次写操作只在日志末尾追加一行，无效记录在压缩时清理
+    """
+
+    def __init__(self, log_file, legacy_file=None):
+        self.log_file = log_file
+        self.legacy_file = legacy_file
+        self.lock = Lock()
+        self.index = {}  # key -> (value, expire_at)，expire_at为None表示永不过期
+        self.garbage = 0  # 日志中的无效记录数
+        self.last_compact = time.time()
+        self._load()
+        self.fp = open(self.log_file, "a", encoding="utf-8")
+
+    def get(self, key, default=None):
+        with self.lock:
+            item = self.index.get(key)
+            if item is None:
+                return default
+            value, expire_at = item
+            if expire_at is not None and expire_at <= time.time():
+                return default
+            return value
+
+    def set(self, key, value, ttl=None):
+        """
+        :param ttl: 过期时间(秒)，None表示永不过期
+        """
+        expire_at = time.time() + ttl if ttl else None
+        record = {"k": key, "v": value}
+        if expire_at is not None:
+            record["e"] = expire_at
+        with self.lock:
+            if key in self.index:
+                self.garbage += 1
+            self.index[key] = (value, expire_at)
+            self._append(record)
+            self._maybe_compact()
+
+    def delete(self, key):
+        with self.lock:
+            if key not in self.index:
+                return
+            del self.index[key]
+            self.garbage += 2  # 原记录和删除标记都是无效记录
+            self._append({"k": key, "d": 1})
+            self._maybe_compact()
+
+    def keys(self, prefix=""):
+        now = time.time()
+        with self.lock:
+            return [key for key, (_, expire_at) in self.index.items()
+                    if key.startswith(prefix) and (expire_at is None or expire_at > now)]
+
+    def compact(self):
+        with self.lock:
+            self._compact()
+
+    def _append(self, record):
+        self.fp.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.fp.flush()
+
+    def _load(self):
+        if not os.path.exists(self.log_file):
+            self._migrate_legacy()
+            return
+        now = time.time()
+        records = 0
+        with open(self.log_file, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    key = record["k"]
+                except (ValueError, KeyError, TypeError):
+                    logger.warning("[cache] skip broken record: {}".format(line[:100]))
+                    continue
+                records += 1
+                if record.get("d"):
+                    self.index.pop(key, None)
+                    continue
+                expire_at = record.get("e")
+                if expire_at is not None and expire_at <= now:
+                    self.index.pop(key, None)
+                    continue
+                self.index[key] = (record.get("v"), expire_at)
+        self.garbage = records - len(self.index)
+        logger.info("[cache] loaded {} keys from {}, {} garbage records".format(len(self.index), self.log_file, self.garbage))
+
+    def _migrate_legacy(self):
+        if not self.legacy_file or not os.path.exists(self.legacy_file):
+            return
         try:
-            return json.load(f)
-        except json.JSONDecodeError:
-            return {}
+            with open(self.legacy_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (ValueError, OSError) as e:
+            logger.warning("[cache] failed to load legacy cache {}: {}".format(self.legacy_file, e))
+            return
+        expire_at = time.time() + MIGRATED_PROCESSED_TTL
+        for key, value in data.items():
+            self.index[key] = (value, expire_at if key.startswith(PROCESSED_KEY_PREFIX) else None)
+        self._rewrite()
+        os.replace(self.legacy_file, self.legacy_file + ".migrated")
+        logger.info("[cache] migrated {} keys from {}".format(len(self.index), self.legacy_file))
+
+    def _maybe_compact(self):
+        if self.garbage == 0:
+            return
+        if (self.garbage >= COMPACT_MIN_GARBAGE and self.garbage > len(self.index)) or time.time() - self.last_compact > COMPACT_INTERVAL:
+            self._compact()
+
+    def _compact(self):
+        now = time.time()
+        expired = [key for key, (_, expire_at) in self.index.items() if expire_at is not None and expire_at <= now]
+        for key in expired:
+            del self.index[key]
+        self.fp.close()
+        self._rewrite()
+        self.fp = open(self.log_file, "a", encoding="utf-8")
+        logger.debug("[cache] compacted, {} garbage records removed, {} keys left".format(self.garbage, len(self.index)))
+        self.garbage = 0
+        self.last_compact = now
+
+    # 把当前有效数据写入临时文件后原子替换日志文件
+    def _rewrite(self):
+        tmp_file = self.log_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            for key, (value, expire_at) in self.index.items():
+                record = {"k": key, "v": value}
+                if expire_at is not None:
+                    record["e"] = expire_at
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.log_file)
+
+
+_store = None
+_store_lock = Lock()
+
+
+def get_store() -> KVStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = KVStore(CACHE_LOG_FILE, CACHE_FILE)
+    return _store
 
-# 保存缓存数据
-def save_cache(data):
-    with open(CACHE_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
 
 def get(key):
-    with cache_lock:
-        data = load_cache()
-        return data.get(key)
-
-def set(key, value):
-    with cache_lock:
-        data = load_cache()
-        data[key] = value
-        save_cache(data)
\ No newline at end of file
+    return get_store().get(key)
+
+
+def set(key, value, ttl=None):
+    get_store().set(key, value, ttl)
+
+
+def delete(key):
+    get_store().delete(key)
@@ -0,0 +1,117 @@
+import asyncio
+import inspect
+import threading
+from concurrent.futures import Future
+
+from bridge.bridge import Bridge
+from bridge.context import *
+from bridge.reply import *
+from channel.chat_channel import ChatChannel
+from common.log import logger
+from common.worker_pool import get_worker_pool
+from config import conf
+from plugins import *
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    获取共享的事件循环，首次调用时在后台线程中启动
+    """
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name="async_chat_loop", daemon=True)
+                thread.start()
+                _loop = loop
+    return _loop
+
+
+def run_coroutine(coro) -> Future:
+    """
+    在共享事件循环中执行协程，可在任意线程中调用(包括没有运行中事件循环的线程池线程)
+    :return: concurrent.futures.Future
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+
+
+# 消息处理流水线的asyncio版本，配置async_pipeline为true时启用
+# compose -> generate -> decorate -> send 各阶段在共享事件循环中串联，
+# 同步的插件、bot和发送函数仍在各阶段的线程池中执行(线程池大小即并发上限)，
+# bot实现了async def areply、渠道实现了async def asend时直接await，等待模型回复和发送时不占用线程
+class AsyncChatChannel(ChatChannel):
+    def _submit_handle(self, context: Context) -> Future:
+        if not conf().get("async_pipeline", False):
+            return super()._submit_handle(context)
+        future = Future()
+        run_coroutine(self._ahandle(future, context))
+        return future
+
+    async def _ahandle(self, future: Future, context: Context):
+        # 与线程池版本一致，只能取消还没开始处理的消息
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            await self._run_pipeline(context)
+            future.set_result(None)
+        except BaseException as e:
+            future.set_exception(e)
+
+    async def _run_pipeline(self, context: Context):
+        next_stage = await self._run_in_pool("compose", self._handle, context)
+        while next_stage:
+            pool_name, func, args = next_stage
+            if func == self._handle_generate:
+                next_stage = await self._ahandle_generate(*args)
+            elif func == self._send_reply and pool_name == "send" and self._is_async_sender():
+                next_stage = await self._asend_reply(*args)
+            else:
+                next_stage = await self._run_in_pool(pool_name, func, *args)
+
+    async def _run_in_pool(self, pool_name, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(get_worker_pool(pool_name), func, *args)
+
+    async def _ahandle_generate(self, context: Context, e_context: EventContext):
+        bot = Bridge().get_bot("chat")
+        # 允许缓存回复的消息需要经过Bridge查询回复缓存
+        if context.type != ContextType.TEXT or context.get("reply_cache") or not inspect.iscoroutinefunction(getattr(bot, "areply", None)):
+            return await self._run_in_pool("generate", self._handle_generate, context, e_context)
+        context["channel"] = e_context["channel"]
+        if self._stream_reply_enabled(context):
+            # 流式回复由渠道在发送时同步消费，仍走线程池
+            context["stream"] = True
+            return await self._run_in_pool("generate", self._handle_generate, context, e_context)
+        reply = await bot.areply(context.content, context)
+        return "decorate", self._handle_decorate, (context, reply)
+
+    def _is_async_sender(self):
+        return inspect.iscoroutinefunction(getattr(self, "asend", None))
+
+    async def _asend_reply(self, context: Context, reply: Reply):
+        if not reply or not reply.type:
+            return
+        e_context = await self._run_in_pool(
+            "send",
+            PluginManager().emit_event,
+            EventContext(Event.ON_SEND_REPLY, {"channel": self, "context": context, "reply": reply}),
+        )
+        reply = e_context["reply"]
+        if not e_context.is_pass() and reply and reply.type:
+            logger.debug("[async_chat_channel] ready to send reply: {}, context: {}".format(reply, context))
+            await self._asend(reply, context)
+
+    async def _asend(self, reply: Reply, context: Context, retry_cnt=0):
+        try:
+            await self.asend(reply, context)
+        except Exception as e:
+            logger.error("[async_chat_channel] sendMsg error: {}".format(str(e)))
+            if isinstance(e, NotImplementedError):
+                return
+            logger.exception(e)
+            if retry_cnt < 2:
+                await asyncio.sleep(3 + 3 * retry_cnt)
+                await self._asend(reply, context, retry_cnt + 1)
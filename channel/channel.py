@@ -10,6 +10,7 @@ from bridge.reply import *
 class Channel(object):
     channel_type = ""
     NOT_SUPPORT_REPLYTYPE = [ReplyType.VOICE, ReplyType.IMAGE]
+    SUPPORT_STREAM_REPLY = False  # 是否支持流式回复(ReplyType.TEXT_STREAM)，支持的渠道需在send中边接收边发送
 
     def startup(self):
         """
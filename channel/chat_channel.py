@@ -1,15 +1,17 @@
 import os
-import re
 import threading
 import time
 from asyncio import CancelledError
-from concurrent.futures import Future, ThreadPoolExecutor
+from collections import deque
+from concurrent.futures import Future
 
 from bridge.context import *
 from bridge.reply import *
 from channel.channel import Channel
+from channel.trigger_matcher import get_trigger_matcher, mention_pattern
 from common.dequeue import Dequeue
 from common import memory
+from common.worker_pool import get_worker_pool
 from plugins import *
 
 try:
@@ -17,8 +19,6 @@ try:
 except Exception as e:
     pass
 
-handler_pool = ThreadPoolExecutor(max_workers=8)  # 处理消息的线程池
-
 
 # 抽象类, 它包含了与消息通道无关的通用处理逻辑
 class ChatChannel(Channel):
@@ -27,6 +27,9 @@ class ChatChannel(Channel):
     futures = {}  # 记录每个session_id提交到线程池的future对象, 用于重置会话时把没执行的future取消掉，正在执行的不会被取消
     sessions = {}  # 用于控制并发，每个session_id同时只能有一个context在处理
     lock = threading.Lock()  # 用于控制对sessions的访问
+    ready_cond = threading.Condition(lock)  # 与lock共用同一把锁，有可运行的session时唤醒消费线程
+    ready_sessions = deque()  # 可运行的session_id队列：有待处理消息且可能还有空闲并发名额
+    ready_set = set()  # ready_sessions的去重集合
 
     def __init__(self):
         _thread = threading.Thread(target=self.consume)
@@ -37,6 +40,8 @@ class ChatChannel(Channel):
     def _compose_context(self, ctype: ContextType, content, **kwargs):
         context = Context(ctype, content)
         context.kwargs = kwargs
+        # 前缀、关键词、群白名单等触发规则在配置加载后预先编译，整条消息处理过程使用同一个匹配器
+        matcher = get_trigger_matcher()
         # context首次传入时，origin_ctype是None,
         # 引入的起因是：当输入语音时，会嵌套生成两个context，第一步语音转文本，第二步通过文本生成文字回复。
         # origin_ctype用于第二步文本回复时，判断是否需要匹配前缀，如果是私聊的语音，就不需要匹配前缀
@@ -46,32 +51,17 @@ class ChatChannel(Channel):
         first_in = "receiver" not in context
         # 群名匹配过程，设置session_id和receiver
         if first_in:  # context首次传入时，receiver是None，根据类型设置receiver
-            config = conf()
             cmsg = context["msg"]
-            user_data = conf().get_user_data(cmsg.from_user_id)
+            user_data = matcher.config.get_user_data(cmsg.from_user_id)
             context["openai_api_key"] = user_data.get("openai_api_key")
             context["gpt_model"] = user_data.get("gpt_model")
             if context.get("isgroup", False):
                 group_name = cmsg.other_user_nickname
                 group_id = cmsg.other_user_id
 
-                group_name_white_list = config.get("group_name_white_list", [])
-                group_name_keyword_white_list = config.get("group_name_keyword_white_list", [])
-                if any(
-                    [
-                        group_name in group_name_white_list,
-                        "ALL_GROUP" in group_name_white_list,
-                        check_contain(group_name, group_name_keyword_white_list),
-                    ]
-                ):
-                    group_chat_in_one_session = conf().get("group_chat_in_one_session", [])
+                if matcher.is_group_allowed(group_name):
                     session_id = cmsg.actual_user_id
-                    if any(
-                        [
-                            group_name in group_chat_in_one_session,
-                            "ALL_GROUP" in group_chat_in_one_session,
-                        ]
-                    ):
+                    if matcher.is_group_in_one_session(group_name):
                         session_id = group_id
                 else:
                     logger.debug(f"No need reply, groupName not in whitelist, group_name={group_name}")
@@ -85,7 +75,7 @@ class ChatChannel(Channel):
             context = e_context["context"]
             if e_context.is_pass() or context is None:
                 return context
-            if cmsg.from_user_id == self.user_id and not config.get("trigger_by_self", True):
+            if cmsg.from_user_id == self.user_id and not matcher.trigger_by_self:
                 logger.debug("[chat_channel]self message skipped")
                 return None
 
@@ -96,11 +86,10 @@ class ChatChannel(Channel):
                 logger.debug("[chat_channel]reference query skipped")
                 return None
 
-            nick_name_black_list = conf().get("nick_name_black_list", [])
             if context.get("isgroup", False):  # 群聊
                 # 校验关键字
-                match_prefix = check_prefix(content, conf().get("group_chat_prefix"))
-                match_contain = check_contain(content, conf().get("group_chat_keyword"))
+                match_prefix = matcher.match_group_chat_prefix(content)
+                match_contain = matcher.contain_group_chat_keyword(content)
                 flag = False
                 if context["msg"].to_user_id != context["msg"].actual_user_id:
                     if match_prefix is not None or match_contain is not None:
@@ -109,25 +98,22 @@ class ChatChannel(Channel):
                             content = content.replace(match_prefix, "", 1).strip()
                     if context["msg"].is_at:
                         nick_name = context["msg"].actual_user_nickname
-                        if nick_name and nick_name in nick_name_black_list:
+                        if matcher.is_nick_name_blocked(nick_name):
                             # 黑名单过滤
                             logger.warning(f"[chat_channel] Nickname {nick_name} in In BlackList, ignore")
                             return None
 
                         logger.info("[chat_channel]receive group at")
-                        if not conf().get("group_at_off", False):
+                        if not matcher.group_at_off:
                             flag = True
                         self.name = self.name if self.name is not None else ""  # 部分渠道self.name可能没有赋值
-                        pattern = f"@{re.escape(self.name)}(\u2005|\u0020)"
-                        subtract_res = re.sub(pattern, r"", content)
+                        subtract_res = mention_pattern(self.name).sub(r"", content)
                         if isinstance(context["msg"].at_list, list):
                             for at in context["msg"].at_list:
-                                pattern = f"@{re.escape(at)}(\u2005|\u0020)"
-                                subtract_res = re.sub(pattern, r"", subtract_res)
+                                subtract_res = mention_pattern(at).sub(r"", subtract_res)
                         if subtract_res == content and context["msg"].self_display_name:
                             # 前缀移除后没有变化，使用群昵称再次移除
-                            pattern = f"@{re.escape(context['msg'].self_display_name)}(\u2005|\u0020)"
-                            subtract_res = re.sub(pattern, r"", content)
+                            subtract_res = mention_pattern(context["msg"].self_display_name).sub(r"", content)
                         content = subtract_res
                 if not flag:
                     if context["origin_ctype"] == ContextType.VOICE:
@@ -135,12 +121,12 @@ class ChatChannel(Channel):
                     return None
             else:  # 单聊
                 nick_name = context["msg"].from_user_nickname
-                if nick_name and nick_name in nick_name_black_list:
+                if matcher.is_nick_name_blocked(nick_name):
                     # 黑名单过滤
                     logger.warning(f"[chat_channel] Nickname '{nick_name}' in In BlackList, ignore")
                     return None
 
-                match_prefix = check_prefix(content, conf().get("single_chat_prefix", [""]))
+                match_prefix = matcher.match_single_chat_prefix(content)
                 if match_prefix is not None:  # 判断如果匹配到自定义前缀，则返回过滤掉前缀+空格后的内容
                     content = content.replace(match_prefix, "", 1).strip()
                 elif context["origin_ctype"] == ContextType.VOICE:  # 如果源消息是私聊的语音消息，允许不匹配前缀，放宽条件
@@ -148,7 +134,7 @@ class ChatChannel(Channel):
                 else:
                     return None
             content = content.strip()
-            img_match_prefix = check_prefix(content, conf().get("image_create_prefix",[""]))
+            img_match_prefix = matcher.match_image_create_prefix(content)
             if img_match_prefix:
                 content = content.replace(img_match_prefix, "", 1)
                 context.type = ContextType.IMAGE_CREATE
@@ -162,76 +148,126 @@ class ChatChannel(Channel):
                 context["desire_rtype"] = ReplyType.VOICE
         return context
 
+    # 消息处理流水线：compose(插件分发) -> generate(调用模型) -> decorate(装饰回复/语音合成) -> send(发送回复)
+    # 每个阶段在各自的线程池中执行，耗时的模型调用不会阻塞#管理指令、关键词回复等廉价任务
+    # 每个阶段返回下一阶段 (线程池名称, 处理函数, 参数)，返回None表示处理结束
     def _handle(self, context: Context):
         if context is None or not context.content:
             return
         logger.debug("[chat_channel] ready to handle context: {}".format(context))
+        e_context = self._emit_handle_context(context, Reply())
+        if e_context.is_pass():
+            return "decorate", self._handle_decorate, (context, e_context["reply"])
+        if context.type in [ContextType.TEXT, ContextType.IMAGE_CREATE, ContextType.VOICE]:
+            return "generate", self._handle_generate, (context, e_context)
+        return self._handle_generate(context, e_context)
+
+    def _handle_generate(self, context: Context, e_context: EventContext):
         # reply的构建步骤
-        reply = self._generate_reply(context)
+        reply = self._build_reply(context, e_context)
+        return "decorate", self._handle_decorate, (context, reply)
 
+    def _handle_decorate(self, context: Context, reply: Reply):
         logger.debug("[chat_channel] ready to decorate reply: {}".format(reply))
-
+        if not reply or not reply.content:
+            return
         # reply的包装步骤
-        if reply and reply.content:
-            reply = self._decorate_reply(context, reply)
-
-            # reply的发送步骤
-            self._send_reply(context, reply)
+        reply = self._decorate_reply(context, reply)
+        if reply and reply.type == ReplyType.TEXT_STREAM:
+            # 流式回复在发送时才真正调用模型，放在generate线程池中执行
+            return "generate", self._send_reply, (context, reply)
+        # reply的发送步骤
+        return "send", self._send_reply, (context, reply)
+
+    def _submit_handle(self, context: Context) -> Future:
+        future = Future()
+        get_worker_pool("compose").submit(self._run_stage, future, self._handle, (context,))
+        return future
+
+    def _run_stage(self, future: Future, func, args):
+        if not future.running() and not future.set_running_or_notify_cancel():
+            return  # 排队时已被取消
+        try:
+            next_stage = func(*args)
+            if next_stage:
+                pool_name, next_func, next_args = next_stage
+                get_worker_pool(pool_name).submit(self._run_stage, future, next_func, next_args)
+            else:
+                future.set_result(None)
+        except BaseException as e:
+            future.set_exception(e)
 
-    def _generate_reply(self, context: Context, reply: Reply = Reply()) -> Reply:
-        e_context = PluginManager().emit_event(
+    def _emit_handle_context(self, context: Context, reply: Reply) -> EventContext:
+        return PluginManager().emit_event(
             EventContext(
                 Event.ON_HANDLE_CONTEXT,
                 {"channel": self, "context": context, "reply": reply},
             )
         )
+
+    def _generate_reply(self, context: Context, reply: Reply = Reply()) -> Reply:
+        e_context = self._emit_handle_context(context, reply)
         reply = e_context["reply"]
         if not e_context.is_pass():
-            logger.debug("[chat_channel] ready to handle context: type={}, content={}".format(context.type, context.content))
-            if context.type == ContextType.TEXT or context.type == ContextType.IMAGE_CREATE:  # 文字和图片消息
-                context["channel"] = e_context["channel"]
-                reply = super().build_reply_content(context.content, context)
-            elif context.type == ContextType.VOICE:  # 语音消息
-                cmsg = context["msg"]
-                cmsg.prepare()
-                file_path = context.content
-                wav_path = os.path.splitext(file_path)[0] + ".wav"
-                try:
-                    any_to_wav(file_path, wav_path)
-                except Exception as e:  # 转换失败，直接使用mp3，对于某些api，mp3也可以识别
-                    logger.warning("[chat_channel]any to wav error, use raw path. " + str(e))
-                    wav_path = file_path
-                # 语音识别
-                reply = super().build_voice_to_text(wav_path)
-                # 删除临时文件
-                try:
-                    os.remove(file_path)
-                    if wav_path != file_path:
-                        os.remove(wav_path)
-                except Exception as e:
-                    pass
-                    # logger.warning("[chat_channel]delete temp file error: " + str(e))
+            reply = self._build_reply(context, e_context)
+        return reply
 
-                if reply.type == ReplyType.TEXT:
-                    new_context = self._compose_context(ContextType.TEXT, reply.content, **context.kwargs)
-                    if new_context:
-                        reply = self._generate_reply(new_context)
-                    else:
-                        return
-            elif context.type == ContextType.IMAGE:  # 图片消息，当前仅做下载保存到本地的逻辑
-                memory.USER_IMAGE_CACHE[context["session_id"]] = {
-                    "path": context.content,
-                    "msg": context.get("msg")
-                }
-            elif context.type == ContextType.SHARING:  # 分享信息，当前无默认逻辑
-                pass
-            elif context.type == ContextType.FUNCTION or context.type == ContextType.FILE:  # 文件消息及函数调用等，当前无默认逻辑
+    # 插件未拦截时的默认回复逻辑
+    def _build_reply(self, context: Context, e_context: EventContext) -> Reply:
+        reply = e_context["reply"]
+        logger.debug("[chat_channel] ready to handle context: type={}, content={}".format(context.type, context.content))
+        if context.type == ContextType.TEXT or context.type == ContextType.IMAGE_CREATE:  # 文字和图片消息
+            context["channel"] = e_context["channel"]
+            if context.type == ContextType.TEXT and self._stream_reply_enabled(context):
+                context["stream"] = True
+            reply = super().build_reply_content(context.content, context)
+        elif context.type == ContextType.VOICE:  # 语音消息
+            cmsg = context["msg"]
+            cmsg.prepare()
+            file_path = context.content
+            wav_path = os.path.splitext(file_path)[0] + ".wav"
+            try:
+                any_to_wav(file_path, wav_path)
+            except Exception as e:  # 转换失败，直接使用mp3，对于某些api，mp3也可以识别
+                logger.warning("[chat_channel]any to wav error, use raw path. " + str(e))
+                wav_path = file_path
+            # 语音识别
+            reply = super().build_voice_to_text(wav_path)
+            # 删除临时文件
+            try:
+                os.remove(file_path)
+                if wav_path != file_path:
+                    os.remove(wav_path)
+            except Exception as e:
                 pass
-            else:
-                logger.warning("[chat_channel] unknown context type: {}".format(context.type))
-                return
+                # logger.warning("[chat_channel]delete temp file error: " + str(e))
+
+            if reply.type == ReplyType.TEXT:
+                new_context = self._compose_context(ContextType.TEXT, reply.content, **context.kwargs)
+                if new_context:
+                    reply = self._generate_reply(new_context)
+                else:
+                    return
+        elif context.type == ContextType.IMAGE:  # 图片消息，当前仅做下载保存到本地的逻辑
+            memory.USER_IMAGE_CACHE[context["session_id"]] = {
+                "path": context.content,
+                "msg": context.get("msg")
+            }
+        elif context.type == ContextType.SHARING:  # 分享信息，当前无默认逻辑
+            pass
+        elif context.type == ContextType.FUNCTION or context.type == ContextType.FILE:  # 文件消息及函数调用等，当前无默认逻辑
+            pass
+        else:
+            logger.warning("[chat_channel] unknown context type: {}".format(context.type))
+            return
         return reply
 
+    def _stream_reply_enabled(self, context: Context) -> bool:
+        if not conf().get("stream_reply") or not self.SUPPORT_STREAM_REPLY:
+            return False
+        # 需要语音回复时要拿到完整文本再合成语音
+        return context.get("desire_rtype") != ReplyType.VOICE
+
     def _decorate_reply(self, context: Context, reply: Reply) -> Reply:
         if reply and reply.type:
             e_context = PluginManager().emit_event(
@@ -260,6 +296,17 @@ class ChatChannel(Channel):
                     else:
                         reply_text = conf().get("single_chat_reply_prefix", "") + reply_text + conf().get("single_chat_reply_suffix", "")
                     reply.content = reply_text
+                elif reply.type == ReplyType.TEXT_STREAM:
+                    if context.get("isgroup", False):
+                        prefix = conf().get("group_chat_reply_prefix", "")
+                        if not context.get("no_need_at", False):
+                            prefix += "@" + context["msg"].actual_user_nickname + "\n"
+                        suffix = conf().get("group_chat_reply_suffix", "")
+                    else:
+                        prefix = conf().get("single_chat_reply_prefix", "")
+                        suffix = conf().get("single_chat_reply_suffix", "")
+                    if prefix or suffix:
+                        reply.content = _wrap_stream(prefix, reply.content, suffix)
                 elif reply.type == ReplyType.ERROR or reply.type == ReplyType.INFO:
                     reply.content = "[" + str(reply.type) + "]\n" + reply.content
                 elif reply.type == ReplyType.IMAGE_URL or reply.type == ReplyType.VOICE or reply.type == ReplyType.IMAGE or reply.type == ReplyType.FILE or reply.type == ReplyType.VIDEO or reply.type == ReplyType.VIDEO_URL:
@@ -315,10 +362,27 @@ class ChatChannel(Channel):
             except Exception as e:
                 logger.exception("Worker raise exception: {}".format(e))
             with self.lock:
-                self.sessions[session_id][1].release()
+                context_queue, semaphore = self.sessions[session_id]
+                semaphore.release()
+                if session_id in self.futures:
+                    self.futures[session_id] = [t for t in self.futures[session_id] if not t.done()]
+                if not context_queue.empty():
+                    # 释放了并发名额且还有排队的消息，重新放回可运行队列
+                    self._mark_ready(session_id)
+                elif semaphore._initial_value == semaphore._value:  # 没有排队的消息，也没有处理中的任务，清理session
+                    assert not self.futures.get(session_id), "thread pool error"
+                    self.futures.pop(session_id, None)
+                    del self.sessions[session_id]
 
         return func
 
+    # 调用方需持有self.lock
+    def _mark_ready(self, session_id):
+        if session_id not in self.ready_set:
+            self.ready_set.add(session_id)
+            self.ready_sessions.append(session_id)
+            self.ready_cond.notify()
+
     def produce(self, context: Context):
         session_id = context["session_id"]
         with self.lock:
@@ -331,54 +395,63 @@ class ChatChannel(Channel):
                 self.sessions[session_id][0].putleft(context)  # 优先处理管理命令
             else:
                 self.sessions[session_id][0].put(context)
+            self._mark_ready(session_id)
 
-    # 消费者函数，单独线程，用于从消息队列中取出消息并处理
+    # 消费者函数，单独线程，等待可运行的session并把消息提交到线程池
     def consume(self):
         while True:
             with self.lock:
-                session_ids = list(self.sessions.keys())
-            for session_id in session_ids:
-                with self.lock:
-                    context_queue, semaphore = self.sessions[session_id]
-                if semaphore.acquire(blocking=False):  # 等线程处理完毕才能删除
-                    if not context_queue.empty():
-                        context = context_queue.get()
-                        logger.debug("[chat_channel] consume context: {}".format(context))
-                        future: Future = handler_pool.submit(self._handle, context)
-                        future.add_done_callback(self._thread_pool_callback(session_id, context=context))
-                        with self.lock:
-                            if session_id not in self.futures:
-                                self.futures[session_id] = []
-                            self.futures[session_id].append(future)
-                    elif semaphore._initial_value == semaphore._value + 1:  # 除了当前，没有任务再申请到信号量，说明所有任务都处理完毕
-                        with self.lock:
-                            self.futures[session_id] = [t for t in self.futures[session_id] if not t.done()]
-                            assert len(self.futures[session_id]) == 0, "thread pool error"
-                            del self.sessions[session_id]
-                    else:
-                        semaphore.release()
-            time.sleep(0.2)
+                while not self.ready_sessions:
+                    self.ready_cond.wait()
+                session_id = self.ready_sessions.popleft()
+                self.ready_set.discard(session_id)
+                if session_id not in self.sessions:
+                    continue
+                context_queue, semaphore = self.sessions[session_id]
+                if not semaphore.acquire(blocking=False):  # 并发名额已满，等任务结束时由回调重新放回队列
+                    continue
+                if context_queue.empty():  # 消息已被取消
+                    semaphore.release()
+                    if semaphore._initial_value == semaphore._value and not self.futures.get(session_id):
+                        self.futures.pop(session_id, None)
+                        del self.sessions[session_id]
+                    continue
+                context = context_queue.get()
+                if not context_queue.empty():  # 还有排队的消息，可能还有空闲的并发名额
+                    self._mark_ready(session_id)
+            logger.debug("[chat_channel] consume context: {}".format(context))
+            future: Future = self._submit_handle(context)
+            with self.lock:
+                if session_id not in self.futures:
+                    self.futures[session_id] = []
+                self.futures[session_id].append(future)
+            future.add_done_callback(self._thread_pool_callback(session_id, context=context))
 
     # 取消session_id对应的所有任务，只能取消排队的消息和已提交线程池但未执行的任务
     def cancel_session(self, session_id):
         with self.lock:
+            futures = []
             if session_id in self.sessions:
-                for future in self.futures[session_id]:
-                    future.cancel()
+                futures = list(self.futures.get(session_id, []))
                 cnt = self.sessions[session_id][0].qsize()
                 if cnt > 0:
                     logger.info("Cancel {} messages in session {}".format(cnt, session_id))
                 self.sessions[session_id][0] = Dequeue()
+        # future.cancel()会同步触发回调，回调中需要获取self.lock，因此在锁外取消
+        for future in futures:
+            future.cancel()
 
     def cancel_all_session(self):
         with self.lock:
+            futures = []
             for session_id in self.sessions:
-                for future in self.futures[session_id]:
-                    future.cancel()
+                futures.extend(self.futures.get(session_id, []))
                 cnt = self.sessions[session_id][0].qsize()
                 if cnt > 0:
                     logger.info("Cancel {} messages in session {}".format(cnt, session_id))
                 self.sessions[session_id][0] = Dequeue()
+        for future in futures:
+            future.cancel()
 
 
 def check_prefix(content, prefix_list):
@@ -397,3 +470,12 @@ def check_contain(content, keyword_list):
         if content.find(ky) != -1:
             return True
     return None
+
+
+def _wrap_stream(prefix, stream, suffix):
+    # 给流式回复加上前后缀
+    if prefix:
+        yield prefix
+    yield from stream
+    if suffix:
+        yield suffix
@@ -1,10 +1,9 @@
 from bridge.context import ContextType
 from channel.chat_message import ChatMessage
 import json
-import requests
 from common.log import logger
 from common.tmp_dir import TmpDir
-from common import utils
+from common import http_client, utils
 
 
 class FeishuMessage(ChatMessage):
@@ -39,7 +38,7 @@ class FeishuMessage(ChatMessage):
                 params = {
                     "type": "file"
                 }
-                response = requests.get(url=url, headers=headers, params=params)
+                response = http_client.get(url=url, headers=headers, params=params)
                 if response.status_code == 200:
                     with open(self.content, "wb") as f:
                         f.write(response.content)
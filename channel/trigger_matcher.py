@@ -0,0 +1,116 @@
+import re
+import threading
+from functools import lru_cache
+
+from common.log import logger
+from config import conf
+
+
+def _compile_alternation(words):
+    """
+    把词列表编译为一个正则，列表为空时返回None
+    正则的分支按列表顺序尝试，match返回的是列表中第一个匹配的前缀，与逐个startswith的结果一致
+    """
+    if not words:
+        return None
+    return re.compile("|".join(re.escape(word) for word in words))
+
+
+@lru_cache(maxsize=1024)
+def mention_pattern(name):
+    """
+    @某人 的正则，按名称缓存编译结果(机器人名称、群昵称和@列表中的名称)
+    """
+    return re.compile(f"@{re.escape(name)}(\u2005|\u0020)")
+
+
+class TriggerMatcher:
+    """
+    消息触发规则的匹配器，在配置加载或修改后构建一次
+    - 前缀、关键词列表各编译为一个正则，匹配时只需一次调用
+    - 群名称白名单、会话共享群、昵称黑名单转为集合
+    配置对象被替换(#reconf/load_config)或配置项被修改后，get_trigger_matcher会构建新的匹配器整体替换，
+    正在处理的消息继续使用旧匹配器，不会读到构建了一半的规则
+    注意：直接修改配置中的列表(如append)不会触发重建
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.version = config.version
+        self.single_chat_prefix = _compile_alternation(config.get("single_chat_prefix", [""]))
+        self.group_chat_prefix = _compile_alternation(config.get("group_chat_prefix"))
+        self.group_chat_keyword = _compile_alternation(config.get("group_chat_keyword"))
+        self.image_create_prefix = _compile_alternation(config.get("image_create_prefix", [""]))
+        self.group_name_keyword_white_list = _compile_alternation(config.get("group_name_keyword_white_list", []))
+        group_name_white_list = config.get("group_name_white_list", [])
+        self.all_group = "ALL_GROUP" in group_name_white_list
+        self.group_name_white_list = frozenset(group_name_white_list)
+        group_chat_in_one_session = config.get("group_chat_in_one_session", [])
+        self.all_group_in_one_session = "ALL_GROUP" in group_chat_in_one_session
+        self.group_chat_in_one_session = frozenset(group_chat_in_one_session)
+        self.nick_name_black_list = frozenset(config.get("nick_name_black_list", []))
+        self.group_at_off = config.get("group_at_off", False)
+        self.trigger_by_self = config.get("trigger_by_self", True)
+
+    def is_current(self, config) -> bool:
+        return self.config is config and self.version == config.version
+
+    @staticmethod
+    def _match_prefix(pattern, content):
+        if pattern is None:
+            return None
+        match = pattern.match(content)
+        return match.group() if match else None
+
+    @staticmethod
+    def _contains(pattern, content):
+        if pattern is None:
+            return None
+        return True if pattern.search(content) else None
+
+    # 以下方法的返回值与chat_channel中的check_prefix/check_contain一致
+    def match_single_chat_prefix(self, content):
+        return self._match_prefix(self.single_chat_prefix, content)
+
+    def match_group_chat_prefix(self, content):
+        return self._match_prefix(self.group_chat_prefix, content)
+
+    def match_image_create_prefix(self, content):
+        return self._match_prefix(self.image_create_prefix, content)
+
+    def contain_group_chat_keyword(self, content):
+        return self._contains(self.group_chat_keyword, content)
+
+    def is_group_allowed(self, group_name) -> bool:
+        return (
+            self.all_group
+            or group_name in self.group_name_white_list
+            or bool(self._contains(self.group_name_keyword_white_list, group_name))
+        )
+
+    def is_group_in_one_session(self, group_name) -> bool:
+        return self.all_group_in_one_session or group_name in self.group_chat_in_one_session
+
+    def is_nick_name_blocked(self, nick_name) -> bool:
+        return bool(nick_name) and nick_name in self.nick_name_black_list
+
+
+_matcher = None
+_matcher_lock = threading.Lock()
+
+
+def get_trigger_matcher() -> TriggerMatcher:
+    """
+    获取当前配置对应的匹配器，配置重载或修改后首次调用时重建
+    """
+    global _matcher
+    config = conf()
+    matcher = _matcher
+    if matcher is None or not matcher.is_current(config):
+        with _matcher_lock:
+            matcher = _matcher
+            if matcher is None or not matcher.is_current(config):
+                matcher = TriggerMatcher(config)
+                _matcher = matcher
+                logger.debug("[trigger_matcher] rebuild trigger matcher, config version={}".format(config.version))
+    return matcher
@@ -14,7 +14,7 @@ import requests
 from bridge.context import *
 from bridge.reply import *
 from channel.chat_channel import ChatChannel
-from channel import chat_channel
+from common import worker_pool
 from channel.wechat.wechat_message import *
 from common.expired_dict import ExpiredDict
 from common.log import logger
@@ -155,7 +155,8 @@ class WechatChannel(ChatChannel):
                 time.sleep(2)
                 self.auto_login_times += 1
                 if self.auto_login_times < 100:
-                    chat_channel.handler_pool._shutdown = False
+                    for pool in worker_pool.get_worker_pools().values():
+                        pool._shutdown = False
                     self.startup()
         except Exception as e:
             pass
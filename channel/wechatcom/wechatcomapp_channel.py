@@ -6,9 +6,7 @@ import time
 import re
 import threading
 from PIL import Image
-from paddleocr import PaddleOCR
 
-import requests
 import web
 from wechatpy.enterprise import create_reply, parse_message
 from wechatpy.enterprise.crypto import WeChatCrypto
@@ -18,27 +16,27 @@ from wechatpy.exceptions import InvalidSignatureException, WeChatClientException
 from bridge.context import Context
 from bridge.reply import Reply, ReplyType
 from cache import cache
-from channel.chat_channel import ChatChannel
+from channel.async_chat_channel import AsyncChatChannel
 from channel.wechatcom.wechatcomapp_client import WechatComAppClient
 from channel.wechatcom.wechatcomapp_message import WechatComAppMessage
+from common import http_client
 from common.log import logger
+from common.sentence_segmenter import SentenceSegmenter
 from common.singleton import singleton
 from common.utils import compress_imgfile, fsize, split_string_by_utf8_length, convert_webp_to_png, remove_markdown_symbol
 from config import conf, subscribe_msg
-from voice.audio_convert import any_to_amr, split_audio
+from service.ocr_service import OcrQueueFullError, get_ocr_service
+from voice.audio_convert import transcode
+from voice.tts_cache import get_tts_cache
 from xml.etree import ElementTree
 from common.tmp_dir import TmpDir  # 添加 TmpDir 导入
 
 MAX_UTF8_LEN = 2048
 
-# 修改OCR初始化，使用更轻量级的配置
-ocr = PaddleOCR(use_angle_cls=False, lang='ch', use_gpu=False, enable_mkldnn=False, 
-                cpu_threads=2, det_model_dir=None, rec_model_dir=None, 
-                det_limit_side_len=960, det_db_thresh=0.3, det_db_box_thresh=0.5)
-
 @singleton
-class WechatComAppChannel(ChatChannel):
+class WechatComAppChannel(AsyncChatChannel):
     NOT_SUPPORT_REPLYTYPE = []
+    SUPPORT_STREAM_REPLY = True
 
     def __init__(self):
         super().__init__()
@@ -66,10 +64,15 @@ class WechatComAppChannel(ChatChannel):
             # 使用客服消息发送方法
             user_id = context['reply_callback']['user_id']
             open_kf_id = context['reply_callback']['open_kf_id']
-            if reply.type in [ReplyType.TEXT, ReplyType.ERROR, ReplyType.INFO]:
+            if reply.type == ReplyType.TEXT_STREAM:
+                self._send_text_stream(reply.content, lambda text: self.send_kf_message(open_kf_id, user_id, "text", text))
+            elif reply.type in [ReplyType.TEXT, ReplyType.ERROR, ReplyType.INFO]:
                 self.send_kf_message(open_kf_id, user_id, "text", reply.content)
             return
-        if reply.type in [ReplyType.TEXT, ReplyType.ERROR, ReplyType.INFO]:
+        if reply.type == ReplyType.TEXT_STREAM:
+            reply_text = self._send_text_stream(reply.content, lambda text: self.client.message.send_text(self.agent_id, receiver, text))
+            logger.info("[wechatcom] Do send text stream to {}: {}".format(receiver, reply_text))
+        elif reply.type in [ReplyType.TEXT, ReplyType.ERROR, ReplyType.INFO]:
             reply_text = remove_markdown_symbol(reply.content)
             texts = split_string_by_utf8_length(reply_text, MAX_UTF8_LEN)
             if len(texts) > 1:
@@ -83,22 +86,27 @@ class WechatComAppChannel(ChatChannel):
             try:
                 media_ids = []
                 file_path = reply.content
-                amr_file = os.path.splitext(file_path)[0] + ".amr"
-                any_to_amr(file_path, amr_file)
-                duration, files = split_audio(amr_file, 60 * 1000)
-                if len(files) > 1:
-                    logger.info("[wechatcom] voice too long {}s > 60s , split into {} parts".format(duration / 1000.0, len(files)))
-                for path in files:
-                    response = self.client.media.upload("voice", open(path, "rb"))
-                    logger.debug("[wechatcom] upload voice response: {}".format(response))
-                    media_ids.append(response["media_id"])
+                file_prefix = os.path.splitext(os.path.basename(file_path))[0]
+                # 解码一次，转成amr并按60s切分，各段在内存中直接上传
+                duration, segments = transcode(file_path, "amr", frame_rate=8000, max_segment_length_ms=60 * 1000)
+                if len(segments) > 1:
+                    logger.info("[wechatcom] voice too long {}s > 60s , split into {} parts".format(duration / 1000.0, len(segments)))
+                tts_cache = get_tts_cache()
+                for i, data in enumerate(segments):
+                    # 缓存的语音合成结果内容相同，有效期内复用已上传的临时素材
+                    media_id = tts_cache.get_media_id("wechatcom", data) if tts_cache else None
+                    if not media_id:
+                        response = self.client.media.upload("voice", ("{}_{}.amr".format(file_prefix, i + 1), io.BytesIO(data), "audio/amr"))
+                        logger.debug("[wechatcom] upload voice response: {}".format(response))
+                        media_id = response["media_id"]
+                        if tts_cache:
+                            tts_cache.set_media_id("wechatcom", data, media_id)
+                    media_ids.append(media_id)
             except WeChatClientException as e:
                 logger.error("[wechatcom] upload voice failed: {}".format(e))
                 return
             try:
                 os.remove(file_path)
-                if amr_file != file_path:
-                    os.remove(amr_file)
             except Exception:
                 pass
             for media_id in media_ids:
@@ -107,7 +115,7 @@ class WechatComAppChannel(ChatChannel):
             logger.info("[wechatcom] sendVoice={}, receiver={}".format(reply.content, receiver))
         elif reply.type == ReplyType.IMAGE_URL:  # 从网络下载图片
             img_url = reply.content
-            pic_res = requests.get(img_url, stream=True)
+            pic_res = http_client.get(img_url, stream=True)
             image_storage = io.BytesIO()
             for block in pic_res.iter_content(1024):
                 image_storage.write(block)
@@ -149,6 +157,22 @@ class WechatComAppChannel(ChatChannel):
             self.client.message.send_image(self.agent_id, receiver, response["media_id"])
             logger.info("[wechatcom] sendImage, receiver={}".format(receiver))
 
+    def _send_text_stream(self, stream, send_func):
+        """
+        边接收模型的增量回复边按句发送
+        :param send_func: 发送单条文本的函数
+        :return: 完整的回复文本
+        """
+        segmenter = SentenceSegmenter(conf().get("stream_reply_min_len", 10), MAX_UTF8_LEN)
+        reply_text = ""
+        for delta in stream:
+            reply_text += delta
+            for segment in segmenter.feed(delta):
+                send_func(remove_markdown_symbol(segment))
+        for segment in segmenter.flush():
+            send_func(remove_markdown_symbol(segment))
+        return reply_text
+
     def sync_kf_message(self, open_kfid, token):
         access_token = self.client.access_token  # 获取有效的 access_token
         url = f"https://qyapi.weixin.qq.com/cgi-bin/kf/sync_msg?access_token={access_token}"
@@ -161,7 +185,7 @@ class WechatComAppChannel(ChatChannel):
             payload['cursor'] = cursor
 
         try:
-            response = requests.post(url, headers={"Content-Type": "application/json"}, data=json.dumps(payload))
+            response = http_client.post(url, headers={"Content-Type": "application/json"}, data=json.dumps(payload))
             return response.json() if response.status_code == 200 else None
         except Exception as e:
             logger.error(f"[wechatcom] sync_kf_message error: {e}")
@@ -180,7 +204,7 @@ class WechatComAppChannel(ChatChannel):
         # 可以根据需要添加其他消息类型
 
         try:
-            response = requests.post(url, json=payload)
+            response = http_client.post(url, json=payload)
             result = response.json()
             if result.get("errcode") != 0:
                 logger.error(f"[wechatcom] send_kf_message error: {result}")
@@ -202,6 +226,7 @@ class WechatComAppChannel(ChatChannel):
             
             # 下载图片 - 参考 WechatComAppMessage 中的下载方式
             image_path = TmpDir().path() + media_id + ".png"
+            download_path = image_path
             
             # 使用与 WechatComAppMessage 相同的下载方式
             try:
@@ -266,15 +291,29 @@ class WechatComAppChannel(ChatChannel):
                 logger.error(f"[wechatcom] 压缩图片异常: {str(e)}")
                 # 继续使用原始图片
             
-            # 调用OCR服务识别图片中的文字
+            # 调用OCR服务识别图片中的文字，队列已满时直接告知用户
+            ocr_service = get_ocr_service()
+            try:
+                estimated_wait = ocr_service.estimate_wait()
+                future = ocr_service.submit(image_path)
+            except OcrQueueFullError as e:
+                logger.warning(f"[wechatcom] {e}")
+                self._send_ocr_notice("现在分析图片的人太多啦，请稍后再发一次。", from_user_id, agent_id, open_kf_id, external_userid)
+                self._remove_tmp_files(download_path, image_path)
+                return
+
+            # 先发送一条消息安抚用户
+            self._send_ocr_notice(f"已收到您的图片，正在分析中，预计需要{int(estimated_wait) + 1}秒左右...", from_user_id, agent_id, open_kf_id, external_userid)
             try:
                 logger.info("[wechatcom] 开始OCR识别")
-                # 使用更低内存的方式调用OCR
-                result = ocr.ocr(image_path, cls=False)
+                result = future.result()
                 logger.info(f"[wechatcom] OCR识别完成")
             except Exception as e:
                 logger.error(f"[wechatcom] OCR识别异常: {str(e)}")
                 return
+            finally:
+                # 识别结束后图片不再需要，清理临时文件
+                self._remove_tmp_files(download_path, image_path)
             
             if not result or len(result) == 0 or not result[0]:
                 logger.error("[wechatcom] OCR结果为空")
@@ -295,13 +334,6 @@ class WechatComAppChannel(ChatChannel):
             # 构建提示信息，告诉AI这是聊天记录
             prompt = f"以下是一段微信聊天记录截图中提取的文本，请帮我分析并解读对话内容，理清对话的逻辑和情感：\n\n{chat_history}"
             
-            # 清理临时文件
-            try:
-                if os.path.exists(image_path):
-                    os.remove(image_path)
-            except Exception as e:
-                logger.error(f"[wechatcom] 删除临时文件异常: {str(e)}")
-            
             # 确保有 agent_id
             if not agent_id:
                 agent_id = self.agent_id
@@ -353,6 +385,10 @@ class WechatComAppChannel(ChatChannel):
                     # 如果不是客服消息，使用普通的会话ID
                     context['session_id'] = f"user_{from_user_id}"
                     context['receiver'] = from_user_id
+                # 同一张聊天记录截图的识别结果相同，允许直接返回缓存的分析结果
+                # 分析结果只取决于截图中的聊天记录，缓存key不包含会话历史，会话中重复发送同一张截图也能命中
+                context['reply_cache'] = True
+                context['reply_cache_ignore_history'] = True
                 
                 # 将消息传递给AI处理
                 logger.info(f"[wechatcom] 将OCR识别的聊天记录传递给AI处理")
@@ -365,6 +401,24 @@ class WechatComAppChannel(ChatChannel):
             logger.error(f"OCR处理异常: {str(e)}")
             logger.error(f"异常堆栈: {traceback.format_exc()}")
 
+    def _send_ocr_notice(self, text, from_user_id, agent_id, open_kf_id=None, external_userid=None):
+        """发送图片分析过程中的提示消息，客服消息通过客服接口发送"""
+        try:
+            if open_kf_id and external_userid:
+                self.send_kf_message(open_kf_id, external_userid, "text", text)
+            else:
+                self.client.message.send_text(agent_id or self.agent_id or conf().get("wechatcomapp_agent_id"), from_user_id, text)
+        except Exception as e:
+            logger.error(f"[wechatcom] 发送提示消息异常: {str(e)}")
+
+    def _remove_tmp_files(self, *paths):
+        for path in set(paths):
+            try:
+                if path and os.path.exists(path):
+                    os.remove(path)
+            except Exception as e:
+                logger.error(f"[wechatcom] 删除临时文件异常: {str(e)}")
+
     def _organize_chat_history(self, ocr_result):
         """整理OCR识别出的聊天记录"""
         try:
@@ -21,7 +21,8 @@ from db.mysql.dao import notify_dao, user_dao, dialog_dao
 
 
 def handle_message(message, channel):
-    user = user_dao.get_user_by_openid(message.source)
+    # 用户信息和问候/等待提醒需要的对话状态一次查询获取
+    user, has_recent_dialog, has_unreply_dialog = user_dao.get_user_with_dialog_flags(message.source)
 
     if user.privacy_status == 0:
         privacy_messages = [
@@ -32,17 +33,16 @@ def handle_message(message, channel):
             channel._send_text_message(user.openid, privacy_msg)
             
     elif user.privacy_status == 1:
-        do_handle_message(message, channel)
+        do_handle_message(message, channel, user, has_recent_dialog, has_unreply_dialog)
     elif user.privacy_status == 2:
-        do_handle_message(message, channel)
+        do_handle_message(message, channel, user, has_recent_dialog, has_unreply_dialog)
 
 
-def do_handle_message(message, channel):
+def do_handle_message(message, channel, user, has_recent_dialog=None, has_unreply_dialog=None):
     wechatmp_msg = WeChatMPMessage(message, client=channel.client)
-    user = user_dao.get_user_by_openid(wechatmp_msg.from_user_id)
     chat_history = dialog_dao.get_replied_dialog(user.id)
-    hello_notify(user, channel)
-    wait_notify(user, channel)
+    hello_notify(user, channel, has_dialog=has_recent_dialog)
+    wait_notify(user, channel, has_unreply_dialog=has_unreply_dialog)
 
     # 插入对话记录并获取dialog
     dialog = dialog_dao.insert_dialog(user.id, message.type, wechatmp_msg.content)
@@ -25,10 +25,11 @@ from db.mysql.model import User, Dialog, Notify
 from db.mysql.dao import notify_dao, user_dao, dialog_dao
 
 
-def hello_notify(user, channel, chating_hour=2):
+def hello_notify(user, channel, chating_hour=2, has_dialog=None):
     """根据当前时间返回合适的问候回复"""
-    # 检查用户在过去 chating_hour 小时内是否有对话记录
-    has_dialog = dialog_dao.has_dialog_in_pass_time(user.id, chating_hour)
+    # 检查用户在过去 chating_hour 小时内是否有对话记录，调用方已查询过时直接使用
+    if has_dialog is None:
+        has_dialog = dialog_dao.has_dialog_in_pass_time(user.id, chating_hour)
 
     # 如果没有对话记录，查询时间段内的回复配置
     if not has_dialog:
@@ -36,8 +37,9 @@ def hello_notify(user, channel, chating_hour=2):
         channel._send_text_message(user.openid, hello_notify)
 
 
-def wait_notify(user, channel):
-    has_unreply_dialog = dialog_dao.has_unreply_dialog(user.id)
+def wait_notify(user, channel, has_unreply_dialog=None):
+    if has_unreply_dialog is None:
+        has_unreply_dialog = dialog_dao.has_unreply_dialog(user.id)
 
     if has_unreply_dialog:
         wait_notify = notify_dao.get_wait_notify()
@@ -140,7 +142,8 @@ class Query:
                 message_id = wechatmp_msg.msg_id
 
                 # 检查用户是否同意隐私政策
-                if not channel.check_privacy_agreed(from_user):
+                privacy_agreed = channel.check_privacy_agreed(from_user)
+                if not privacy_agreed:
                     # 检查用户消息是否为同意隐私政策
                     if msg.type == "text" and channel.is_agree_privacy(content):
                         # 设置用户已同意隐私政策
@@ -158,7 +161,7 @@ class Query:
 
                 # 新增：如果数据库查不到该用户（即首次发消息的历史用户），发送三条欢迎消息
                 # 这里假设 check_privacy_agreed 返回 False 表示数据库无记录
-                if not channel.check_privacy_agreed(from_user):
+                if not privacy_agreed:
                     welcome_messages = [
                         "人类，你是怎么找到我的？ 还挺前卫... 😄",
                         "礼貌自我介绍一下吧。其实呢...😊我是月老部门搞了一款帮你们拆红线的APP，在它上线之前，就派我这个情商最高的先来微信教你们聊聊天。",
@@ -178,11 +181,12 @@ class Query:
                     supported = False  # not supported, used to refresh
 
                 # New request
+                reply_states = channel.reply_states
                 if (
-                    channel.cache_dict.get(from_user) is None
-                    and from_user not in channel.running
+                    not reply_states.has_replies(from_user)
+                    and not reply_states.is_running(from_user)
                     or content.startswith("#")
-                    and message_id not in channel.request_cnt  # insert the godcmd
+                    and not reply_states.has_request(from_user, message_id)  # insert the godcmd
                 ):
                     # The first query begin
                     if msg.type == "voice" and wechatmp_msg.ctype == ContextType.TEXT and conf().get("voice_reply_voice", False):
@@ -206,7 +210,7 @@ class Query:
                         prompt_message = "正在生成回复，请稍候..."
                         channel._send_text_message(from_user, prompt_message)
 
-                        channel.running.add(from_user)
+                        reply_states.start(from_user)
                         channel.produce(context)
                     else:
                         trigger_prefix = conf().get("single_chat_prefix", [""])[0]
@@ -236,50 +240,41 @@ class Query:
 
                 # Wechat official server will request 3 times (5 seconds each), with the same message_id.
                 # Because the interval is 5 seconds, here assumed that do not have multithreading problems.
-                request_cnt = channel.request_cnt.get(message_id, 0) + 1
-                channel.request_cnt[message_id] = request_cnt
+                request_cnt = reply_states.count_request(from_user, message_id)
                 logger.info(
                     "[wechatmp] Request {} from {} {} {}:{}\n{}".format(
                         request_cnt, from_user, message_id, web.ctx.env.get("REMOTE_ADDR"), web.ctx.env.get("REMOTE_PORT"), content
                     )
                 )
 
-                task_running = True
-                waiting_until = request_time + 4
-                while time.time() < waiting_until:
-                    if from_user in channel.running:
-                        time.sleep(0.1)
-                    else:
-                        task_running = False
-                        break
+                # 回复缓存或处理结束时立即被唤醒，最多等到收到请求后4秒
+                task_running = not channel.wait_reply(from_user, request_time + 4 - time.time())
 
                 reply_text = ""
                 if task_running:
                     if request_cnt < 3:
                         # waiting for timeout (the POST request will be closed by Wechat official server)
+                        # 返回success会让微信服务器停止重试，因此需要保持连接直到微信服务器超时
                         time.sleep(2)
                         # and do nothing, waiting for the next request
                         return "success"
                     else:  # request_cnt == 3:
+                        # 微信服务器不会再重试这条消息
+                        reply_states.pop_request(from_user, message_id)
                         # return timeout message
                         reply_text = "【正在思考中，回复任意文字尝试获取回复】"
                         replyPost = create_reply(reply_text, msg)
                         return encrypt_func(replyPost.render())
 
                 # reply is ready
-                channel.request_cnt.pop(message_id)
+                reply_states.pop_request(from_user, message_id)
 
                 # no return because of bandwords or other reasons
-                if from_user not in channel.cache_dict and from_user not in channel.running:
-                    return "success"
-
                 # Only one request can access to the cached data
-                try:
-                    (reply_type, reply_content) = channel.cache_dict[from_user].pop(0)
-                    if not channel.cache_dict[from_user]:  # If popping the message makes the list empty, delete the user entry from cache
-                        del channel.cache_dict[from_user]
-                except IndexError:
+                cached_reply = reply_states.pop_reply(from_user)
+                if cached_reply is None:
                     return "success"
+                (reply_type, reply_content) = cached_reply
 
                 if reply_type == "text":
                     if len(reply_content.encode("utf8")) <= MAX_UTF8_LEN:
@@ -292,7 +287,7 @@ class Query:
                             max_split=1,
                         )
                         reply_text = splits[0] + continue_text
-                        channel.cache_dict[from_user].append(("text", splits[1]))
+                        reply_states.add_reply(from_user, "text", splits[1])
 
                     logger.info(
                         "[wechatmp] Request {} do send to {} {}: {}\n{}".format(
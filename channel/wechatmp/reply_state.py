@@ -0,0 +1,144 @@
+import threading
+
+from common.expired_dict import ExpiredDict
+from common.log import logger
+
+# 内容为永久素材media_id的回复类型，条目过期时需要删除素材
+MEDIA_REPLY_TYPES = ("voice", "image", "video")
+
+_store = None  # 渠道创建的实例，用于 #stats 查看
+
+
+class UserReplyState:
+    """单个用户的被动回复状态"""
+
+    def __init__(self):
+        self.replies = []  # 等待微信服务器拉取的回复 [(类型, 内容)]
+        self.running = False  # 是否有消息正在处理
+        self.requests = {}  # message_id -> 微信服务器对该消息的请求次数
+
+    def is_idle(self):
+        return not self.replies and not self.running and not self.requests
+
+
+class ReplyStateStore:
+    """
+    公众号被动回复模式下各用户的回复状态
+    - 用户没有回复"继续"时缓存的分段回复、请求失败后残留的请求计数都会在ttl后过期，不再常驻内存
+    - 用户数超过max_users时淘汰最久未访问的用户
+    - 过期或被淘汰的回复中未发送的永久素材交给delete_media删除，避免占满素材数量上限
+    """
+
+    def __init__(self, ttl=3600, max_users=10000, delete_media=None):
+        """
+        :param ttl: 用户状态的有效期(秒)，每次访问重新计算
+        :param max_users: 最多保存的用户数
+        :param delete_media: 删除永久素材的函数，参数为media_id
+        """
+        global _store
+        self.delete_media = delete_media
+        self._states = ExpiredDict(ttl, maxsize=max_users, on_evict=self._on_evict)
+        # 组合操作(读取-修改-按需删除)需要加锁，过期回调可能在持有锁的线程中同步触发，使用可重入锁
+        self._lock = threading.RLock()
+        self.evicted = 0
+        self.evicted_replies = 0
+        self.media_deleted = 0
+        _store = self
+
+    def _get(self, user_id, create=False):
+        state = self._states.get(user_id)
+        if state is None and create:
+            state = UserReplyState()
+            self._states[user_id] = state
+        return state
+
+    # 调用方需持有self._lock
+    def _discard_if_idle(self, user_id, state):
+        if state.is_idle():
+            self._states.pop(user_id, None)
+
+    def start(self, user_id):
+        with self._lock:
+            self._get(user_id, create=True).running = True
+
+    def finish(self, user_id):
+        with self._lock:
+            state = self._get(user_id)
+            if state:
+                state.running = False
+                self._discard_if_idle(user_id, state)
+
+    def is_running(self, user_id) -> bool:
+        state = self._get(user_id)
+        return bool(state and state.running)
+
+    def has_replies(self, user_id) -> bool:
+        state = self._get(user_id)
+        return bool(state and state.replies)
+
+    def add_reply(self, user_id, reply_type, content):
+        with self._lock:
+            self._get(user_id, create=True).replies.append((reply_type, content))
+
+    def pop_reply(self, user_id):
+        """
+        :return: 最早缓存的 (类型, 内容)，没有时返回None
+        """
+        with self._lock:
+            state = self._get(user_id)
+            if not state or not state.replies:
+                return None
+            reply = state.replies.pop(0)
+            self._discard_if_idle(user_id, state)
+            return reply
+
+    def has_request(self, user_id, message_id) -> bool:
+        state = self._get(user_id)
+        return bool(state and message_id in state.requests)
+
+    def count_request(self, user_id, message_id) -> int:
+        """记录微信服务器对消息的一次请求，返回累计请求次数"""
+        with self._lock:
+            state = self._get(user_id, create=True)
+            state.requests[message_id] = state.requests.get(message_id, 0) + 1
+            return state.requests[message_id]
+
+    def pop_request(self, user_id, message_id):
+        with self._lock:
+            state = self._get(user_id)
+            if state:
+                state.requests.pop(message_id, None)
+                self._discard_if_idle(user_id, state)
+
+    def _on_evict(self, user_id, state):
+        media_ids = [content for reply_type, content in state.replies if reply_type in MEDIA_REPLY_TYPES]
+        with self._lock:
+            self.evicted += 1
+            self.evicted_replies += len(state.replies)
+        if state.replies:
+            logger.info("[wechatmp] reply state of {} evicted, drop {} cached replies".format(user_id, len(state.replies)))
+        if not self.delete_media:
+            return
+        for media_id in media_ids:
+            self.delete_media(media_id)
+            with self._lock:
+                self.media_deleted += 1
+
+    def get_metrics(self) -> dict:
+        states = self._states.values()
+        with self._lock:
+            return {
+                "users": len(states),
+                "max_users": self._states.maxsize,
+                "running": sum(1 for state in states if state.running),
+                "replies": sum(len(state.replies) for state in states),
+                "requests": sum(len(state.requests) for state in states),
+                "evicted": self.evicted,
+                "evicted_replies": self.evicted_replies,
+                "media_deleted": self.media_deleted,
+            }
+
+
+def get_reply_state_metrics():
+    """未使用公众号被动回复时返回None"""
+    return _store.get_metrics() if _store else None
@@ -6,29 +6,32 @@ import os
 import threading
 import time
 
-import requests
 import web
 from wechatpy.crypto import WeChatCrypto
 from wechatpy.exceptions import WeChatClientException
-from collections import defaultdict
 from PIL import Image
-from paddleocr import PaddleOCR
 import re
 
 from bridge.context import *
 from bridge.reply import *
-from channel.chat_channel import ChatChannel
+from channel.async_chat_channel import AsyncChatChannel
 from channel.wechatmp.common import *
+from channel.wechatmp.reply_state import ReplyStateStore
 from channel.wechatmp.wechatmp_client import WechatMPClient
+from common import http_client
 from common.log import logger
+from common.sentence_segmenter import SentenceSegmenter
 from common.singleton import singleton
 from common.utils import split_string_by_utf8_length, remove_markdown_symbol
 from config import conf
-from voice.audio_convert import any_to_mp3, split_audio
+from voice.audio_convert import transcode
+from voice.tts_cache import get_tts_cache
 from channel.wechatmp.wechatmp_message import WeChatMPMessage
 from common.tmp_dir import TmpDir
 from db.mysql.model import User, Dialog, Notify
 from db.mysql.dao import user_dao, dialog_dao, notify_dao
+from service.ocr_service import OcrQueueFullError, get_ocr_service
+from service.privacy_service import privacy_service
 
 # If using SSL, uncomment the following lines, and modify the certificate path.
 # from cheroot.server import HTTPServer
@@ -37,22 +40,15 @@ from db.mysql.dao import user_dao, dialog_dao, notify_dao
 #         certificate='/ssl/cert.pem',
 #         private_key='/ssl/cert.key')
 
-# 初始化OCR，使用更简单的配置
-try:
-    ocr = PaddleOCR(use_angle_cls=False, lang='ch', use_gpu=False)
-    logger.info("[wechatmp] PaddleOCR初始化成功")
-except Exception as e:
-    logger.error(f"[wechatmp] PaddleOCR初始化失败: {str(e)}")
-    import traceback
-    logger.error(f"[wechatmp] PaddleOCR初始化异常堆栈: {traceback.format_exc()}")
-
 
 @singleton
-class WechatMPChannel(ChatChannel):
+class WechatMPChannel(AsyncChatChannel):
     def __init__(self, passive_reply=True):
         super().__init__()
         self.passive_reply = passive_reply
         self.NOT_SUPPORT_REPLYTYPE = []
+        # 被动回复需要缓存完整回复等待微信服务器重试拉取，只有主动回复(客服消息)支持流式发送
+        self.SUPPORT_STREAM_REPLY = not passive_reply
         appid = conf().get("wechatmp_app_id")
         secret = conf().get("wechatmp_app_secret")
         token = conf().get("wechatmp_token")
@@ -62,17 +58,19 @@ class WechatMPChannel(ChatChannel):
         if aes_key:
             self.crypto = WeChatCrypto(token, aes_key, appid)
         if self.passive_reply:
-            # Cache the reply to the user's first message
-            self.cache_dict = defaultdict(list)
-            # Record whether the current message is being processed
-            self.running = set()
-            # Count the request from wechat official server by message_id
-            self.request_cnt = dict()
             # The permanent media need to be deleted to avoid media number limit
             self.delete_media_loop = asyncio.new_event_loop()
             t = threading.Thread(target=self.start_loop, args=(self.delete_media_loop,))
             t.setDaemon(True)
             t.start()
+            # 每个用户的缓存回复、处理状态和微信服务器的请求计数，过期后删除未发送的永久素材
+            self.reply_states = ReplyStateStore(
+                ttl=conf().get("wechatmp_reply_state_ttl", 3600),
+                max_users=conf().get("wechatmp_reply_state_max_users", 10000),
+                delete_media=lambda media_id: asyncio.run_coroutine_threadsafe(self.delete_media(media_id), self.delete_media_loop),
+            )
+            # 回复缓存或消息处理结束时唤醒等待中的HTTP请求，见wait_reply
+            self.reply_cond = threading.Condition()
 
     def startup(self):
         if self.passive_reply:
@@ -99,32 +97,32 @@ class WechatMPChannel(ChatChannel):
             if reply.type == ReplyType.TEXT or reply.type == ReplyType.INFO or reply.type == ReplyType.ERROR:
                 reply_text = remove_markdown_symbol(reply.content)
                 logger.info("[wechatmp] text cached, receiver {}\n{}".format(receiver, reply_text))
-                self.cache_dict[receiver].append(("text", reply_text))
+                self.reply_states.add_reply(receiver, "text", reply_text)
             elif reply.type == ReplyType.VOICE:
                 voice_file_path = reply.content
-                duration, files = split_audio(voice_file_path, 60 * 1000)
-                if len(files) > 1:
-                    logger.info("[wechatmp] voice too long {}s > 60s , split into {} parts".format(duration / 1000.0, len(files)))
+                file_prefix, file_ext = os.path.splitext(os.path.basename(voice_file_path))
+                # 不超过60s时直接上传原文件数据，超过时解码一次后各段在内存中编码
+                duration, segments = transcode(voice_file_path, file_ext[1:].lower(), max_segment_length_ms=60 * 1000)
+                if len(segments) > 1:
+                    logger.info("[wechatmp] voice too long {}s > 60s , split into {} parts".format(duration / 1000.0, len(segments)))
 
-                for path in files:
+                for i, data in enumerate(segments):
                     # support: <2M, <60s, mp3/wma/wav/amr
                     try:
-                        with open(path, "rb") as f:
-                            response = self.client.material.add("voice", f)
-                            logger.debug("[wechatmp] upload voice response: {}".format(response))
-                            f_size = os.fstat(f.fileno()).st_size
-                            time.sleep(1.0 + 2 * f_size / 1024 / 1024)
-                            # todo check media_id
+                        response = self.client.material.add("voice", ("{}_{}{}".format(file_prefix, i + 1, file_ext), io.BytesIO(data)))
+                        logger.debug("[wechatmp] upload voice response: {}".format(response))
+                        time.sleep(1.0 + 2 * len(data) / 1024 / 1024)
+                        # todo check media_id
                     except WeChatClientException as e:
                         logger.error("[wechatmp] upload voice failed: {}".format(e))
                         return
                     media_id = response["media_id"]
                     logger.info("[wechatmp] voice uploaded, receiver {}, media_id {}".format(receiver, media_id))
-                    self.cache_dict[receiver].append(("voice", media_id))
+                    self.reply_states.add_reply(receiver, "voice", media_id)
 
             elif reply.type == ReplyType.IMAGE_URL:  # 从网络下载图片
                 img_url = reply.content
-                pic_res = requests.get(img_url, stream=True)
+                pic_res = http_client.get(img_url, stream=True)
                 image_storage = io.BytesIO()
                 for block in pic_res.iter_content(1024):
                     image_storage.write(block)
@@ -140,7 +138,7 @@ class WechatMPChannel(ChatChannel):
                     return
                 media_id = response["media_id"]
                 logger.info("[wechatmp] image uploaded, receiver {}, media_id {}".format(receiver, media_id))
-                self.cache_dict[receiver].append(("image", media_id))
+                self.reply_states.add_reply(receiver, "image", media_id)
             elif reply.type == ReplyType.IMAGE:  # 从文件读取图片
                 image_storage = reply.content
                 image_storage.seek(0)
@@ -155,10 +153,10 @@ class WechatMPChannel(ChatChannel):
                     return
                 media_id = response["media_id"]
                 logger.info("[wechatmp] image uploaded, receiver {}, media_id {}".format(receiver, media_id))
-                self.cache_dict[receiver].append(("image", media_id))
+                self.reply_states.add_reply(receiver, "image", media_id)
             elif reply.type == ReplyType.VIDEO_URL:  # 从网络下载视频
                 video_url = reply.content
-                video_res = requests.get(video_url, stream=True)
+                video_res = http_client.get(video_url, stream=True)
                 video_storage = io.BytesIO()
                 for block in video_res.iter_content(1024):
                     video_storage.write(block)
@@ -174,7 +172,7 @@ class WechatMPChannel(ChatChannel):
                     return
                 media_id = response["media_id"]
                 logger.info("[wechatmp] video uploaded, receiver {}, media_id {}".format(receiver, media_id))
-                self.cache_dict[receiver].append(("video", media_id))
+                self.reply_states.add_reply(receiver, "video", media_id)
 
             elif reply.type == ReplyType.VIDEO:  # 从文件读取视频
                 video_storage = reply.content
@@ -190,10 +188,13 @@ class WechatMPChannel(ChatChannel):
                     return
                 media_id = response["media_id"]
                 logger.info("[wechatmp] video uploaded, receiver {}, media_id {}".format(receiver, media_id))
-                self.cache_dict[receiver].append(("video", media_id))
+                self.reply_states.add_reply(receiver, "video", media_id)
+            self._notify_reply()
 
         else:
-            if reply.type == ReplyType.TEXT or reply.type == ReplyType.INFO or reply.type == ReplyType.ERROR:
+            if reply.type == ReplyType.TEXT_STREAM:
+                self._send_text_stream(receiver, reply.content, context)
+            elif reply.type == ReplyType.TEXT or reply.type == ReplyType.INFO or reply.type == ReplyType.ERROR:
                 reply_text = reply.content
                 MAX_UTF8_LEN = conf().get("single_reply_max_len", 1800) # 微信单条消息限制
 
@@ -231,29 +232,28 @@ class WechatMPChannel(ChatChannel):
             elif reply.type == ReplyType.VOICE:
                 try:
                     file_path = reply.content
-                    file_name = os.path.basename(file_path)
-                    file_type = os.path.splitext(file_name)[1]
-                    if file_type == ".mp3":
-                        file_type = "audio/mpeg"
-                    elif file_type == ".amr":
-                        file_type = "audio/amr"
-                    else:
-                        mp3_file = os.path.splitext(file_path)[0] + ".mp3"
-                        any_to_mp3(file_path, mp3_file)
-                        file_path = mp3_file
-                        file_name = os.path.basename(file_path)
-                        file_type = "audio/mpeg"
-                    logger.info("[wechatmp] file_name: {}, file_type: {} ".format(file_name, file_type))
+                    file_prefix, file_ext = os.path.splitext(os.path.basename(file_path))
+                    # amr直接上传，其他格式转成mp3，解码一次后各段在内存中编码
+                    voice_format = "amr" if file_ext.lower() == ".amr" else "mp3"
+                    file_type = "audio/amr" if voice_format == "amr" else "audio/mpeg"
+                    logger.info("[wechatmp] file_name: {}, file_type: {} ".format(os.path.basename(file_path), file_type))
                     media_ids = []
-                    duration, files = split_audio(file_path, 60 * 1000)
-                    if len(files) > 1:
-                        logger.info("[wechatmp] voice too long {}s > 60s , split into {} parts".format(duration / 1000.0, len(files)))
-                    for path in files:
-                        # support: <2M, <60s, AMR\MP3
-                        response = self.client.media.upload("voice", (os.path.basename(path), open(path, "rb"), file_type))
-                        logger.debug("[wechatcom] upload voice response: {}".format(response))
-                        media_ids.append(response["media_id"])
-                        os.remove(path)
+                    duration, segments = transcode(file_path, voice_format, max_segment_length_ms=60 * 1000)
+                    if len(segments) > 1:
+                        logger.info("[wechatmp] voice too long {}s > 60s , split into {} parts".format(duration / 1000.0, len(segments)))
+                    tts_cache = get_tts_cache()
+                    for i, data in enumerate(segments):
+                        # 缓存的语音合成结果内容相同，有效期内复用已上传的临时素材
+                        media_id = tts_cache.get_media_id("wechatmp", data) if tts_cache else None
+                        if not media_id:
+                            # support: <2M, <60s, AMR\MP3
+                            file_name = "{}_{}.{}".format(file_prefix, i + 1, voice_format)
+                            response = self.client.media.upload("voice", (file_name, io.BytesIO(data), file_type))
+                            logger.debug("[wechatcom] upload voice response: {}".format(response))
+                            media_id = response["media_id"]
+                            if tts_cache:
+                                tts_cache.set_media_id("wechatmp", data, media_id)
+                        media_ids.append(media_id)
                 except WeChatClientException as e:
                     logger.error("[wechatmp] upload voice failed: {}".format(e))
                     return
@@ -269,7 +269,7 @@ class WechatMPChannel(ChatChannel):
                 logger.info("[wechatmp] Do send voice to {}".format(receiver))
             elif reply.type == ReplyType.IMAGE_URL:  # 从网络下载图片
                 img_url = reply.content
-                pic_res = requests.get(img_url, stream=True)
+                pic_res = http_client.get(img_url, stream=True)
                 image_storage = io.BytesIO()
                 for block in pic_res.iter_content(1024):
                     image_storage.write(block)
@@ -301,7 +301,7 @@ class WechatMPChannel(ChatChannel):
                 logger.info("[wechatmp] Do send image to {}".format(receiver))
             elif reply.type == ReplyType.VIDEO_URL:  # 从网络下载视频
                 video_url = reply.content
-                video_res = requests.get(video_url, stream=True)
+                video_res = http_client.get(video_url, stream=True)
                 video_storage = io.BytesIO()
                 for block in video_res.iter_content(1024):
                     video_storage.write(block)
@@ -333,25 +333,66 @@ class WechatMPChannel(ChatChannel):
                 logger.info("[wechatmp] Do send video to {}".format(receiver))
         return
 
+    def _send_text_stream(self, receiver, stream, context):
+        """
+        边接收模型的增量回复边按句发送，全部发送完后再记录完整回复
+        """
+        segmenter = SentenceSegmenter(conf().get("stream_reply_min_len", 10), conf().get("single_reply_max_len", 1800))
+        reply_text = ""
+        for delta in stream:
+            reply_text += delta
+            for segment in segmenter.feed(delta):
+                self.client.message.send_text(receiver, segment)
+                logger.info(f"[wechatmp] 发送流式消息到 {receiver}: {segment[:50]}...")
+        for segment in segmenter.flush():
+            self.client.message.send_text(receiver, segment)
+            logger.info(f"[wechatmp] 发送最后流式消息到 {receiver}: {segment[:50]}...")
+
+        if context.get("dialog_id"):
+            dialog_dao.update_dialog_reply(context["dialog_id"], reply_text)
+        logger.info("[wechatmp] Do send text stream to {}: {}".format(receiver, reply_text))
+
     def _success_callback(self, session_id, context, **kwargs):  # 线程异常结束时的回调函数
         logger.debug("[wechatmp] Success to generate reply, msgId={}".format(context["msg"].msg_id))
         if self.passive_reply:
-            self.running.remove(session_id)
+            self.reply_states.finish(session_id)
+            self._notify_reply()
 
     def _fail_callback(self, session_id, exception, context, **kwargs):  # 线程异常结束时的回调函数
         logger.exception("[wechatmp] Fail to generate reply to user, msgId={}, exception={}".format(context["msg"].msg_id, exception))
         if self.passive_reply:
-            assert session_id not in self.cache_dict
-            self.running.remove(session_id)
+            assert not self.reply_states.has_replies(session_id)
+            self.reply_states.finish(session_id)
+            self._notify_reply()
+
+    def _notify_reply(self):
+        with self.reply_cond:
+            self.reply_cond.notify_all()
+
+    def wait_reply(self, user_id, timeout):
+        """
+        被动回复时等待用户的回复就绪：已有缓存的回复，或者消息处理已结束(可能没有回复)
+        回复就绪时立即返回，不再轮询
+        :return: 超时前是否就绪
+        """
+        with self.reply_cond:
+            return self.reply_cond.wait_for(
+                lambda: not self.reply_states.is_running(user_id) or self.reply_states.has_replies(user_id), max(0, timeout)
+            )
+
+    def _remove_tmp_file(self, path):
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+                logger.info(f"[wechatmp] 已删除临时文件: {path}")
+        except Exception as e:
+            logger.error(f"[wechatmp] 删除临时文件异常: {str(e)}")
 
     def _process_image_with_ocr(self, media_id, from_user_id, to_user_id):
         """处理图片OCR并解析聊天记录"""
         try:
             logger.info(f"[wechatmp] 开始处理图片OCR，media_id={media_id}")
 
-            # 先发送一条消息安抚用户
-            self._send_text_message(from_user_id, "已收到您的图片，正在分析中，这可能需要10-20秒时间...")
-
             # 下载图片
             image_path = TmpDir().path() + media_id + ".png"
 
@@ -369,12 +410,27 @@ class WechatMPChannel(ChatChannel):
             except Exception as e:
                 logger.error(f"[wechatmp] 下载图片异常: {str(e)}")
                 self._send_text_message(from_user_id, "下载图片时出错，请稍后重试。")
+                self._remove_tmp_file(image_path)
                 return
 
-            # 进行OCR识别
+            # 提交OCR任务，队列已满时直接告知用户
+            ocr_service = get_ocr_service()
+            try:
+                estimated_wait = ocr_service.estimate_wait()
+                future = ocr_service.submit(image_path)
+            except OcrQueueFullError as e:
+                logger.warning(f"[wechatmp] {e}")
+                self._send_text_message(from_user_id, "现在分析图片的人太多啦，请稍后再发一次。")
+                self._remove_tmp_file(image_path)
+                return
+
+            # 先发送一条消息安抚用户
+            self._send_text_message(from_user_id, f"已收到您的图片，正在分析中，预计需要{int(estimated_wait) + 1}秒左右...")
+
+            # 等待OCR识别结果
             try:
                 logger.info("[wechatmp] 开始OCR识别")
-                result = ocr.ocr(image_path, cls=False)
+                result = future.result()
                 logger.info(f"[wechatmp] OCR识别完成，结果长度: {len(result) if result else 0}")
                 if result and len(result) > 0 and result[0]:
                     logger.info(f"[wechatmp] OCR识别到的文本数量: {len(result[0])}")
@@ -388,6 +444,9 @@ class WechatMPChannel(ChatChannel):
                 logger.error(f"[wechatmp] OCR异常堆栈: {traceback.format_exc()}")
                 self._send_text_message(from_user_id, "OCR识别过程中出现错误，请稍后重试。")
                 return
+            finally:
+                # 识别结束后图片不再需要，清理临时文件
+                self._remove_tmp_file(image_path)
 
             if not result or len(result) == 0 or not result[0]:
                 logger.error("[wechatmp] OCR结果为空")
@@ -434,14 +493,6 @@ class WechatMPChannel(ChatChannel):
             prompt = f"以下是一段微信聊天记录截图中提取的文本，请帮我分析并解读对话内容，理清对话的逻辑和情感：\n\n{chat_history}"
             logger.info(f"[wechatmp] 构建的提示信息: {prompt[:100]}...")
 
-            # 清理临时文件
-            try:
-                if os.path.exists(image_path):
-                    os.remove(image_path)
-                    logger.info(f"[wechatmp] 已删除临时文件: {image_path}")
-            except Exception as e:
-                logger.error(f"[wechatmp] 删除临时文件异常: {str(e)}")
-
             # 创建一个自定义消息封装类，适配微信公众号消息格式
             logger.info("[wechatmp] 创建自定义消息对象")
             class CustomMsg:
@@ -471,6 +522,10 @@ class WechatMPChannel(ChatChannel):
             if context:
                 context['session_id'] = f"user_{from_user_id}"
                 context['receiver'] = from_user_id
+                # 同一张聊天记录截图的识别结果相同，允许直接返回缓存的分析结果
+                # 分析结果只取决于截图中的聊天记录，缓存key不包含会话历史，会话中重复发送同一张截图也能命中
+                context['reply_cache'] = True
+                context['reply_cache_ignore_history'] = True
                 
                 # 为OCR处理的消息也插入对话记录并获取dialog_id
                 try:
@@ -709,52 +764,23 @@ class WechatMPChannel(ChatChannel):
             logger.error(f"[wechatmp] 发送错误消息异常堆栈: {traceback.format_exc()}")
 
     def check_privacy_agreed(self, user_id):
-        """检查用户是否同意隐私政策（通过API查询）"""
+        """检查用户是否同意隐私政策，user_id为用户openid"""
         try:
-            api_url = "http://0.0.0.0:9900/api/privacy/check"  # 独立API地址
-            response = requests.get(f"{api_url}?user_id={user_id}", timeout=3)
-
-            if response.status_code == 200:
-                result = response.json()
-                if result['code'] == 200:
-                    has_consented = result['data']['has_consented']
-                    logger.info(f"[wechatmp] 查询用户 {user_id} 隐私协议同意状态: {has_consented}")
-                    return has_consented
-
-            logger.error(f"[wechatmp] API查询失败，状态码: {response.status_code}")
-            # 如果API不可用，默认用户未同意，确保隐私安全
-            return False
+            has_consented = privacy_service.check_privacy_agreed(None, user_id)
+            logger.debug(f"[wechatmp] 查询用户 {user_id} 隐私协议同意状态: {has_consented}")
+            return has_consented
         except Exception as e:
             logger.error(f"[wechatmp] 查询用户隐私协议状态失败: {str(e)}")
-            # 发生异常时，默认用户未同意
+            # 发生异常时，默认用户未同意，确保隐私安全
             return False
 
     def set_privacy_agreed(self, user_id):
-        """设置用户已同意隐私政策（通过API更新）"""
+        """设置用户已同意隐私政策，user_id为用户openid"""
         try:
-            api_url = "http://0.0.0.0:9900/api/privacy/update"  # 独立API地址
-
-            # 获取用户IP和设备ID（如果有）
-            ip_address = web.ctx.env.get('REMOTE_ADDR') if hasattr(web, 'ctx') else None
-            device_id = None  # 微信公众号场景下可能无法获取设备ID
-
-            data = {
-                "user_id": user_id,
-                "has_consented": True,
-                "device_id": device_id,
-                "ip_address": ip_address
-            }
-
-            response = requests.post(api_url, json=data, timeout=3)
-
-            if response.status_code == 200:
-                result = response.json()
-                if result['code'] == 200:
-                    logger.info(f"[wechatmp] 更新用户 {user_id} 隐私协议同意状态成功")
-                    return True
-
-            logger.error(f"[wechatmp] API更新失败，状态码: {response.status_code}")
-            return False
+            # 与隐私服务的更新接口保持一致，同意后状态为2(授权ai及人工)
+            privacy_service.update_privacy_status(None, user_id, 2)
+            logger.info(f"[wechatmp] 更新用户 {user_id} 隐私协议同意状态成功")
+            return True
         except Exception as e:
             logger.error(f"[wechatmp] 更新用户隐私协议状态失败: {str(e)}")
             return False
@@ -1,22 +1,64 @@
-from datetime import datetime, timedelta
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from collections.abc import MutableMapping
 
+from common.log import logger
 
-class ExpiredDict(dict):
-    def __init__(self, expires_in_seconds):
-        super().__init__()
+# 后台清理线程的执行间隔(秒)
+SWEEP_INTERVAL = 1
+
+# 需要后台清理的字典，字典被回收后自动移除
+_instances = weakref.WeakValueDictionary()  # id -> ExpiredDict
+_instances_lock = threading.Lock()
+_sweeper = None
+
+
+class ExpiredDict(MutableMapping):
+    """
+    条目过期自动删除的字典，读写条目都会重新计算过期时间
+    所有条目的有效期相同，按最近访问顺序保存的条目同时也是按过期时间排序的，
+    过期检查只需要看最前面的条目，删除过期条目和淘汰最久未使用的条目都是O(1)
+    - 使用time.monotonic计时，不受系统时间调整影响
+    - 后台线程定期删除过期条目，不再依赖下一次访问
+    - 设置maxsize后超过上限时淘汰最久未使用的条目
+    - 条目过期或被淘汰时调用on_evict(key, value)，可用于清理条目关联的资源
+    """
+
+    def __init__(self, expires_in_seconds, maxsize=None, on_evict=None):
         self.expires_in_seconds = expires_in_seconds
+        self.maxsize = maxsize
+        self.on_evict = on_evict
+        self._data = OrderedDict()  # key -> (value, expiry_time)
+        self._lock = threading.RLock()
+        _register(self)
 
     def __getitem__(self, key):
-        value, expiry_time = super().__getitem__(key)
-        if datetime.now() > expiry_time:
-            del self[key]
-            raise KeyError("expired {}".format(key))
-        self.__setitem__(key, value)
-        return value
+        now = time.monotonic()
+        with self._lock:
+            value, expiry_time = self._data[key]
+            if now > expiry_time:
+                evicted = [(key, value)]
+                del self._data[key]
+            else:
+                self._data[key] = (value, now + self.expires_in_seconds)
+                self._data.move_to_end(key)
+                return value
+        self._notify(evicted)
+        raise KeyError("expired {}".format(key))
 
     def __setitem__(self, key, value):
-        expiry_time = datetime.now() + timedelta(seconds=self.expires_in_seconds)
-        super().__setitem__(key, (value, expiry_time))
+        now = time.monotonic()
+        with self._lock:
+            self._data[key] = (value, now + self.expires_in_seconds)
+            self._data.move_to_end(key)
+            evicted = self._purge(now)
+        self._notify(evicted)
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._data[key]
 
     def get(self, key, default=None):
         try:
@@ -31,12 +73,79 @@ class ExpiredDict(dict):
         except KeyError:
             return False
 
+    def __len__(self):
+        # 先删除后台线程还没来得及清理的过期条目，与keys()、in、迭代的结果保持一致
+        with self._lock:
+            evicted = self._purge(time.monotonic())
+            size = len(self._data)
+        self._notify(evicted)
+        return size
+
+    def __iter__(self):
+        return iter(self.keys())
+
     def keys(self):
-        keys = list(super().keys())
-        return [key for key in keys if key in self]
+        now = time.monotonic()
+        with self._lock:
+            return [key for key, (_, expiry_time) in self._data.items() if expiry_time >= now]
 
     def items(self):
-        return [(key, self[key]) for key in self.keys()]
+        now = time.monotonic()
+        with self._lock:
+            return [(key, value) for key, (value, expiry_time) in self._data.items() if expiry_time >= now]
 
-    def __iter__(self):
-        return self.keys().__iter__()
+    def values(self):
+        return [value for _, value in self.items()]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def expire(self):
+        """
+        删除所有过期条目，由后台清理线程定期调用
+        """
+        with self._lock:
+            evicted = self._purge(time.monotonic())
+        self._notify(evicted)
+
+    # 调用方需持有self._lock，返回被删除的条目
+    def _purge(self, now):
+        evicted = []
+        while self._data:
+            key, (value, expiry_time) = next(iter(self._data.items()))
+            if now <= expiry_time and (self.maxsize is None or len(self._data) <= self.maxsize):
+                break
+            del self._data[key]
+            evicted.append((key, value))
+        return evicted
+
+    def _notify(self, evicted):
+        if not self.on_evict:
+            return
+        for key, value in evicted:
+            try:
+                self.on_evict(key, value)
+            except Exception as e:
+                logger.warning("[ExpiredDict] on_evict failed, key={}: {}".format(key, e))
+
+
+def _register(expired_dict):
+    global _sweeper
+    with _instances_lock:
+        _instances[id(expired_dict)] = expired_dict
+        if _sweeper is None:
+            _sweeper = threading.Thread(target=_sweep_loop, name="expired_dict_sweeper", daemon=True)
+            _sweeper.start()
+
+
+def _sweep_loop():
+    while True:
+        time.sleep(SWEEP_INTERVAL)
+        with _instances_lock:
+            instances = list(_instances.values())
+        for expired_dict in instances:
+            try:
+                expired_dict.expire()
+            except Exception as e:
+                logger.warning("[ExpiredDict] sweep failed: {}".format(e))
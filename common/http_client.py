@@ -0,0 +1,173 @@
+import asyncio
+import functools
+import threading
+import time
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from common.log import logger
+from config import conf
+
+
+class HostStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.connections = 0  # 新建的连接数，requests - connections即复用连接的请求数
+
+
+class HttpClient:
+    """
+    共享的HTTP客户端，同一个host的请求复用keep-alive连接
+    - 每个host一个连接池，最多pool_maxsize个连接
+    - 没有指定timeout的请求使用默认超时时间
+    - 连接失败时按指数退避重试，幂等请求(GET等)在读超时、429和5xx时也会重试，POST不会重复发送
+    用法与requests相同：http_client.get(url, ...)，返回requests.Response
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=20, timeout=(5, 60), retries=2, backoff_factor=0.5):
+        """
+        :param pool_connections: 缓存连接池的host数
+        :param pool_maxsize: 每个host的最大连接数
+        :param timeout: 默认的(连接超时, 读取超时)，单位秒
+        :param retries: 最大重试次数
+        :param backoff_factor: 重试间隔为 backoff_factor * 2^(重试次数-1) 秒
+        """
+        self.timeout = timeout
+        retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=(429, 500, 502, 503, 504), raise_on_status=False)
+        self.adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+        self.session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))  # 不在调用方之间共享cookie
+        self._stats = {}  # host -> HostStats
+        self._stats_lock = threading.Lock()
+
+    def request(self, method, url, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        host = urlsplit(url).netloc
+        start = time.monotonic()
+        error = False
+        try:
+            return self.session.request(method, url, **kwargs)
+        except Exception:
+            error = True
+            raise
+        finally:
+            self._record(host, url, time.monotonic() - start, error)
+
+    def get(self, url, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    async def arequest(self, method, url, **kwargs) -> requests.Response:
+        """
+        异步版本，在线程池中执行请求
+        各处异步调用通常各自用asyncio.run创建事件循环，绑定事件循环的异步连接池无法跨调用复用，
+        这里复用同一个同步连接池
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(self.request, method, url, **kwargs))
+
+    async def aget(self, url, **kwargs) -> requests.Response:
+        return await self.arequest("GET", url, **kwargs)
+
+    async def apost(self, url, **kwargs) -> requests.Response:
+        return await self.arequest("POST", url, **kwargs)
+
+    def get_metrics(self) -> dict:
+        with self._stats_lock:
+            return {
+                host: {
+                    "requests": stats.requests,
+                    "errors": stats.errors,
+                    "connections": stats.connections,
+                    "reuse_rate": round(max(0.0, 1 - stats.connections / stats.requests), 4) if stats.requests else 0.0,
+                    "avg_ms": round(stats.total_time / stats.requests * 1000, 2) if stats.requests else 0.0,
+                    "max_ms": round(stats.max_time * 1000, 2),
+                }
+                for host, stats in self._stats.items()
+            }
+
+    def _record(self, host, url, elapsed, error):
+        connections = self._count_connections(url)
+        with self._stats_lock:
+            stats = self._stats.get(host)
+            if stats is None:
+                stats = self._stats[host] = HostStats()
+            stats.requests += 1
+            stats.errors += 1 if error else 0
+            stats.total_time += elapsed
+            stats.max_time = max(stats.max_time, elapsed)
+            if connections is not None:
+                stats.connections = connections
+
+    def _count_connections(self, url):
+        """
+        统计访问该host的连接池累计新建的连接数，获取失败时返回None
+        同一个host可能因为证书等参数不同有多个连接池
+        """
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        try:
+            pools = self.adapter.poolmanager.pools
+            return sum(pools[key].num_connections for key in pools.keys() if key.key_host == parts.hostname and key.key_port == port)
+        except Exception:
+            return None
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> HttpClient:
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = HttpClient(
+                    pool_connections=conf().get("http_pool_connections", 10),
+                    pool_maxsize=conf().get("http_pool_maxsize", 20),
+                    timeout=tuple(conf().get("http_timeout", [5, 60])),
+                    retries=conf().get("http_retries", 2),
+                    backoff_factor=conf().get("http_backoff_factor", 0.5),
+                )
+                logger.debug("[http_client] shared http client created")
+    return _client
+
+
+def request(method, url, **kwargs) -> requests.Response:
+    return get_client().request(method, url, **kwargs)
+
+
+def get(url, **kwargs) -> requests.Response:
+    return get_client().get(url, **kwargs)
+
+
+def post(url, **kwargs) -> requests.Response:
+    return get_client().post(url, **kwargs)
+
+
+async def arequest(method, url, **kwargs) -> requests.Response:
+    return await get_client().arequest(method, url, **kwargs)
+
+
+async def aget(url, **kwargs) -> requests.Response:
+    return await get_client().aget(url, **kwargs)
+
+
+async def apost(url, **kwargs) -> requests.Response:
+    return await get_client().apost(url, **kwargs)
+
+
+def get_http_metrics():
+    """客户端未创建时返回None"""
+    return _client.get_metrics() if _client else None
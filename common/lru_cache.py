@@ -0,0 +1,98 @@
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+# 所有命名缓存，用于统计命中率
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+class LRUCache:
+    """
+    线程安全的LRU缓存，条目可设置过期时间
+    超过maxsize时淘汰最久未使用的条目
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, name=None):
+        """
+        :param maxsize: 最大条目数
+        :param ttl: 默认过期时间(秒)，None表示不过期
+        :param name: 缓存名称，设置后可通过get_cache_metrics查看命中率
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.name = name
+        self._data = OrderedDict()  # key -> (value, expire_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if name:
+            with _caches_lock:
+                _caches[name] = self
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                self.misses += 1
+                return default
+            value, expire_at = item
+            if expire_at is not None and expire_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=_MISSING):
+        """
+        :param ttl: 本条目的过期时间(秒)，不传使用默认值，None表示不过期
+        """
+        if ttl is _MISSING:
+            ttl = self.ttl
+        expire_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expire_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, _MISSING)
+        if item is _MISSING:
+            return default
+        return item[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self):
+        return len(self._data)
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+def get_cache_metrics() -> dict:
+    with _caches_lock:
+        caches = dict(_caches)
+    return {name: cache.get_metrics() for name, cache in caches.items()}
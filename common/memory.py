@@ -1,3 +1,15 @@
+import os
+
 from common.expired_dict import ExpiredDict
+from common.log import logger
+
+
+def _remove_cached_image(session_id, image):
+    """图片缓存过期或被淘汰时删除本地临时图片"""
+    path = image.get("path") if isinstance(image, dict) else None
+    if path and os.path.isfile(path):
+        os.remove(path)
+        logger.debug("[memory] removed expired cached image {}".format(path))
+
 
-USER_IMAGE_CACHE = ExpiredDict(60 * 3)
\ No newline at end of file
+USER_IMAGE_CACHE = ExpiredDict(60 * 3, maxsize=1000, on_evict=_remove_cached_image)
@@ -0,0 +1,64 @@
+import hashlib
+import json
+import threading
+
+from common.lru_cache import LRUCache
+from config import conf
+
+# 参与缓存key计算的采样参数，其他参数不影响回复内容
+SAMPLING_PARAMS = ("temperature", "top_p", "max_tokens", "frequency_penalty", "presence_penalty")
+
+
+def _normalize(text):
+    # 合并空白字符，首尾空格和换行数量不同的相同提示词视为同一个
+    return " ".join((text or "").split())
+
+
+def _digest(value):
+    return hashlib.sha256(json.dumps(value, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def make_key(model, system_prompt, messages, params=None):
+    """
+    生成缓存key: (模型, 系统提示词哈希, 消息哈希, 采样参数)
+    :param messages: [{"role": ..., "content": ...}]
+    :param params: 采样参数，只取SAMPLING_PARAMS中的参数
+    """
+    normalized = [(message.get("role"), _normalize(message.get("content"))) for message in messages]
+    sampling = tuple(sorted((name, params[name]) for name in SAMPLING_PARAMS if params and params.get(name) is not None))
+    return model, _digest(_normalize(system_prompt)), _digest(normalized), sampling
+
+
+class ReplyCache:
+    """
+    确定性提示词的回复缓存，只缓存调用方明确开启缓存的请求
+    命中率等统计信息可以通过 #stats 查看(缓存名为reply)
+    """
+
+    def __init__(self, maxsize=1000, ttl=24 * 3600):
+        self.cache = LRUCache(maxsize=maxsize, ttl=ttl, name="reply")
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, content):
+        if content:
+            self.cache.set(key, content)
+
+
+_reply_cache = None
+_reply_cache_lock = threading.Lock()
+
+
+def get_reply_cache():
+    """
+    未开启reply_cache_enabled时返回None
+    """
+    global _reply_cache
+    if not conf().get("reply_cache_enabled", False):
+        return None
+    if _reply_cache is None:
+        with _reply_cache_lock:
+            if _reply_cache is None:
+                _reply_cache = ReplyCache(conf().get("reply_cache_size", 1000), conf().get("reply_cache_ttl", 24 * 3600))
+    return _reply_cache
@@ -0,0 +1,97 @@
+# encoding:utf-8
+
+from common.utils import split_string_by_utf8_length
+
+# 中文标点可以直接断句，英文标点后需紧跟空白才断句，避免把 3.14、e.g. 之类的内容拆开
+CJK_BOUNDARIES = "。？！；\n"
+ASCII_BOUNDARIES = ".?!;"
+
+
+class SentenceSegmenter:
+    """
+    流式文本断句器，把模型返回的增量文本拼接成完整的句子段落
+    用法:
+        segmenter = SentenceSegmenter()
+        for delta in stream:
+            for segment in segmenter.feed(delta):
+                send(segment)
+        for segment in segmenter.flush():
+            send(segment)
+    """
+
+    def __init__(self, min_len=10, max_utf8_len=1800):
+        """
+        :param min_len: 段落的最小字符数，过短的句子会和后面的句子合并发送，避免消息过碎
+        :param max_utf8_len: 单条消息的最大utf8字节数，超过时强制拆分
+        """
+        self.min_len = min_len
+        self.max_utf8_len = max_utf8_len
+        self.buffer = ""
+        self.scan_pos = 0  # buffer中已检查过断句的位置
+
+    def feed(self, delta: str) -> list:
+        """
+        追加增量文本，返回已经可以发送的段落
+        """
+        if not delta:
+            return []
+        self.buffer += delta
+        segments = []
+        cut = self._find_cut()
+        while cut > 0:
+            segment = self.buffer[:cut].strip()
+            self.buffer = self.buffer[cut:]
+            self.scan_pos = 0
+            if segment:
+                segments.extend(split_string_by_utf8_length(segment, self.max_utf8_len))
+            cut = self._find_cut()
+        if len(self.buffer.encode("utf-8")) > self.max_utf8_len:
+            # 长时间没有断句符号，按长度强制拆分，保留最后一部分继续累积
+            parts = split_string_by_utf8_length(self.buffer, self.max_utf8_len)
+            segments.extend(part.strip() for part in parts[:-1] if part.strip())
+            self.buffer = parts[-1]
+            self.scan_pos = 0
+        return segments
+
+    def flush(self) -> list:
+        """
+        流结束时调用，返回剩余的文本
+        """
+        segment = self.buffer.strip()
+        self.buffer = ""
+        self.scan_pos = 0
+        if not segment:
+            return []
+        return split_string_by_utf8_length(segment, self.max_utf8_len)
+
+    def _find_cut(self) -> int:
+        """
+        查找第一个满足最小长度的断句位置，返回断句后的下标，找不到返回0
+        """
+        buffer = self.buffer
+        i = self.scan_pos
+        while i < len(buffer):
+            ch = buffer[i]
+            if ch in CJK_BOUNDARIES:
+                cut = i + 1
+            elif ch in ASCII_BOUNDARIES:
+                if i + 1 >= len(buffer):
+                    break  # 需要等下一个字符才能判断是否断句
+                if not buffer[i + 1].isspace():
+                    i += 1
+                    continue
+                cut = i + 1
+            else:
+                i += 1
+                continue
+            # 连续的标点一起归入当前句，如"！！"、"？”"
+            while cut < len(buffer) and (buffer[cut] in CJK_BOUNDARIES or buffer[cut] in ASCII_BOUNDARIES or buffer[cut] in "”’\"')）"):
+                cut += 1
+            if cut >= len(buffer) and buffer[cut - 1] not in "\n":
+                break  # 标点在末尾，可能后面还有标点或引号，等下一段增量
+            if len(buffer[:cut].strip()) >= self.min_len:
+                self.scan_pos = 0
+                return cut
+            i = cut
+        self.scan_pos = i
+        return 0
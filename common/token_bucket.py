@@ -1,39 +1,116 @@
+import asyncio
 import threading
 import time
 
+from common.expired_dict import ExpiredDict
+
+_DEFAULT = object()
+
 
 class TokenBucket:
-    def __init__(self, tpm, timeout=None):
-        self.capacity = int(tpm)  # 令牌桶容量
-        self.tokens = 0  # 初始令牌数为0
+    """
+    令牌桶限流，不使用后台线程，获取令牌时根据距上次计算经过的时间补充令牌
+    令牌不足时预先扣除(令牌数可以为负)，再等待到扣除的令牌补齐，
+    多个线程同时等待时按获取的先后顺序放行
+    """
+
+    def __init__(self, tpm, timeout=None, capacity=None):
+        """
+        :param tpm: 每分钟生成的令牌数
+        :param timeout: 默认的等待令牌超时时间(秒)，None表示一直等待，0表示不等待
+        :param capacity: 令牌桶容量，默认为tpm
+        """
+        self.capacity = int(capacity or tpm)  # 令牌桶容量
+        self.tokens = self.capacity  # 初始时令牌桶是满的
         self.rate = int(tpm) / 60  # 令牌每秒生成速率
         self.timeout = timeout  # 等待令牌超时时间
-        self.cond = threading.Condition()  # 条件变量
-        self.is_running = True
-        # 开启令牌生成线程
-        threading.Thread(target=self._generate_tokens).start()
-
-    def _generate_tokens(self):
-        """生成令牌"""
-        while self.is_running:
-            with self.cond:
-                if self.tokens < self.capacity:
-                    self.tokens += 1
-                self.cond.notify()  # 通知获取令牌的线程
-            time.sleep(1 / self.rate)
-
-    def get_token(self):
-        """获取令牌"""
-        with self.cond:
-            while self.tokens <= 0:
-                flag = self.cond.wait(self.timeout)
-                if not flag:  # 超时
-                    return False
-            self.tokens -= 1
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _reserve(self, weight, timeout):
+        """
+        扣除令牌，返回需要等待的时间(秒)，等待时间超过timeout时不扣除并返回None
+        """
+        weight = min(weight, self.capacity)  # 超过容量的请求按容量计算，否则永远拿不到令牌
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+            wait = max(0.0, (weight - self.tokens) / self.rate)
+            if timeout is not None and wait > timeout:
+                return None
+            self.tokens -= weight
+            return wait
+
+    def get_token(self, weight=1, timeout=_DEFAULT):
+        """
+        获取令牌，令牌不足时阻塞等待
+        :param weight: 需要的令牌数，如按请求的预估token数获取
+        :param timeout: 最长等待时间(秒)，不传使用构造时的timeout
+        :return: 是否获取成功，预计等待时间超过timeout时立即返回False
+        """
+        wait = self._reserve(weight, self.timeout if timeout is _DEFAULT else timeout)
+        if wait is None:
+            return False
+        if wait > 0:
+            time.sleep(wait)
+        return True
+
+    async def aget_token(self, weight=1, timeout=_DEFAULT):
+        """get_token的异步版本，等待时不阻塞事件循环"""
+        wait = self._reserve(weight, self.timeout if timeout is _DEFAULT else timeout)
+        if wait is None:
+            return False
+        if wait > 0:
+            await asyncio.sleep(wait)
         return True
 
+    def try_get_token(self, weight=1):
+        """获取令牌，令牌不足时不等待直接返回False"""
+        return self.get_token(weight, timeout=0)
+
+    def refund(self, weight=1):
+        """退还已扣除的令牌，用于获取令牌后请求因其他原因被拒绝的情况"""
+        weight = min(weight, self.capacity)
+        with self.lock:
+            self.tokens = min(self.capacity, self.tokens + weight)
+
     def close(self):
-        self.is_running = False
+        """没有后台线程，保留该方法以兼容旧的调用方式"""
+        pass
+
+
+class TokenBucketRegistry:
+    """
+    按key(用户、API key、模型等)分别限流的令牌桶集合
+    令牌桶在第一次使用时创建，空闲超过idle_seconds后删除(此时桶早已补满，删除不影响限流)
+    """
+
+    def __init__(self, tpm, timeout=None, capacity=None, idle_seconds=600, maxsize=10000):
+        self.tpm = tpm
+        self.timeout = timeout
+        self.capacity = capacity
+        self.buckets = ExpiredDict(idle_seconds, maxsize=maxsize)
+        self.lock = threading.Lock()
+
+    def get_bucket(self, key) -> TokenBucket:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            with self.lock:
+                bucket = self.buckets.get(key)
+                if bucket is None:
+                    bucket = TokenBucket(self.tpm, self.timeout, self.capacity)
+                    self.buckets[key] = bucket
+        return bucket
+
+    def get_token(self, key, weight=1, timeout=_DEFAULT):
+        return self.get_bucket(key).get_token(weight, timeout)
+
+    async def aget_token(self, key, weight=1, timeout=_DEFAULT):
+        return await self.get_bucket(key).aget_token(weight, timeout)
+
+    def try_get_token(self, key, weight=1):
+        return self.get_bucket(key).try_get_token(weight)
 
 
 if __name__ == "__main__":
@@ -79,7 +79,7 @@ def remove_markdown_symbol(text: str):
     return re.sub(r'\*\*(.*?)\*\*', r'\1', text)
 
 
-async def send_message_to_open_ai_with_retry(prompt, model=None, api_key=None, base_url=None, temperature=0.7, top_p=0.9, max_tokens=2000, retry_count=3):
+async def send_message_to_open_ai_with_retry(prompt, model=None, api_key=None, base_url=None, temperature=0.7, top_p=0.9, max_tokens=2000, retry_count=3, cache=False):
     """
     直接发送消息到OpenAI/DeepSeek API并获取响应，支持重试
     
@@ -92,12 +92,14 @@ async def send_message_to_open_ai_with_retry(prompt, model=None, api_key=None, b
         top_p: top_p参数，控制多样性
         max_tokens: 最大生成token数
         retry_count: 重试次数
+        cache: 提示词是确定性的，开启reply_cache_enabled时相同的请求直接返回缓存的回复
         
     Returns:
         返回API响应的文本内容，如果失败则返回None
     """
-    import aiohttp
     import json
+    from common import http_client
+    from common.reply_cache import get_reply_cache, make_key
     import time
     from common.log import logger
     from config import conf
@@ -128,20 +130,29 @@ async def send_message_to_open_ai_with_retry(prompt, model=None, api_key=None, b
         "max_tokens": max_tokens
     }
     
+    reply_cache = get_reply_cache() if cache else None
+    if reply_cache:
+        cache_key = make_key(model, None, data["messages"], data)
+        content = reply_cache.get(cache_key)
+        if content is not None:
+            logger.info("[send_message_to_open_ai_with_retry] reply cache hit")
+            return content
+
     for attempt in range(retry_count):
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, headers=headers, json=data, timeout=60) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        if "choices" in result and len(result["choices"]) > 0:
-                            content = result["choices"][0]["message"]["content"]
-                            return content
-                        else:
-                            logger.error(f"[send_message_to_open_ai_with_retry] Invalid response format: {result}")
-                    else:
-                        error_text = await response.text()
-                        logger.error(f"[send_message_to_open_ai_with_retry] API返回错误，状态码: {response.status}, 错误: {error_text}")
+            # 使用共享连接池，重试时复用已建立的连接
+            response = await http_client.apost(url, headers=headers, json=data, timeout=(5, 60))
+            if response.status_code == 200:
+                result = response.json()
+                if "choices" in result and len(result["choices"]) > 0:
+                    content = result["choices"][0]["message"]["content"]
+                    if reply_cache:
+                        reply_cache.set(cache_key, content)
+                    return content
+                else:
+                    logger.error(f"[send_message_to_open_ai_with_retry] Invalid response format: {result}")
+            else:
+                logger.error(f"[send_message_to_open_ai_with_retry] API返回错误，状态码: {response.status_code}, 错误: {response.text}")
         except Exception as e:
             logger.error(f"[send_message_to_open_ai_with_retry] 第{attempt+1}次调用API异常: {e}")
             import traceback
@@ -157,31 +168,27 @@ async def send_message_to_open_ai_with_retry(prompt, model=None, api_key=None, b
     return None
 
 
-async def send_reply(reply, msg):
+async def send_reply(reply, context, channel):
     """
-    发送回复消息到指定渠道
+    在共享事件循环中主动推送回复，例如插件在后台生成的补充消息
+    渠道的发送是同步阻塞的，提交到send线程池执行，与正常回复一样经过ON_DECORATE_REPLY和ON_SEND_REPLY事件
+    :param context: 触发本次回复的消息上下文，决定接收者(receiver)
+    :param channel: 接收消息的渠道实例，插件中为e_context["channel"]
     """
-    from bridge.context import Context
-    from channel.chat_message import ChatMessage
+    import asyncio
     from common.log import logger
-    
-    if isinstance(msg, ChatMessage):
-        channel_name = msg.ctype
-        user_id = msg.from_user_id
-        context = Context(msg)
-        
-        try:
-            from common.singleton import singleton
-            from channel.channel_factory import create_channel
-            channel = create_channel(channel_name)
-            if channel:
-                await channel.send(reply, context)
-                logger.info(f"[send_reply] 成功发送消息到用户 {user_id}")
-            else:
-                logger.error(f"[send_reply] 无法创建渠道 {channel_name}")
-        except Exception as e:
-            logger.error(f"[send_reply] 发送消息异常: {e}")
-            import traceback
-            logger.error(f"[send_reply] 异常堆栈: {traceback.format_exc()}")
-    else:
-        logger.error(f"[send_reply] 不支持的消息类型: {type(msg)}")
+    from common.worker_pool import get_worker_pool
+
+    def send():
+        if hasattr(channel, "_send_reply"):
+            channel._send_reply(context, channel._decorate_reply(context, reply))
+        else:
+            channel.send(reply, context)
+
+    try:
+        await asyncio.get_running_loop().run_in_executor(get_worker_pool("send"), send)
+        logger.info(f"[send_reply] 成功发送消息到用户 {context.get('receiver')}")
+    except Exception as e:
+        logger.error(f"[send_reply] 发送消息异常: {e}")
+        import traceback
+        logger.error(f"[send_reply] 异常堆栈: {traceback.format_exc()}")
@@ -0,0 +1,114 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common.log import logger
+from config import conf
+
+# 消息处理流水线的各阶段线程池及默认大小，可通过 {name}_pool_size 配置
+# compose: 插件分发(ON_HANDLE_CONTEXT)，#管理指令、关键词回复等廉价任务
+# generate: 调用大模型、语音识别等耗时任务
+# decorate: 回复装饰及文字转语音
+# send: 发送回复
+DEFAULT_POOL_SIZES = {
+    "compose": 4,
+    "generate": 8,
+    "decorate": 4,
+    "send": 4,
+}
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class WorkerPool(ThreadPoolExecutor):
+    """带排队深度和等待时间统计的线程池"""
+
+    def __init__(self, name, max_workers):
+        super().__init__(max_workers=max_workers, thread_name_prefix="{}_pool".format(name))
+        self.name = name
+        self.max_workers = max_workers
+        self._stat_lock = threading.Lock()
+        self.queued = 0  # 已提交但未开始执行的任务数
+        self.active = 0  # 正在执行的任务数
+        self.submitted = 0
+        self.completed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_run = 0.0
+
+    def submit(self, fn, *args, **kwargs):
+        submit_time = time.monotonic()
+        with self._stat_lock:
+            self.queued += 1
+            self.submitted += 1
+
+        def run():
+            start_time = time.monotonic()
+            wait = start_time - submit_time
+            with self._stat_lock:
+                self.queued -= 1
+                self.active += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._stat_lock:
+                    self.active -= 1
+                    self.completed += 1
+                    self.total_run += time.monotonic() - start_time
+
+        try:
+            future = super().submit(run)
+        except Exception:
+            with self._stat_lock:
+                self.queued -= 1
+                self.submitted -= 1
+            raise
+        # 排队中被取消的任务不会执行run，需要在这里修正排队数
+        future.add_done_callback(lambda f: f.cancelled() and self._on_cancelled())
+        return future
+
+    def _on_cancelled(self):
+        with self._stat_lock:
+            self.queued -= 1
+
+    def get_metrics(self) -> dict:
+        with self._stat_lock:
+            started = self.completed + self.active
+            return {
+                "max_workers": self.max_workers,
+                "queued": self.queued,
+                "active": self.active,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "avg_wait_ms": round(self.total_wait / started * 1000, 2) if started else 0.0,
+                "max_wait_ms": round(self.max_wait * 1000, 2),
+                "avg_run_ms": round(self.total_run / self.completed * 1000, 2) if self.completed else 0.0,
+            }
+
+
+def get_worker_pool(name) -> WorkerPool:
+    """
+    获取指定阶段的线程池，首次使用时按配置创建
+    :param name: 线程池名称，见DEFAULT_POOL_SIZES
+    """
+    pool = _pools.get(name)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(name)
+            if pool is None:
+                max_workers = conf().get("{}_pool_size".format(name)) or DEFAULT_POOL_SIZES.get(name, 4)
+                pool = WorkerPool(name, int(max_workers))
+                _pools[name] = pool
+                logger.info("[WorkerPool] create pool {}, max_workers={}".format(name, max_workers))
+    return pool
+
+
+def get_worker_pools() -> dict:
+    return dict(_pools)
+
+
+def get_pool_metrics() -> dict:
+    return {name: pool.get_metrics() for name, pool in get_worker_pools().items()}
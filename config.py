@@ -49,16 +49,37 @@ available_setting = {
     "image_proxy": True,  # 是否需要图片代理，国内访问LinkAI时需要
     "image_create_prefix": ["画", "看", "找"],  # 开启图片回复的前缀
     "concurrency_in_session": 1,  # 同一会话最多有多少条消息在处理中，大于1可能乱序
+    "async_pipeline": False,  # 是否在事件循环中处理消息，同步的插件和bot仍在各阶段线程池中执行，支持异步的bot直接await，目前支持wechatmp和wechatcom_app
+    "reply_cache_enabled": False,  # 是否缓存确定性提示词(聊天记录分析、命盘解读等)的回复，相同的提问直接返回缓存
+    "reply_cache_size": 1000,  # 最多缓存的回复数
+    "reply_cache_ttl": 86400,  # 回复缓存的过期时间(秒)
+    # 消息处理各阶段的线程池大小
+    "compose_pool_size": 4,  # 插件分发(#管理指令、关键词回复等)
+    "generate_pool_size": 8,  # 调用大模型、语音识别
+    "decorate_pool_size": 4,  # 回复装饰、文字转语音
+    "send_pool_size": 4,  # 发送回复
+    "stream_reply": False,  # 是否流式回复，边生成边按句发送，目前支持wechatmp_service和wechatcom_app
+    "stream_reply_min_len": 10,  # 流式回复时单条消息的最小字数，过短的句子会与后面的句子合并发送
     "image_create_size": "256x256",  # 图片大小,可选有 256x256, 512x512, 1024x1024 (dall-e-3默认为1024x1024)
     "group_chat_exit_group": False,
     # chatgpt会话参数
     "expires_in_seconds": 3600,  # 无操作会话的过期时间
+    "session_max_entries": 1000,  # 内存中最多保留的会话数，超过时最久未使用的会话转存到磁盘，用户再次发消息时加载
     # 人格描述
     "character_desc": "你是ChatGPT, 一个由OpenAI训练的大型语言模型, 你旨在回答并解决人们的任何问题，并且可以使用多种语言与人交流。",
     "conversation_max_tokens": 1000,  # 支持上下文记忆的最多字符数
     # chatgpt限流配置
     "rate_limit_chatgpt": 20,  # chatgpt的调用频率限制
     "rate_limit_dalle": 50,  # openai dalle的调用频率限制
+    "rate_limit_chatgpt_user": 0,  # 每个会话每分钟最多的chatgpt调用次数，0表示不限制
+    "rate_limit_chatgpt_tpm": 0,  # 每个API key和模型每分钟最多发送的预估prompt token数，0表示不限制
+    "rate_limit_wait_seconds": 10,  # 全局限流时最长等待时间(秒)，超过时直接提示用户稍后再试
+    # 共享HTTP客户端，同一个host的请求复用连接
+    "http_pool_connections": 10,  # 缓存连接池的host数
+    "http_pool_maxsize": 20,  # 每个host的最大连接数
+    "http_timeout": [5, 60],  # 未指定超时的请求使用的(连接超时, 读取超时)，单位秒
+    "http_retries": 2,  # 连接失败的重试次数，GET等幂等请求在429和5xx时也会重试
+    "http_backoff_factor": 0.5,  # 重试间隔为 backoff_factor * 2^(重试次数-1) 秒
     # chatgpt api参数 参考https://platform.openai.com/docs/api-reference/chat/create
     "temperature": 0.9,
     "top_p": 1,
@@ -103,6 +124,9 @@ available_setting = {
     "text_to_voice": "openai",  # 语音合成引擎，支持openai,baidu,google,azure,xunfei,ali,pytts(offline),elevenlabs,edge(online)
     "text_to_voice_model": "tts-1",
     "tts_voice_id": "alloy",
+    "tts_cache_enabled": True,  # 是否缓存语音合成结果，相同的文本(欢迎语、提示语等)直接复用之前合成的音频
+    "tts_cache_max_mb": 100,  # 语音合成缓存的磁盘空间上限(MB)
+    "tts_cache_max_text_length": 500,  # 超过该长度的文本不缓存
     # baidu 语音api配置， 使用百度语音识别和语音合成时需要
     "baidu_app_id": "",
     "baidu_api_key": "",
@@ -134,8 +158,16 @@ available_setting = {
     "wechatmp_app_id": "",  # 微信公众平台的appID
     "wechatmp_app_secret": "",  # 微信公众平台的appsecret
     "wechatmp_aes_key": "",  # 微信公众平台的EncodingAESKey，加密模式需要
+    "wechatmp_reply_state_ttl": 3600,  # 被动回复模式下用户未拉取的缓存回复和请求计数的有效期(秒)，过期后删除未发送的素材
+    "wechatmp_reply_state_max_users": 10000,  # 被动回复模式下最多保存状态的用户数，超过时淘汰最久未访问的用户
     "chat_record_analysis_enabled": False,  # 添加这一行
     "chat_record_direct_process": False,
+    # 聊天记录截图OCR服务配置
+    "ocr_workers": 2,  # OCR工作进程数，每个进程加载一个模型
+    "ocr_cpu_threads": 2,  # 每个OCR模型使用的CPU线程数
+    "ocr_queue_size": 20,  # 排队等待的OCR任务上限，超过时直接拒绝
+    "ocr_timeout": 60,  # 单张图片OCR的超时时间(秒)，超时后重启工作进程
+    "ocr_warmup": True,  # 开启聊天记录分析时，启动后在后台预加载OCR模型
     "use_simple_image_process": False,
     # wechatcom的通用配置
     "wechatcom_corp_id": "",  # 企业微信公司的corpID
@@ -185,12 +217,24 @@ available_setting = {
     "web_port": 9899,
     "character_desc_file": "",
     "single_reply_max_len": int,
+    # MySQL连接池配置
+    "mysql_pool_size": 10,  # 最大连接数
+    "mysql_pool_timeout": 10,  # 等待空闲连接的超时时间(秒)
+    "mysql_max_lifetime": 3600,  # 连接的最大存活时间(秒)，需小于MySQL的wait_timeout
+    "mysql_ping_interval": 60,  # 连接空闲超过该时间(秒)后，使用前先ping检查
+    "user_cache_size": 10000,  # 用户信息缓存的最大用户数
+    "user_cache_ttl": 600,  # 用户信息缓存的过期时间(秒)
+    "privacy_cache_size": 10000,  # 隐私协议同意状态缓存的最大用户数
+    "privacy_cache_ttl": 3600,  # 已同意状态的缓存时间(秒)
+    "privacy_cache_unagreed_ttl": 5,  # 未同意状态的缓存时间(秒)，隐私服务进程中的更新最多延迟这么久生效
 }
 
 
 class Config(dict):
     def __init__(self, d=None):
         super().__init__()
+        # 每次修改配置项时递增，用于判断依赖配置预先构建的对象(如触发词匹配器)是否需要重建
+        self.version = 0
         if d is None:
             d = {}
         for k, v in d.items():
@@ -206,6 +250,7 @@ class Config(dict):
     def __setitem__(self, key, value):
         if key not in available_setting:
             raise Exception("key {} not in available_setting".format(key))
+        self.version += 1
         return super().__setitem__(key, value)
 
     def get(self, key, default=None):
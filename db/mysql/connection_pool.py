@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+from collections import deque
+
+from common.log import logger
+
+
+class PoolTimeoutError(Exception):
+    """等待空闲连接超时"""
+    pass
+
+
+class ConnectionPool:
+    """
+    有上限的数据库连接池
+    - 连接借出/归还，连接数达到上限时等待其他线程归还
+    - 空闲超过ping_interval的连接在借出前ping一次，断开的连接关闭后重新创建
+    - 存活超过max_lifetime的连接在归还或借出时关闭，避免被MySQL的wait_timeout断开
+    """
+
+    def __init__(self, creator, max_size=10, timeout=10, max_lifetime=3600, ping_interval=60):
+        """
+        :param creator: 创建新连接的函数
+        :param max_size: 最大连接数
+        :param timeout: 等待空闲连接的超时时间(秒)
+        :param max_lifetime: 连接的最大存活时间(秒)
+        :param ping_interval: 连接空闲超过该时间(秒)后，借出前先检查连接是否可用
+        """
+        self.creator = creator
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.ping_interval = ping_interval
+        self._cond = threading.Condition()
+        self._idle = deque()  # (connection, created_at, last_used)
+        self._created_at = {}  # id(connection) -> 创建时间，包含借出中的连接
+        self._size = 0  # 已创建(含正在创建)的连接数
+        # 统计信息
+        self.checkouts = 0
+        self.timeouts = 0
+        self.created = 0
+        self.closed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def acquire(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        conn = None
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn, created_at, last_used = self._idle.pop()
+                    if time.monotonic() - created_at > self.max_lifetime:
+                        self._discard(conn)
+                        conn = None
+                        continue
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeoutError("wait for mysql connection timeout after {}s".format(self.timeout))
+                self._cond.wait(remaining)
+            self._record_wait(time.monotonic() - start)
+
+        if conn is None:
+            return self._create()
+        if time.monotonic() - last_used > self.ping_interval:
+            try:
+                conn.ping(reconnect=False)
+            except Exception as e:
+                logger.warning("[ConnectionPool] ping failed, reconnect: {}".format(e))
+                with self._cond:
+                    self._discard(conn)
+                    self._size += 1
+                return self._create()
+        return conn
+
+    def release(self, conn, broken=False):
+        """
+        归还连接
+        :param broken: 连接已不可用(如执行时断开)，直接关闭
+        """
+        with self._cond:
+            created_at = self._created_at.get(id(conn))
+            if created_at is None:
+                return  # 不是本连接池的连接或已关闭
+            if broken or time.monotonic() - created_at > self.max_lifetime:
+                self._discard(conn)
+            else:
+                self._idle.append((conn, created_at, time.monotonic()))
+            self._cond.notify()
+
+    def close_all(self):
+        with self._cond:
+            while self._idle:
+                conn, _, _ = self._idle.pop()
+                self._discard(conn)
+            self._cond.notify_all()
+
+    def get_metrics(self) -> dict:
+        with self._cond:
+            return {
+                "max_size": self.max_size,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "created": self.created,
+                "closed": self.closed,
+                "avg_wait_ms": round(self.total_wait / self.checkouts * 1000, 2) if self.checkouts else 0.0,
+                "max_wait_ms": round(self.max_wait * 1000, 2),
+            }
+
+    # 在已占用的名额上创建新连接
+    def _create(self):
+        try:
+            conn = self.creator()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._created_at[id(conn)] = time.monotonic()
+            self.created += 1
+        return conn
+
+    # 调用方需持有self._cond
+    def _discard(self, conn):
+        self._created_at.pop(id(conn), None)
+        self._size -= 1
+        self.closed += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    # 调用方需持有self._cond
+    def _record_wait(self, wait):
+        self.checkouts += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
@@ -1,3 +1,5 @@
+from datetime import datetime
+
 from db.mysql.model import Dialog
 from db.mysql.mysql_manager import mysql
 
@@ -61,8 +63,8 @@ def insert_dialog(user_id, ask_type, ask_content):
     )
 
     if dialog_id:
-        # 插入成功，根据ID查询并返回新插入的对话对象
-        return mysql.select_one("SELECT * FROM ab_dialog WHERE id = %s", (dialog_id,), Dialog)
+        # 插入成功，直接构造对话对象，不再回查
+        return Dialog(id=dialog_id, user_id=user_id, ask_type=ask_type, ask_content=ask_content, ask_time=datetime.now())
     else:
         return None
 
@@ -1,24 +1,113 @@
+from common.lru_cache import LRUCache
+from config import conf
 from db.mysql.model import User
 from db.mysql.mysql_manager import mysql
 
 
+# 用户信息缓存，同一份数据按id和openid两个key缓存，缓存的是字段值，每次取出时构造新的User对象
+# 隐私协议由独立的隐私服务进程更新，本进程收不到变更通知，而隐私状态只会从0(未授权)变为授权，
+# 所以只缓存已授权的用户，未授权的用户每次都从数据库读取，保证授权后立即生效
+_user_cache = LRUCache(conf().get("user_cache_size", 10000), conf().get("user_cache_ttl", 600), name="user")
+
+
+def _id_key(id):
+    try:
+        return "id", int(id)
+    except (TypeError, ValueError):
+        return "id", id
+
+
+def _to_row(user):
+    return {column.name: getattr(user, column.name, None) for column in user.__table__.columns}
+
+
+def _cache_user(user):
+    if not user or not user.id or not user.privacy_status:
+        return
+    row = _to_row(user)
+    _user_cache.set(_id_key(user.id), row)
+    if user.openid:
+        _user_cache.set(("openid", user.openid), row)
+
+
+def _get_cached_user(key):
+    row = _user_cache.get(key)
+    return User.from_dict(row) if row else None
+
+
+def invalidate_user(user_id=None, openid=None):
+    """清除用户缓存，隐私状态等信息在其他地方变更时调用"""
+    rows = []
+    if user_id:
+        rows.append(_user_cache.pop(_id_key(user_id)))
+    if openid:
+        rows.append(_user_cache.pop(("openid", openid)))
+    for row in rows:
+        if row:
+            _user_cache.pop(_id_key(row["id"]))
+            _user_cache.pop(("openid", row["openid"]))
+
+
 def get_user_by_id(id):
-    return mysql.select_one("select * from ab_user where id = %s", (id,), User)
+    user = _get_cached_user(_id_key(id))
+    if not user:
+        user = mysql.select_one("select * from ab_user where id = %s", (id,), User)
+        _cache_user(user)
+    return user
 
 
 def get_user_by_openid(openid):
+    user = _get_cached_user(("openid", openid))
+    if user:
+        return user
     user = mysql.select_one("select * from ab_user where openid = %s", (openid,), User)
     if not user:
         user = insert_user(openid)
+    _cache_user(user)
     return user
 
 
+def get_user_with_dialog_flags(openid, chating_hour=2):
+    """
+    一次查询获取用户及其对话状态，用户不存在时自动创建
+    :param chating_hour: 判断最近是否有对话的时间范围(小时)
+    :return: (user, 最近chating_hour小时内是否有对话, 是否有未回复的对话)
+    """
+    user = _get_cached_user(("openid", openid))
+    if user:
+        # 用户已缓存，只查询对话状态
+        row = mysql.select_one(
+            "SELECT "
+            "EXISTS(SELECT 1 FROM ab_dialog d WHERE d.user_id = %s AND d.ask_time > DATE_SUB(NOW(), INTERVAL %s HOUR)) AS has_recent_dialog, "
+            "EXISTS(SELECT 1 FROM ab_dialog d WHERE d.user_id = %s AND d.reply_time is null) AS has_unreply_dialog",
+            (user.id, chating_hour, user.id,)
+        )
+        return user, bool(row["has_recent_dialog"]), bool(row["has_unreply_dialog"])
+
+    row = mysql.select_one(
+        "SELECT u.*, "
+        "EXISTS(SELECT 1 FROM ab_dialog d WHERE d.user_id = u.id AND d.ask_time > DATE_SUB(NOW(), INTERVAL %s HOUR)) AS has_recent_dialog, "
+        "EXISTS(SELECT 1 FROM ab_dialog d WHERE d.user_id = u.id AND d.reply_time is null) AS has_unreply_dialog "
+        "FROM ab_user u WHERE u.openid = %s",
+        (chating_hour, openid,)
+    )
+    if not row:
+        # 新用户没有任何对话记录
+        return insert_user(openid), False, False
+    has_recent_dialog = bool(row.pop("has_recent_dialog"))
+    has_unreply_dialog = bool(row.pop("has_unreply_dialog"))
+    user = User.from_dict(row)
+    _cache_user(user)
+    return user, has_recent_dialog, has_unreply_dialog
+
+
 def insert_user(openid):
     # 执行插入操作并获取自增ID
     user_id = mysql.insert_and_get_id("INSERT INTO ab_user (openid) VALUES (%s)", (openid,))
-    
+
     if user_id:
         # 插入成功，根据ID查询并返回新插入的用户对象
+        # 每个用户只插入一次，回查以数据库中的实际默认值(剩余次数、隐私状态、时间)为准
         return mysql.select_one("SELECT * FROM ab_user WHERE id = %s", (user_id,), User)
     else:
         return None
@@ -53,4 +142,12 @@ def update_user(user):
     if update_params:
         sql += ", ".join(update_params) + " where id = %s"
         update_values.append(user.id)
-        mysql.update(sql, tuple(update_values))
\ No newline at end of file
+        mysql.update(sql, tuple(update_values))
+
+        # 写穿缓存：把更新的字段合并到已缓存的数据中，未缓存的用户下次读取时再加载
+        row = _user_cache.get(_id_key(user.id))
+        invalidate_user(user.id, user.openid)
+        if row:
+            row = dict(row)
+            row.update({key: value for key, value in _to_row(user).items() if value is not None and key not in exclude_fields})
+            _cache_user(User.from_dict(row))
\ No newline at end of file
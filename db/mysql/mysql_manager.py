@@ -2,11 +2,11 @@
 # -*- coding: utf-8 -*-
 
 import pymysql
-import threading
 from contextlib import contextmanager
 from common.log import logger
 from common.singleton import singleton
 from config import conf
+from db.mysql.connection_pool import ConnectionPool
 from db.mysql.model import User
 
 
@@ -35,38 +35,54 @@ class MysqlManager:
             self.password = password or 'Yaoqi100@'
             self.database = database or 'aibot'
             self.charset = 'utf8mb4'
-        self._local = threading.local()
+        self.pool = ConnectionPool(
+            self._create_connection,
+            max_size=conf().get("mysql_pool_size", 10),
+            timeout=conf().get("mysql_pool_timeout", 10),
+            max_lifetime=conf().get("mysql_max_lifetime", 3600),
+            ping_interval=conf().get("mysql_ping_interval", 60),
+        )
 
-    def _get_connection(self):
-        """获取线程本地的数据库连接"""
-        if not hasattr(self._local, 'connection'):
-            try:
-                self._local.connection = pymysql.connect(
-                    host=self.host,
-                    port=self.port,
-                    user=self.user,
-                    password=self.password,
-                    database=self.database,
-                    charset=self.charset,
-                    autocommit=True,
-                    cursorclass=pymysql.cursors.DictCursor
-                )
-            except Exception as e:
-                raise e
-        return self._local.connection
+    def _create_connection(self):
+        """创建新的数据库连接，由连接池调用"""
+        return pymysql.connect(
+            host=self.host,
+            port=self.port,
+            user=self.user,
+            password=self.password,
+            database=self.database,
+            charset=self.charset,
+            autocommit=True,
+            cursorclass=pymysql.cursors.DictCursor
+        )
 
     @contextmanager
     def _get_cursor(self):
-        """获取数据库游标的上下文管理器"""
-        connection = self._get_connection()
-        cursor = connection.cursor()
+        """从连接池借出连接并获取游标的上下文管理器，结束后归还连接"""
+        connection = self.pool.acquire()
+        cursor = None
+        broken = False
         try:
+            cursor = connection.cursor()
             yield cursor
+        except (pymysql.err.OperationalError, pymysql.err.InterfaceError) as e:
+            # 连接已断开，不再放回连接池
+            broken = True
+            logger.error(f"[DatabaseManager] 数据库连接异常: {str(e)}")
+            raise e
         except Exception as e:
             logger.error(f"[DatabaseManager] 数据库操作失败: {str(e)}")
             raise e
         finally:
-            cursor.close()
+            if cursor:
+                try:
+                    cursor.close()
+                except Exception:
+                    broken = True
+            self.pool.release(connection, broken)
+
+    def get_pool_metrics(self) -> dict:
+        return self.pool.get_metrics()
 
     def select_list(self, sql, params=None, return_type=None):
         with self._get_cursor() as cursor:
@@ -7,9 +7,10 @@ import plugins
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
 from common.log import logger
+from common.sentence_segmenter import ASCII_BOUNDARIES, CJK_BOUNDARIES
 from plugins import *
 
-from .lib.WordsSearch import WordsSearch
+from .lib.WordsSearchCompact import WordsSearchCompact
 
 
 @plugins.register(
@@ -35,7 +36,7 @@ class Banwords(Plugin):
                     with open(config_path, "w") as f:
                         json.dump(conf, f, indent=4)
 
-            self.searchr = WordsSearch()
+            self.searchr = WordsSearchCompact()
             self.action = conf["action"]
             banwords_path = os.path.join(curdir, "banwords.txt")
             with open(banwords_path, "r", encoding="utf-8") as f:
@@ -44,7 +45,8 @@ class Banwords(Plugin):
                     word = line.strip()
                     if word:
                         words.append(word)
-            self.searchr.SetKeywords(words)
+            # 词库不变时直接加载上次构建的自动机
+            self.searchr.SetKeywords(words, os.path.join(curdir, "banwords.dat"))
             self.handlers[Event.ON_HANDLE_CONTEXT] = self.on_handle_context
             if conf.get("reply_filter", True):
                 self.handlers[Event.ON_DECORATE_REPLY] = self.on_decorate_reply
@@ -77,10 +79,14 @@ class Banwords(Plugin):
                 return
 
     def on_decorate_reply(self, e_context: EventContext):
-        if e_context["reply"].type not in [ReplyType.TEXT]:
+        reply = e_context["reply"]
+        if reply.type == ReplyType.TEXT_STREAM:
+            # 流式回复在发送时才生成，包装增量文本，按句检查后再交给渠道发送
+            reply.content = self._filter_stream(reply.content)
+            return
+        if reply.type not in [ReplyType.TEXT]:
             return
 
-        reply = e_context["reply"]
         content = reply.content
         if self.reply_action == "ignore":
             f = self.searchr.FindFirst(content)
@@ -96,5 +102,41 @@ class Banwords(Plugin):
                 e_context.action = EventAction.CONTINUE
                 return
 
+    def _filter_stream(self, stream):
+        """
+        缓存增量文本直到断句符号，整句检查敏感词后再输出，敏感词不会被拆在两次检查之间
+        ignore: 句子中有敏感词时停止输出(已发送的句子无法撤回)
+        replace: 替换句子中的敏感词
+        """
+        buffer = ""
+        for delta in stream:
+            buffer += delta or ""
+            cut = max(buffer.rfind(ch) for ch in CJK_BOUNDARIES + ASCII_BOUNDARIES) + 1
+            if cut <= 0:
+                continue
+            text, buffer = buffer[:cut], buffer[cut:]
+            text = self._filter_stream_text(text)
+            if text is None:
+                if hasattr(stream, "close"):
+                    stream.close()
+                return
+            yield text
+        if buffer:
+            text = self._filter_stream_text(buffer)
+            if text is not None:
+                yield text
+
+    def _filter_stream_text(self, text):
+        """返回过滤后的文本，需要停止输出时返回None"""
+        if self.reply_action == "ignore":
+            f = self.searchr.FindFirst(text)
+            if f:
+                logger.info("[Banwords] %s in stream reply, stop sending" % f["Keyword"])
+                return None
+        elif self.reply_action == "replace":
+            if self.searchr.ContainsAny(text):
+                return self.searchr.Replace(text)
+        return text
+
     def get_help_text(self, **kwargs):
         return "过滤消息中的敏感词。"
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# 与WordsSearch接口和匹配结果相同的Aho-Corasick实现
+# 自动机保存为按状态编号索引的数组(转移表、失败指针、输出表)，不再为每个节点创建对象，
+# 转移表只保存trie的边，匹配时没有方法调用，每个字符通常只需一次字典查找
+# 构建结果可以序列化到磁盘，词库不变时启动直接加载
+
+import hashlib
+import marshal
+import os
+from collections import deque
+
+__all__ = ['WordsSearchCompact']
+
+# 序列化格式版本，格式变化时递增，旧文件会被忽略并重新构建
+_FORMAT_VERSION = 1
+
+
+def _keywords_digest(keywords):
+    return hashlib.sha256("\n".join(keywords).encode("utf-8")).hexdigest()
+
+
+class WordsSearchCompact():
+    def __init__(self):
+        self._keywords = []
+        self._indexs = []
+        self._goto = [{}]  # 状态 -> {字符: 下一个状态}，即trie的边，状态0为根
+        self._fail = [0]  # 状态 -> 失败指针
+        self._outputs = [None]  # 状态 -> 匹配到的关键词下标元组(包含失败链上的输出)，非终止状态为None
+
+    def SetKeywords(self, keywords, cache_file=None):
+        """
+        :param keywords: 关键词列表
+        :param cache_file: 自动机的序列化文件，词库未变化时直接加载，否则重新构建并写入
+        """
+        keywords = list(keywords)
+        if cache_file and self.Load(cache_file, keywords):
+            return
+        self._build(keywords)
+        if cache_file:
+            try:
+                self.Save(cache_file)
+            except OSError:
+                pass  # 写入失败不影响使用，下次启动重新构建
+
+    def _build(self, keywords):
+        self._keywords = keywords
+        self._indexs = list(range(len(keywords)))
+
+        # 构建trie
+        goto = [{}]
+        own = [[]]
+        for i, keyword in enumerate(keywords):
+            s = 0
+            for ch in keyword:
+                nxt = goto[s].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[s][ch] = nxt
+                    goto.append({})
+                    own.append([])
+                s = nxt
+            own[s].append(i)
+
+        # 按层遍历计算失败指针，输出表合并失败链上的输出(本状态的关键词在前，与WordsSearch一致)
+        count = len(goto)
+        fail = [0] * count
+        outputs = [None] * count
+        queue = deque(goto[0].values())
+        while queue:
+            s = queue.popleft()
+            f = fail[s]
+            results = own[s] + [i for i in (outputs[f] or ()) if i not in own[s]]
+            outputs[s] = tuple(results) if results else None
+            for ch, child in goto[s].items():
+                # 子节点的失败指针: 沿s的失败链找到第一个有ch转移的状态
+                r = f
+                while r and ch not in goto[r]:
+                    r = fail[r]
+                fail[child] = goto[r].get(ch, 0)
+                queue.append(child)
+
+        self._goto = goto
+        self._fail = fail
+        self._outputs = outputs
+
+    def Save(self, path):
+        data = (_FORMAT_VERSION, _keywords_digest(self._keywords), self._keywords, self._goto, self._fail, self._outputs)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            marshal.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def Load(self, path, keywords):
+        """
+        加载序列化的自动机，文件不存在、格式不兼容或词库已变化时返回False
+        """
+        try:
+            with open(path, "rb") as f:
+                version, digest, saved_keywords, goto, fail, outputs = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            return False
+        if version != _FORMAT_VERSION or digest != _keywords_digest(keywords) or saved_keywords != keywords:
+            return False
+        self._keywords = saved_keywords
+        self._indexs = list(range(len(saved_keywords)))
+        self._goto = goto
+        self._fail = fail
+        self._outputs = outputs
+        return True
+
+    def _scan(self, text):
+        """
+        逐字符运行自动机，遇到终止状态时产出 (结束位置, 输出元组)
+        """
+        goto = self._goto
+        fail = self._fail
+        outputs = self._outputs
+        state = 0
+        for index, ch in enumerate(text):
+            nxt = goto[state].get(ch)
+            while nxt is None and state:
+                state = fail[state]
+                nxt = goto[state].get(ch)
+            state = nxt or 0
+            out = outputs[state]
+            if out:
+                yield index, out
+
+    def _result(self, item, index):
+        keyword = self._keywords[item]
+        return { "Keyword": keyword, "Success": True, "End": index, "Start": index + 1 - len(keyword), "Index": self._indexs[item] }
+
+    def FindFirst(self, text):
+        for index, out in self._scan(text):
+            return self._result(out[0], index)
+        return None
+
+    def FindAll(self, text):
+        return [self._result(item, index) for index, out in self._scan(text) for item in out]
+
+    def ContainsAny(self, text):
+        for _ in self._scan(text):
+            return True
+        return False
+
+    def Replace(self, text, replaceChar = '*'):
+        result = None
+        keywords = self._keywords
+        for index, out in self._scan(text):
+            if result is None:
+                result = list(text)
+            start = index + 1 - len(keywords[out[0]])
+            result[start:index + 1] = [replaceChar] * (index + 1 - start)
+        return text if result is None else ''.join(result)
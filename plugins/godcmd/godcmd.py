@@ -4,16 +4,24 @@ import json
 import os
 import random
 import string
+import sys
 import logging
 from typing import Tuple
 
 import bridge.bridge
 import plugins
+from bot.session_manager import get_session_metrics
 from bridge.bridge import Bridge
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
 from common import const
+from common.http_client import get_http_metrics
+from common.lru_cache import get_cache_metrics
+from common.worker_pool import get_pool_metrics
 from config import conf, load_config, global_config
+from channel.wechatmp.reply_state import get_reply_state_metrics
+from service.ocr_service import get_ocr_metrics
+from voice.tts_cache import get_tts_cache_metrics
 from plugins import *
 
 # 定义指令集
@@ -131,6 +139,14 @@ ADMIN_COMMANDS = {
         "alias": ["debug", "调试模式", "DEBUG"],
         "desc": "开启机器调试日志",
     },
+    "stats": {
+        "alias": ["stats", "运行状态"],
+        "desc": "查看线程池等运行指标",
+    },
+    "pstats": {
+        "alias": ["pstats", "插件耗时"],
+        "desc": "查看各插件处理事件的耗时，加参数reset清空统计",
+    },
 }
 
 
@@ -170,6 +186,64 @@ def get_help_text(isadmin, isgroup):
     return help_text
 
 
+def get_stats_text():
+    stats_text = "线程池：\n"
+    for name, metrics in get_pool_metrics().items():
+        stats_text += f"{name}: 线程{metrics['max_workers']} 执行中{metrics['active']} 排队{metrics['queued']} 已完成{metrics['completed']} "
+        stats_text += f"平均等待{metrics['avg_wait_ms']}ms 最长等待{metrics['max_wait_ms']}ms 平均耗时{metrics['avg_run_ms']}ms\n"
+    cache_metrics = get_cache_metrics()
+    if cache_metrics:
+        stats_text += "\n缓存：\n"
+        for name, metrics in cache_metrics.items():
+            stats_text += f"{name}: 条目{metrics['size']}/{metrics['maxsize']} 命中率{metrics['hit_rate']:.2%} 命中{metrics['hits']} 未命中{metrics['misses']} 淘汰{metrics['evictions']}\n"
+    session_metrics = get_session_metrics()
+    if session_metrics:
+        stats_text += "\n会话：\n"
+        for name, metrics in session_metrics.items():
+            stats_text += f"{name}: 内存中{metrics['resident']}/{metrics['max_entries']} 磁盘中{metrics['spilled']} 消息{metrics['messages']}条 约{metrics['approx_memory_kb']}KB "
+            stats_text += f"命中{metrics['hits']} 从磁盘加载{metrics['loads']} 转存{metrics['spills']} 过期{metrics['expirations']}\n"
+    ocr_metrics = get_ocr_metrics()
+    if ocr_metrics:
+        stats_text += "\nOCR服务：\n"
+        stats_text += f"进程{ocr_metrics['workers']} 执行中{ocr_metrics['busy']} 排队{ocr_metrics['queued']} 已完成{ocr_metrics['completed']} 失败{ocr_metrics['failed']} "
+        stats_text += f"超时{ocr_metrics['timeouts']} 拒绝{ocr_metrics['rejected']} 平均等待{ocr_metrics['avg_wait_ms']}ms 平均耗时{ocr_metrics['avg_run_ms']}ms 最长耗时{ocr_metrics['max_run_ms']}ms\n"
+        stats_text += f"已加载模型{ocr_metrics['loaded']} 累计加载{ocr_metrics['loads']}次 平均加载耗时{ocr_metrics['avg_load_ms']}ms 模型进程内存{ocr_metrics['rss_mb']}MB\n"
+    tts_metrics = get_tts_cache_metrics()
+    if tts_metrics:
+        stats_text += "\n语音合成缓存：\n"
+        stats_text += f"文件{tts_metrics['files']} 占用{tts_metrics['size_mb']}/{tts_metrics['max_mb']}MB 命中率{tts_metrics['hit_rate']:.2%} 命中{tts_metrics['hits']} 未命中{tts_metrics['misses']}\n"
+    reply_state_metrics = get_reply_state_metrics()
+    if reply_state_metrics:
+        stats_text += "\n公众号被动回复：\n"
+        stats_text += f"用户{reply_state_metrics['users']}/{reply_state_metrics['max_users']} 处理中{reply_state_metrics['running']} 待拉取回复{reply_state_metrics['replies']} 等待中的请求{reply_state_metrics['requests']} "
+        stats_text += f"过期或淘汰{reply_state_metrics['evicted']} 丢弃回复{reply_state_metrics['evicted_replies']} 删除素材{reply_state_metrics['media_deleted']}\n"
+    http_metrics = get_http_metrics()
+    if http_metrics:
+        stats_text += "\nHTTP连接：\n"
+        for host, metrics in http_metrics.items():
+            stats_text += f"{host}: 请求{metrics['requests']} 失败{metrics['errors']} 新建连接{metrics['connections']} 复用率{metrics['reuse_rate']:.2%} 平均耗时{metrics['avg_ms']}ms 最长耗时{metrics['max_ms']}ms\n"
+    # 只有使用了数据库的渠道才会加载mysql_manager，这里不主动加载
+    mysql_manager = sys.modules.get("db.mysql.mysql_manager")
+    if mysql_manager:
+        metrics = mysql_manager.mysql.get_pool_metrics()
+        stats_text += "\n数据库连接池：\n"
+        stats_text += f"连接{metrics['size']}/{metrics['max_size']} 使用中{metrics['in_use']} 空闲{metrics['idle']} 借出{metrics['checkouts']}次 超时{metrics['timeouts']}次 "
+        stats_text += f"新建{metrics['created']} 关闭{metrics['closed']} 平均等待{metrics['avg_wait_ms']}ms 最长等待{metrics['max_wait_ms']}ms\n"
+    return stats_text
+
+
+def get_plugin_stats_text():
+    plugin_metrics = PluginManager().stats.get_metrics()
+    if not plugin_metrics:
+        return "暂无插件耗时统计"
+    stats_text = "插件耗时(按累计耗时排序)：\n"
+    for name, events in plugin_metrics.items():
+        for event, metrics in events.items():
+            stats_text += f"{name} {event}: 调用{metrics['calls']} 中断{metrics['breaks']} 异常{metrics['errors']} "
+            stats_text += f"平均{metrics['avg_ms']}ms p50≤{metrics['p50_ms']}ms p99≤{metrics['p99_ms']}ms 最长{metrics['max_ms']}ms 累计{metrics['total_ms']}ms\n"
+    return stats_text
+
+
 @plugins.register(
     name="Godcmd",
     desire_priority=999,
@@ -352,6 +426,14 @@ class Godcmd(Plugin):
                             else:
                                 logger.setLevel(logging.DEBUG)
                                 ok, result = True, "DEBUG模式已开启"
+                        elif cmd == "stats":
+                            ok, result = True, get_stats_text()
+                        elif cmd == "pstats":
+                            if args and args[0] == "reset":
+                                PluginManager().stats.reset()
+                                ok, result = True, "插件耗时统计已清空"
+                            else:
+                                ok, result = True, get_plugin_stats_text()
                         elif cmd == "plist":
                             plugins = PluginManager().list_plugins()
                             ok = True
@@ -5,6 +5,7 @@ import importlib.util
 import json
 import os
 import sys
+import time
 
 from common.log import logger
 from common.singleton import singleton
@@ -12,6 +13,7 @@ from common.sorted_dict import SortedDict
 from config import conf, remove_plugin_config, write_plugin_config
 
 from .event import *
+from .plugin_stats import PluginStats
 
 
 @singleton
@@ -20,6 +22,10 @@ class PluginManager:
         self.plugins = SortedDict(lambda k, v: v.priority, reverse=True)
         self.listening_plugins = {}
         self.instances = {}
+        # 事件 -> ((插件名, 处理函数), ...)，只包含已启用的插件，按优先级排序
+        # 插件启用、禁用、重载或优先级变化时整体重建，emit_event无需逐个检查插件状态
+        self.handler_chains = {}
+        self.stats = PluginStats()
         self.pconf = {}
         self.current_plugin_path = None
         self.loaded = {}
@@ -136,6 +142,19 @@ class PluginManager:
     def refresh_order(self):
         for event in self.listening_plugins.keys():
             self.listening_plugins[event].sort(key=lambda name: self.plugins[name].priority, reverse=True)
+        self.rebuild_handler_chains()
+
+    def rebuild_handler_chains(self):
+        chains = {}
+        for event, names in self.listening_plugins.items():
+            chain = []
+            for name in names:
+                if name in self.plugins and self.plugins[name].enabled and name in self.instances:
+                    handler = self.instances[name].handlers.get(event)
+                    if handler:
+                        chain.append((name, handler))
+            chains[event] = tuple(chain)
+        self.handler_chains = chains
 
     def activate_plugins(self):  # 生成新开启的插件实例
         failed_plugins = []
@@ -188,15 +207,22 @@ class PluginManager:
         self.activate_plugins()
 
     def emit_event(self, e_context: EventContext, *args, **kwargs):
-        if e_context.event in self.listening_plugins:
-            for name in self.listening_plugins[e_context.event]:
-                if self.plugins[name].enabled and e_context.action == EventAction.CONTINUE:
-                    logger.debug("Plugin %s triggered by event %s" % (name, e_context.event))
-                    instance = self.instances[name]
-                    instance.handlers[e_context.event](e_context, *args, **kwargs)
-                    if e_context.is_break():
-                        e_context["breaked_by"] = name
-                        logger.debug("Plugin %s breaked event %s" % (name, e_context.event))
+        event = e_context.event
+        for name, handler in self.handler_chains.get(event, ()):
+            if e_context.action != EventAction.CONTINUE:
+                break
+            logger.debug("Plugin %s triggered by event %s" % (name, event))
+            start = time.perf_counter()
+            try:
+                handler(e_context, *args, **kwargs)
+            except Exception:
+                self.stats.record(name, event, time.perf_counter() - start, error=True)
+                raise
+            breaked = e_context.is_break()
+            self.stats.record(name, event, time.perf_counter() - start, breaked)
+            if breaked:
+                e_context["breaked_by"] = name
+                logger.debug("Plugin %s breaked event %s" % (name, event))
         return e_context
 
     def set_plugin_priority(self, name: str, priority: int):
@@ -238,6 +264,7 @@ class PluginManager:
             rawname = self.plugins[name].name
             self.pconf["plugins"][rawname]["enabled"] = False
             self.save_config()
+            self.rebuild_handler_chains()
             return True
         return True
 
@@ -336,6 +363,7 @@ class PluginManager:
                 if name in self.listening_plugins[event]:
                     self.listening_plugins[event].remove(name)
             del self.plugins[name]
+            self.rebuild_handler_chains()
             del self.pconf["plugins"][rawname]
             self.loaded[dirname] = None
             self.save_config()
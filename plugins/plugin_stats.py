@@ -0,0 +1,79 @@
+import bisect
+import threading
+
+# 耗时直方图的桶上界(毫秒)，最后一个桶记录超过5秒的调用
+LATENCY_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+
+class HandlerStats:
+    def __init__(self):
+        self.calls = 0
+        self.breaks = 0  # 中断事件(BREAK/BREAK_PASS)的次数
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def percentile_ms(self, p):
+        """根据直方图估算分位数，返回所在桶的上界(不超过最大耗时)"""
+        if not self.calls:
+            return 0.0
+        target = self.calls * p / 100.0
+        count = 0
+        for index, bucket in enumerate(self.buckets):
+            count += bucket
+            if count >= target:
+                break
+        max_ms = round(self.max_time * 1000, 2)
+        if index < len(LATENCY_BUCKETS_MS):
+            return min(float(LATENCY_BUCKETS_MS[index]), max_ms)
+        return max_ms
+
+
+class PluginStats:
+    """
+    插件事件处理函数的耗时统计，按(插件, 事件)记录调用次数、中断次数、异常次数和耗时直方图
+    通过 #pstats 查看，用于定位回复变慢时是哪个插件耗时
+    """
+
+    def __init__(self):
+        self._stats = {}  # (插件名, 事件) -> HandlerStats
+        self._lock = threading.Lock()
+
+    def record(self, name, event, elapsed, breaked=False, error=False):
+        bucket = bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed * 1000)
+        with self._lock:
+            stats = self._stats.get((name, event))
+            if stats is None:
+                stats = self._stats[(name, event)] = HandlerStats()
+            stats.calls += 1
+            stats.breaks += 1 if breaked else 0
+            stats.errors += 1 if error else 0
+            stats.total_time += elapsed
+            stats.max_time = max(stats.max_time, elapsed)
+            stats.buckets[bucket] += 1
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+    def get_metrics(self) -> dict:
+        """
+        :return: {插件名: {事件名: 指标}}，按插件累计耗时从高到低排序
+        """
+        with self._lock:
+            items = sorted(self._stats.items(), key=lambda item: item[1].total_time, reverse=True)
+            metrics = {}
+            for (name, event), stats in items:
+                metrics.setdefault(name, {})[event.name] = {
+                    "calls": stats.calls,
+                    "breaks": stats.breaks,
+                    "errors": stats.errors,
+                    "avg_ms": round(stats.total_time / stats.calls * 1000, 2) if stats.calls else 0.0,
+                    "p50_ms": stats.percentile_ms(50),
+                    "p99_ms": stats.percentile_ms(99),
+                    "max_ms": round(stats.max_time * 1000, 2),
+                    "total_ms": round(stats.total_time * 1000, 2),
+                    "histogram": dict(zip([f"<={b}ms" for b in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}ms"], stats.buckets)),
+                }
+            return metrics
@@ -6,9 +6,18 @@ from bridge.reply import Reply, ReplyType
 from channel.chat_message import ChatMessage
 from common.log import logger
 from plugins import *
+from common.lru_cache import LRUCache
 from config import conf
 from datetime import datetime
+import functools
 import re
+import threading
+
+# 命盘只取决于出生信息，不会过期
+_chart_cache = LRUCache(maxsize=1000, name="ziwei_chart")
+# 运限和排盘文本随日期变化，key中包含日期，隔天自然失效
+_horoscope_cache = LRUCache(maxsize=1000, ttl=24 * 3600, name="ziwei_horoscope")
+_chart_text_cache = LRUCache(maxsize=1000, ttl=24 * 3600, name="ziwei_chart_text")
 
 @plugins.register(
     name="ZiweiAstro",
@@ -27,6 +36,10 @@ class ZiweiAstro(Plugin):
             # 初始化用户状态字典，用于跟踪用户确认过程
             self.user_states = {}
             
+            # py_iztro的Astro对象在多次排盘之间复用，加锁避免多线程同时排盘
+            self.astro = None
+            self.astro_lock = threading.Lock()
+            
             # 检查py_iztro库是否已安装
             try:
                 import py_iztro
@@ -36,14 +49,6 @@ class ZiweiAstro(Plugin):
                 self.py_iztro_available = False
                 logger.warning("[ZiweiAstro] py_iztro库未安装，将使用模拟数据。建议安装: pip install py-iztro")
             
-            # 导入异步处理所需的库
-            try:
-                import asyncio
-                self.asyncio_available = True
-            except ImportError:
-                self.asyncio_available = False
-                logger.warning("[ZiweiAstro] asyncio库导入失败，异步功能可能无法正常工作")
-            
             logger.info("[ZiweiAstro] 紫薇斗数排盘插件已初始化")
         except Exception as e:
             logger.error(f"[ZiweiAstro] 初始化异常：{e}")
@@ -73,18 +78,18 @@ class ZiweiAstro(Plugin):
                 formatted_stars.append(star_text)
         else:
             # 处理字典格式
-        for star in star_list:
-            star_text = star.get("name", "")
+            for star in star_list:
+                star_text = star.get("name", "")
             
-            brightness = star.get("brightness", "")
-            if brightness:
-                star_text += f"({brightness})"
+                brightness = star.get("brightness", "")
+                if brightness:
+                    star_text += f"({brightness})"
                 
-            mutagen = star.get("mutagen", "")
-            if mutagen:
-                star_text += f"[{mutagen}]"
+                mutagen = star.get("mutagen", "")
+                if mutagen:
+                    star_text += f"[{mutagen}]"
                 
-            formatted_stars.append(star_text)
+                formatted_stars.append(star_text)
             
         return "、".join(formatted_stars)
 
@@ -141,6 +146,58 @@ class ZiweiAstro(Plugin):
         }
         return hour_map.get(hour_str, 0)
     
+    def chart_key(self, gender, date_type, date_str, hour_index):
+        """命盘缓存key，日期统一为不带前导0的格式，1990-01-01和1990-1-1是同一个命盘"""
+        try:
+            date_key = "-".join(str(int(part)) for part in date_str.split("-"))
+        except ValueError:
+            date_key = date_str
+        return gender, date_type, date_key, hour_index
+
+    def get_chart(self, chart_key, gender, date_type, date_str, hour_index):
+        """使用py_iztro排盘，结果按出生信息缓存"""
+        result = _chart_cache.get(chart_key)
+        if result is not None:
+            return result
+        
+        with self.astro_lock:
+            if self.astro is None:
+                from py_iztro import Astro
+                self.astro = Astro()
+            
+            logger.info(f"[ZiweiAstro] 开始计算紫微斗数: {gender}, {date_type}, {date_str}, {hour_index}")
+            
+            # 调用py_iztro库的方法进行排盘
+            if date_type == "公历":
+                result = self.astro.by_solar(date_str, hour_index, gender)
+            elif date_type == "农历":
+                result = self.astro.by_lunar(date_str, hour_index, gender)
+            else:
+                raise ValueError("date_type 只能为 '公历' 或 '农历'")
+        
+        logger.info(f"[ZiweiAstro] 紫微斗数计算完成: {result.solar_date}")
+        _chart_cache.set(chart_key, result)
+        return result
+
+    def cached_chart_text(self, kind, gender, date_type, date_str, hour_index, render, daily=True):
+        """
+        排盘文本缓存，只缓存py_iztro的真实排盘结果(模拟数据是随机的)
+        :param kind: 文本类型，不同格式的排盘文本分开缓存
+        :param render: render(result, horoscope) 生成排盘文本
+        :param daily: 文本是否包含运限信息，包含时按日期缓存
+        """
+        chart_key = self.chart_key(gender, date_type, date_str, hour_index)
+        text_key = (kind, chart_key, datetime.today().strftime("%Y-%m-%d") if daily else None)
+        text = _chart_text_cache.get(text_key)
+        if text is not None:
+            return text
+        
+        result, horoscope = self.simulate_astro_result(gender, date_type, date_str, hour_index)
+        text = render(result, horoscope)
+        if hasattr(result, 'solar_date'):
+            _chart_text_cache.set(text_key, text)
+        return text
+
     def simulate_astro_result(self, gender, date_type, date_str, hour_index):
         """
         使用py_iztro库生成紫微斗数排盘结果，如果库不可用则返回模拟数据
@@ -148,26 +205,15 @@ class ZiweiAstro(Plugin):
         # 检查是否有py_iztro库可用
         if hasattr(self, 'py_iztro_available') and self.py_iztro_available:
             try:
-                from py_iztro import Astro
-                from datetime import datetime
-                
-                logger.info(f"[ZiweiAstro] 开始计算紫微斗数: {gender}, {date_type}, {date_str}, {hour_index}")
+                chart_key = self.chart_key(gender, date_type, date_str, hour_index)
+                result = self.get_chart(chart_key, gender, date_type, date_str, hour_index)
                 
-                astro = Astro()
-                
-                # 调用py_iztro库的方法进行排盘
-                if date_type == "公历":
-                    result = astro.by_solar(date_str, hour_index, gender)
-                elif date_type == "农历":
-                    result = astro.by_lunar(date_str, hour_index, gender)
-                else:
-                    raise ValueError("date_type 只能为 '公历' 或 '农历'")
-                
-                # 获取今天日期用于运限计算
+                # 获取今天日期用于运限计算，同一天内同一命盘的运限相同
                 today = datetime.today().strftime("%Y-%m-%d")
-                horoscope = result.horoscope(today)
-                
-                logger.info(f"[ZiweiAstro] 紫微斗数计算完成: {result.solar_date}")
+                horoscope = _horoscope_cache.get((chart_key, today))
+                if horoscope is None:
+                    horoscope = result.horoscope(today)
+                    _horoscope_cache.set((chart_key, today), horoscope)
                 
                 return result, horoscope
             except Exception as e:
@@ -181,7 +227,6 @@ class ZiweiAstro(Plugin):
         hour_name = hour_names[hour_index]
         
         # 获取当前日期用于模拟数据
-        from datetime import datetime
         today = datetime.today().strftime("%Y-%m-%d")
         
         result = {
@@ -331,8 +376,10 @@ class ZiweiAstro(Plugin):
         """
         生成紫微斗数排盘结果字符串
         """
-        result, horoscope = self.simulate_astro_result(gender, date_type, date_str, hour_index)
-        
+        render = functools.partial(self.render_full_chart, gender, date_type, date_str, hour_index)
+        return self.cached_chart_text("full", gender, date_type, date_str, hour_index, render)
+
+    def render_full_chart(self, gender, date_type, date_str, hour_index, result, horoscope):
         lines = []
         lines.append(f"===== 紫微斗数排盘结果（{date_type} {date_str}，{['子','丑','寅','卯','辰','巳','午','未','申','酉','戌','亥'][hour_index]}时，{gender}）=====")
         
@@ -385,43 +432,45 @@ class ZiweiAstro(Plugin):
                     lines.append(f"    流时星: {self.format_star_list(horoscope.hourly.stars[i])}")
         else:
             # 使用模拟数据
-        lines.append(f"命盘公历生日: {result.get('solarDate', '')}")
-        lines.append(f"命盘农历生日: {result.get('lunarDate', '')}")
-        lines.append(f"四柱: {result.get('chineseDate', '')}")
-        lines.append(f"生肖: {result.get('zodiac', '')}  星座: {result.get('sign', '')}")
-        lines.append(f"命宫: {result.get('earthlyBranchOfSoulPalace', '')}  身宫: {result.get('earthlyBranchOfBodyPalace', '')}")
-        lines.append(f"命主: {result.get('soul', '')}  身主: {result.get('body', '')}")
-        lines.append(f"五行局: {result.get('fiveElementsClass', '')}")
-        lines.append("")
+            lines.append(f"命盘公历生日: {result.get('solarDate', '')}")
+            lines.append(f"命盘农历生日: {result.get('lunarDate', '')}")
+            lines.append(f"四柱: {result.get('chineseDate', '')}")
+            lines.append(f"生肖: {result.get('zodiac', '')}  星座: {result.get('sign', '')}")
+            lines.append(f"命宫: {result.get('earthlyBranchOfSoulPalace', '')}  身宫: {result.get('earthlyBranchOfBodyPalace', '')}")
+            lines.append(f"命主: {result.get('soul', '')}  身主: {result.get('body', '')}")
+            lines.append(f"五行局: {result.get('fiveElementsClass', '')}")
+            lines.append("")
         
-        # 输出十二宫位
-        for i in range(12):
-            palace = result.get('palaces', [])[i] if i < len(result.get('palaces', [])) else None
-            if palace:
-                lines.append(
-                    f"宫位: {palace.get('name', '')}\n"
-                    f"  干支: {palace.get('heavenlyStem', '')}{palace.get('earthlyBranch', '')}\n" 
-                    f"  主星: {self.format_star_list(palace.get('majorStars', []))}\n"
-                    f"  辅星: {self.format_star_list(palace.get('minorStars', []))}\n"
-                    f"  杂曜: {self.format_star_list(palace.get('adjectiveStars', []))}\n"
-                    f"  大运: 大运{horoscope.get('decadal', {}).get('palaceNames', [])[i] if i < len(horoscope.get('decadal', {}).get('palaceNames', [])) else ''}\n"
-                    f"    大运星: {self.format_star_list(horoscope.get('decadal', {}).get('stars', [])[i] if i < len(horoscope.get('decadal', {}).get('stars', [])) else [])}\n"
-                    f"  流年: 流年{horoscope.get('yearly', {}).get('palaceNames', [])[i] if i < len(horoscope.get('yearly', {}).get('palaceNames', [])) else ''}\n"
-                    f"    流年星: {self.format_star_list(horoscope.get('yearly', {}).get('stars', [])[i] if i < len(horoscope.get('yearly', {}).get('stars', [])) else [])}\n"
-                    f"  流月: 流月{horoscope.get('monthly', {}).get('palaceNames', [])[i] if i < len(horoscope.get('monthly', {}).get('palaceNames', [])) else ''}\n"
-                    f"    流月星: {self.format_star_list(horoscope.get('monthly', {}).get('stars', [])[i] if i < len(horoscope.get('monthly', {}).get('stars', [])) else [])}\n"
-                    f"  流日: 流日{horoscope.get('daily', {}).get('palaceNames', [])[i] if i < len(horoscope.get('daily', {}).get('palaceNames', [])) else ''}\n"
-                    f"    流日星: {self.format_star_list(horoscope.get('daily', {}).get('stars', [])[i] if i < len(horoscope.get('daily', {}).get('stars', [])) else [])}\n"
-                    f"  流时: 流时{horoscope.get('hourly', {}).get('palaceNames', [])[i] if i < len(horoscope.get('hourly', {}).get('palaceNames', [])) else ''}\n"
-                    f"    流时星: {self.format_star_list(horoscope.get('hourly', {}).get('stars', [])[i] if i < len(horoscope.get('hourly', {}).get('stars', [])) else [])}\n"
-                )
+            # 输出十二宫位
+            for i in range(12):
+                palace = result.get('palaces', [])[i] if i < len(result.get('palaces', [])) else None
+                if palace:
+                    lines.append(
+                        f"宫位: {palace.get('name', '')}\n"
+                        f"  干支: {palace.get('heavenlyStem', '')}{palace.get('earthlyBranch', '')}\n" 
+                        f"  主星: {self.format_star_list(palace.get('majorStars', []))}\n"
+                        f"  辅星: {self.format_star_list(palace.get('minorStars', []))}\n"
+                        f"  杂曜: {self.format_star_list(palace.get('adjectiveStars', []))}\n"
+                        f"  大运: 大运{horoscope.get('decadal', {}).get('palaceNames', [])[i] if i < len(horoscope.get('decadal', {}).get('palaceNames', [])) else ''}\n"
+                        f"    大运星: {self.format_star_list(horoscope.get('decadal', {}).get('stars', [])[i] if i < len(horoscope.get('decadal', {}).get('stars', [])) else [])}\n"
+                        f"  流年: 流年{horoscope.get('yearly', {}).get('palaceNames', [])[i] if i < len(horoscope.get('yearly', {}).get('palaceNames', [])) else ''}\n"
+                        f"    流年星: {self.format_star_list(horoscope.get('yearly', {}).get('stars', [])[i] if i < len(horoscope.get('yearly', {}).get('stars', [])) else [])}\n"
+                        f"  流月: 流月{horoscope.get('monthly', {}).get('palaceNames', [])[i] if i < len(horoscope.get('monthly', {}).get('palaceNames', [])) else ''}\n"
+                        f"    流月星: {self.format_star_list(horoscope.get('monthly', {}).get('stars', [])[i] if i < len(horoscope.get('monthly', {}).get('stars', [])) else [])}\n"
+                        f"  流日: 流日{horoscope.get('daily', {}).get('palaceNames', [])[i] if i < len(horoscope.get('daily', {}).get('palaceNames', [])) else ''}\n"
+                        f"    流日星: {self.format_star_list(horoscope.get('daily', {}).get('stars', [])[i] if i < len(horoscope.get('daily', {}).get('stars', [])) else [])}\n"
+                        f"  流时: 流时{horoscope.get('hourly', {}).get('palaceNames', [])[i] if i < len(horoscope.get('hourly', {}).get('palaceNames', [])) else ''}\n"
+                        f"    流时星: {self.format_star_list(horoscope.get('hourly', {}).get('stars', [])[i] if i < len(horoscope.get('hourly', {}).get('stars', [])) else [])}\n"
+                    )
         
         return '\n'.join(lines)
 
     def natal_chart_str(self, gender, date_type, date_str, hour_index):
         """仅生成本命盘结果字符串，不包括大运流年等信息"""
-        result, _ = self.simulate_astro_result(gender, date_type, date_str, hour_index)
-        
+        render = functools.partial(self.render_natal_chart, gender, date_type, date_str, hour_index)
+        return self.cached_chart_text("natal", gender, date_type, date_str, hour_index, render, daily=False)
+
+    def render_natal_chart(self, gender, date_type, date_str, hour_index, result, horoscope):
         lines = []
         lines.append(f"===== 紫微斗数本命盘（{date_type} {date_str}，{['子','丑','寅','卯','辰','巳','午','未','申','酉','戌','亥'][hour_index]}时，{gender}）=====")
         
@@ -449,26 +498,26 @@ class ZiweiAstro(Plugin):
                 )
         else:
             # 使用模拟数据
-        lines.append(f"命盘公历生日: {result.get('solarDate', '')}")
-        lines.append(f"命盘农历生日: {result.get('lunarDate', '')}")
-        lines.append(f"四柱: {result.get('chineseDate', '')}")
-        lines.append(f"生肖: {result.get('zodiac', '')}  星座: {result.get('sign', '')}")
-        lines.append(f"命宫: {result.get('earthlyBranchOfSoulPalace', '')}  身宫: {result.get('earthlyBranchOfBodyPalace', '')}")
-        lines.append(f"命主: {result.get('soul', '')}  身主: {result.get('body', '')}")
-        lines.append(f"五行局: {result.get('fiveElementsClass', '')}")
-        lines.append("")
+            lines.append(f"命盘公历生日: {result.get('solarDate', '')}")
+            lines.append(f"命盘农历生日: {result.get('lunarDate', '')}")
+            lines.append(f"四柱: {result.get('chineseDate', '')}")
+            lines.append(f"生肖: {result.get('zodiac', '')}  星座: {result.get('sign', '')}")
+            lines.append(f"命宫: {result.get('earthlyBranchOfSoulPalace', '')}  身宫: {result.get('earthlyBranchOfBodyPalace', '')}")
+            lines.append(f"命主: {result.get('soul', '')}  身主: {result.get('body', '')}")
+            lines.append(f"五行局: {result.get('fiveElementsClass', '')}")
+            lines.append("")
         
-        # 输出十二宫位基本信息
-        for i in range(12):
-            palace = result.get('palaces', [])[i] if i < len(result.get('palaces', [])) else None
-            if palace:
-                lines.append(
-                    f"宫位: {palace.get('name', '')}\n"
-                    f"  干支: {palace.get('heavenlyStem', '')}{palace.get('earthlyBranch', '')}\n" 
-                    f"  主星: {self.format_star_list(palace.get('majorStars', []))}\n"
-                    f"  辅星: {self.format_star_list(palace.get('minorStars', []))}\n"
-                    f"  杂曜: {self.format_star_list(palace.get('adjectiveStars', []))}\n"
-                )
+            # 输出十二宫位基本信息
+            for i in range(12):
+                palace = result.get('palaces', [])[i] if i < len(result.get('palaces', [])) else None
+                if palace:
+                    lines.append(
+                        f"宫位: {palace.get('name', '')}\n"
+                        f"  干支: {palace.get('heavenlyStem', '')}{palace.get('earthlyBranch', '')}\n" 
+                        f"  主星: {self.format_star_list(palace.get('majorStars', []))}\n"
+                        f"  辅星: {self.format_star_list(palace.get('minorStars', []))}\n"
+                        f"  杂曜: {self.format_star_list(palace.get('adjectiveStars', []))}\n"
+                    )
         
         return '\n'.join(lines)
 
@@ -515,8 +564,8 @@ class ZiweiAstro(Plugin):
         # 1. 传统时辰表示
         traditional_hour_pattern = r'(子|丑|寅|卯|辰|巳|午|未|申|酉|戌|亥)[时辰]'
         match = re.search(traditional_hour_pattern, text)
-            if match:
-                hour_str = match.group(1)
+        if match:
+            hour_str = match.group(1)
             hour_index = self.get_hour_index(hour_str)
             logger.info(f"[ZiweiAstro] 从文本中提取到传统时辰: {hour_str}({hour_index})")
         else:
@@ -525,33 +574,33 @@ class ZiweiAstro(Plugin):
             match = re.search(digit_hour_pattern, text)
             if match:
                 hour = int(match.group(1))
-                    # 将24小时制转换为12时辰
-                    if 23 <= hour or hour < 1:
-                        hour_index = 0  # 子时 (23:00-01:00)
-                    elif 1 <= hour < 3:
-                        hour_index = 1  # 丑时 (01:00-03:00)
-                    elif 3 <= hour < 5:
-                        hour_index = 2  # 寅时 (03:00-05:00)
-                    elif 5 <= hour < 7:
-                        hour_index = 3  # 卯时 (05:00-07:00)
-                    elif 7 <= hour < 9:
-                        hour_index = 4  # 辰时 (07:00-09:00)
-                    elif 9 <= hour < 11:
-                        hour_index = 5  # 巳时 (09:00-11:00)
-                    elif 11 <= hour < 13:
-                        hour_index = 6  # 午时 (11:00-13:00)
-                    elif 13 <= hour < 15:
-                        hour_index = 7  # 未时 (13:00-15:00)
-                    elif 15 <= hour < 17:
-                        hour_index = 8  # 申时 (15:00-17:00)
-                    elif 17 <= hour < 19:
-                        hour_index = 9  # 酉时 (17:00-19:00)
-                    elif 19 <= hour < 21:
-                        hour_index = 10  # 戌时 (19:00-21:00)
-                    elif 21 <= hour < 23:
-                        hour_index = 11  # 亥时 (21:00-23:00)
+                # 将24小时制转换为12时辰
+                if 23 <= hour or hour < 1:
+                    hour_index = 0  # 子时 (23:00-01:00)
+                elif 1 <= hour < 3:
+                    hour_index = 1  # 丑时 (01:00-03:00)
+                elif 3 <= hour < 5:
+                    hour_index = 2  # 寅时 (03:00-05:00)
+                elif 5 <= hour < 7:
+                    hour_index = 3  # 卯时 (05:00-07:00)
+                elif 7 <= hour < 9:
+                    hour_index = 4  # 辰时 (07:00-09:00)
+                elif 9 <= hour < 11:
+                    hour_index = 5  # 巳时 (09:00-11:00)
+                elif 11 <= hour < 13:
+                    hour_index = 6  # 午时 (11:00-13:00)
+                elif 13 <= hour < 15:
+                    hour_index = 7  # 未时 (13:00-15:00)
+                elif 15 <= hour < 17:
+                    hour_index = 8  # 申时 (15:00-17:00)
+                elif 17 <= hour < 19:
+                    hour_index = 9  # 酉时 (17:00-19:00)
+                elif 19 <= hour < 21:
+                    hour_index = 10  # 戌时 (19:00-21:00)
+                elif 21 <= hour < 23:
+                    hour_index = 11  # 亥时 (21:00-23:00)
                 logger.info(f"[ZiweiAstro] 从文本中提取到小时: {hour}({hour_index})")
-                else:
+            else:
                 # 3. 时间段表达
                 time_periods = {
                     "凌晨": [0, 1, 2, 3, 4, 5],  # 子时、丑时、寅时
@@ -563,7 +612,7 @@ class ZiweiAstro(Plugin):
                     "晚上|夜晚": [19, 20, 21, 22, 23, 0],  # 戌时、亥时、子时
                     "深夜|午夜": [23, 0, 1, 2, 3],  # 子时、丑时
                 }
-                
+
                 for period, hours in time_periods.items():
                     if re.search(period, text):
                         # 取该时间段的中间值对应的时辰
@@ -593,7 +642,7 @@ class ZiweiAstro(Plugin):
                         elif 21 <= mid_hour < 23:
                             hour_index = 11  # 亥时
                         logger.info(f"[ZiweiAstro] 从文本中提取到时间段: {period}，对应时辰: {hour_index}")
-                break
+                        break
         
         # 如果没有检测到时辰，默认用午时
         if not date_str:
@@ -621,12 +670,12 @@ class ZiweiAstro(Plugin):
         if any(keyword in content for keyword in install_keywords):
             logger.info("[ZiweiAstro] 检测到安装依赖请求")
             result = self.install_dependencies()
-                reply = Reply()
-                reply.type = ReplyType.TEXT
+            reply = Reply()
+            reply.type = ReplyType.TEXT
             reply.content = result
-                e_context['reply'] = reply
-                e_context.action = EventAction.BREAK_PASS
-                return
+            e_context['reply'] = reply
+            e_context.action = EventAction.BREAK_PASS
+            return
             
         # 检查用户状态，处理确认流程
         if user_id in self.user_states:
@@ -854,47 +903,47 @@ class ZiweiAstro(Plugin):
                     except Exception as e:
                         logger.error(f"[ZiweiAstro] 保存生辰八字信息到会话上下文时出错: {e}")
             
-            # 生成相应的排盘结果
-            chart_str = ""
+                    # 生成相应的排盘结果
+                    chart_str = ""
                     if user_state.get("is_natal_only", False):
-                chart_str = self.natal_chart_str(gender, date_type, date_str, hour_index)
-                chart_type = "本命盘"
-            else:
-                # 根据用户意图生成不同级别的排盘结果
-                chart_str = self.generate_custom_chart(gender, date_type, date_str, hour_index, 
+                        chart_str = self.natal_chart_str(gender, date_type, date_str, hour_index)
+                        chart_type = "本命盘"
+                    else:
+                        # 根据用户意图生成不同级别的排盘结果
+                        chart_str = self.generate_custom_chart(gender, date_type, date_str, hour_index, 
                                                               include_decadal=True, include_yearly=True, 
                                                               include_monthly=True, include_daily=True, include_hourly=True)
                         chart_type = "完整命盘"
                     
                     # 发送排盘结果
-            reply = Reply()
-            reply.type = ReplyType.TEXT
-            reply.content = chart_str
-            e_context['reply'] = reply
+                    reply = Reply()
+                    reply.type = ReplyType.TEXT
+                    reply.content = chart_str
+                    e_context['reply'] = reply
                     e_context.action = EventAction.BREAK_PASS
-            
-                    # 如果需要解读，在返回排盘结果后，自动触发解读过程
-            if needs_interpretation:
-                    # 设置会话上下文，用于后续解读
-                    user_context = {
-                        "chart_str": chart_str,
-                        "chart_type": chart_type,
-                        "gender": gender,
-                        "date_type": date_type,
-                        "date_str": date_str,
-                        "hour_index": hour_index,
-                        "needs_interpretation": True
-                    }
-                    
-                    # 将用户上下文信息存入用户数据
-                    user_data = conf().get_user_data(user_id)
-                    if not user_data:
-                        user_data = {}
-                    user_data["ziwei_context"] = user_context
-                    conf().set_user_data(user_id, user_data)
                     
+                    # 如果需要解读，在返回排盘结果后，自动触发解读过程
+                    if needs_interpretation:
+                        # 设置会话上下文，用于后续解读
+                        user_context = {
+                            "chart_str": chart_str,
+                            "chart_type": chart_type,
+                            "gender": gender,
+                            "date_type": date_type,
+                            "date_str": date_str,
+                            "hour_index": hour_index,
+                            "needs_interpretation": True
+                        }
+                        
+                        # 将用户上下文信息存入用户数据
+                        user_data = conf().get_user_data(user_id)
+                        if not user_data:
+                            user_data = {}
+                        user_data["ziwei_context"] = user_context
+                        conf().set_user_data(user_id, user_data)
+                        
                         # 创建一个解读任务，使用大模型进行解读
-                        self.process_interpretation_async(user_id, chart_str, chart_type, e_context['context'].ctype, msg)
+                        self.process_interpretation_async(user_id, chart_str, chart_type, e_context['channel'], e_context['context'])
                     
                     return
                 elif "重新输入" in content:
@@ -1002,10 +1051,10 @@ class ZiweiAstro(Plugin):
         # 检查是否需要继续之前的解读
         elif any(phrase in content for phrase in ["继续解读", "接着解读", "继续分析", "接着分析", "更多解读", "详细解读"]):
             # 获取用户信息
-                user_data = conf().get_user_data(user_id)
-                if user_data and "ziwei_context" in user_data:
-                    ziwei_context = user_data["ziwei_context"]
-                    if ziwei_context.get("needs_interpretation", False):
+            user_data = conf().get_user_data(user_id)
+            if user_data and "ziwei_context" in user_data:
+                ziwei_context = user_data["ziwei_context"]
+                if ziwei_context.get("needs_interpretation", False):
                     # 回复用户，告知正在继续解读
                     reply = Reply()
                     reply.type = ReplyType.TEXT
@@ -1017,8 +1066,8 @@ class ZiweiAstro(Plugin):
                     prompt = f"继续解读之前的紫微斗数{ziwei_context['chart_type']}，提供更多关于运势、性格、事业、财运、婚姻等方面的详细信息："
                     
                     # 调用异步处理
-                    self.process_continued_interpretation_async(user_id, ziwei_context['chart_type'], prompt, e_context['context'].ctype, msg)
-                        return
+                    self.process_continued_interpretation_async(user_id, ziwei_context['chart_type'], prompt, e_context['channel'], e_context['context'])
+                    return
             
             # 如果没有找到上下文信息
             reply = Reply()
@@ -1028,7 +1077,7 @@ class ZiweiAstro(Plugin):
             e_context.action = EventAction.BREAK_PASS
             return
 
-    def process_interpretation_async(self, user_id, chart_str, chart_type, ctype, orig_msg):
+    def process_interpretation_async(self, user_id, chart_str, chart_type, channel, context):
         """处理排盘解读，保持在同一个对话线程中"""
         try:
             # 创建解读提示词 - 使用月下星官角色设定
@@ -1096,15 +1145,16 @@ class ZiweiAstro(Plugin):
                         api_key=api_key,
                         base_url=base_url,
                         temperature=temperature,
-                        top_p=top_p
+                        top_p=top_p,
+                        cache=True
                     )
                     
                     if result:
                         reply.content = f"【月下星官·紫微命盘解读】\n\n{result}"
                         
-                        # 发送解读结果
+                        # 通过触发排盘的渠道发送解读结果，接收者与原消息相同
                         from common.utils import send_reply
-                        await send_reply(reply, orig_msg)
+                        await send_reply(reply, context, channel)
                         logger.info(f"[ZiweiAstro] 紫微命盘解读已发送: {user_id}")
                     else:
                         logger.error(f"[ZiweiAstro] 紫微命盘解读请求失败")
@@ -1113,21 +1163,15 @@ class ZiweiAstro(Plugin):
                     import traceback
                     logger.error(f"[ZiweiAstro] 异常堆栈: {traceback.format_exc()}")
             
-            # 启动异步任务
-            if hasattr(self, 'asyncio_available') and self.asyncio_available:
-                asyncio.create_task(process_interpretation())
-            else:
-                # 回退方案：使用线程
-                import threading
-                thread = threading.Thread(target=lambda: asyncio.run(process_interpretation()))
-                thread.daemon = True
-                thread.start()
+            # 插件在线程池线程中执行，没有运行中的事件循环，提交到共享事件循环中执行
+            from channel.async_chat_channel import run_coroutine
+            run_coroutine(process_interpretation())
         except Exception as e:
             logger.error(f"[ZiweiAstro] 启动解读任务时出错: {e}")
             import traceback
             logger.error(f"[ZiweiAstro] 异常堆栈: {traceback.format_exc()}")
 
-    def process_continued_interpretation_async(self, user_id, chart_type, prompt, ctype, orig_msg):
+    def process_continued_interpretation_async(self, user_id, chart_type, prompt, channel, context):
         """处理继续解读，保持在同一个对话线程中"""
         try:
             # 从配置中获取对话模型信息
@@ -1178,15 +1222,16 @@ class ZiweiAstro(Plugin):
                         api_key=api_key,
                         base_url=base_url,
                         temperature=temperature,
-                        top_p=top_p
+                        top_p=top_p,
+                        cache=True
                     )
                     
                     if result:
                         reply.content = f"【月下星官·补充解读】\n\n{result}"
                         
-                        # 发送解读结果
+                        # 通过触发排盘的渠道发送解读结果，接收者与原消息相同
                         from common.utils import send_reply
-                        await send_reply(reply, orig_msg)
+                        await send_reply(reply, context, channel)
                         logger.info(f"[ZiweiAstro] 紫微命盘补充解读已发送: {user_id}")
                     else:
                         logger.error(f"[ZiweiAstro] 紫微命盘补充解读请求失败")
@@ -1195,15 +1240,9 @@ class ZiweiAstro(Plugin):
                     import traceback
                     logger.error(f"[ZiweiAstro] 异常堆栈: {traceback.format_exc()}")
             
-            # 启动异步任务
-            if hasattr(self, 'asyncio_available') and self.asyncio_available:
-                asyncio.create_task(process_continued_interpretation())
-            else:
-                # 回退方案：使用线程
-                import threading
-                thread = threading.Thread(target=lambda: asyncio.run(process_continued_interpretation()))
-                thread.daemon = True
-                thread.start()
+            # 插件在线程池线程中执行，没有运行中的事件循环，提交到共享事件循环中执行
+            from channel.async_chat_channel import run_coroutine
+            run_coroutine(process_continued_interpretation())
         except Exception as e:
             logger.error(f"[ZiweiAstro] 启动补充解读任务时出错: {e}")
             import traceback
@@ -1215,8 +1254,13 @@ class ZiweiAstro(Plugin):
         """
         根据用户需求生成定制的排盘结果
         """
-        result, horoscope = self.simulate_astro_result(gender, date_type, date_str, hour_index)
-        
+        include = (include_decadal, include_yearly, include_monthly, include_daily, include_hourly)
+        render = functools.partial(self.render_custom_chart, gender, date_type, date_str, hour_index, *include)
+        return self.cached_chart_text(("custom",) + include, gender, date_type, date_str, hour_index, render)
+
+    def render_custom_chart(self, gender, date_type, date_str, hour_index, 
+                            include_decadal, include_yearly, include_monthly, include_daily, include_hourly, 
+                            result, horoscope):
         lines = []
         hour_names = ["子", "丑", "寅", "卯", "辰", "巳", "午", "未", "申", "酉", "戌", "亥"]
         lines.append(f"===== 紫微斗数{'' if all([include_decadal, include_yearly]) else '定制'}排盘结果（{date_type} {date_str}，{hour_names[hour_index]}时，{gender}）=====")
@@ -1273,53 +1317,53 @@ class ZiweiAstro(Plugin):
             
         else:
             # 使用模拟数据
-        lines.append(f"命盘公历生日: {result.get('solarDate', '')}")
-        lines.append(f"命盘农历生日: {result.get('lunarDate', '')}")
-        lines.append(f"四柱: {result.get('chineseDate', '')}")
-        lines.append(f"生肖: {result.get('zodiac', '')}  星座: {result.get('sign', '')}")
-        lines.append(f"命宫: {result.get('earthlyBranchOfSoulPalace', '')}  身宫: {result.get('earthlyBranchOfBodyPalace', '')}")
-        lines.append(f"命主: {result.get('soul', '')}  身主: {result.get('body', '')}")
-        lines.append(f"五行局: {result.get('fiveElementsClass', '')}")
-        lines.append("")
+            lines.append(f"命盘公历生日: {result.get('solarDate', '')}")
+            lines.append(f"命盘农历生日: {result.get('lunarDate', '')}")
+            lines.append(f"四柱: {result.get('chineseDate', '')}")
+            lines.append(f"生肖: {result.get('zodiac', '')}  星座: {result.get('sign', '')}")
+            lines.append(f"命宫: {result.get('earthlyBranchOfSoulPalace', '')}  身宫: {result.get('earthlyBranchOfBodyPalace', '')}")
+            lines.append(f"命主: {result.get('soul', '')}  身主: {result.get('body', '')}")
+            lines.append(f"五行局: {result.get('fiveElementsClass', '')}")
+            lines.append("")
         
-        # 输出十二宫位
-        for i in range(12):
-            palace = result.get('palaces', [])[i] if i < len(result.get('palaces', [])) else None
-            if palace:
-                palace_lines = [
+            # 输出十二宫位
+            for i in range(12):
+                palace = result.get('palaces', [])[i] if i < len(result.get('palaces', [])) else None
+                if palace:
+                    palace_lines = [
                         f"宫位: {palace.get('name', '')}",
                         f"  干支: {palace.get('heavenlyStem', '')}{palace.get('earthlyBranch', '')}",
                         f"  主星: {self.format_star_list(palace.get('majorStars', []))}",
                         f"  辅星: {self.format_star_list(palace.get('minorStars', []))}",
-                    f"  杂曜: {self.format_star_list(palace.get('adjectiveStars', []))}"
-                ]
+                        f"  杂曜: {self.format_star_list(palace.get('adjectiveStars', []))}"
+                    ]
                 
                     # 添加大运信息
-                if include_decadal:
-                    palace_lines.append(f"  大运: 大运{horoscope.get('decadal', {}).get('palaceNames', [])[i] if i < len(horoscope.get('decadal', {}).get('palaceNames', [])) else ''}")
-                    palace_lines.append(f"    大运星: {self.format_star_list(horoscope.get('decadal', {}).get('stars', [])[i] if i < len(horoscope.get('decadal', {}).get('stars', [])) else [])}")
+                    if include_decadal:
+                        palace_lines.append(f"  大运: 大运{horoscope.get('decadal', {}).get('palaceNames', [])[i] if i < len(horoscope.get('decadal', {}).get('palaceNames', [])) else ''}")
+                        palace_lines.append(f"    大运星: {self.format_star_list(horoscope.get('decadal', {}).get('stars', [])[i] if i < len(horoscope.get('decadal', {}).get('stars', [])) else [])}")
                     
                     # 添加流年信息
-                if include_yearly:
-                    palace_lines.append(f"  流年: 流年{horoscope.get('yearly', {}).get('palaceNames', [])[i] if i < len(horoscope.get('yearly', {}).get('palaceNames', [])) else ''}")
-                    palace_lines.append(f"    流年星: {self.format_star_list(horoscope.get('yearly', {}).get('stars', [])[i] if i < len(horoscope.get('yearly', {}).get('stars', [])) else [])}")
+                    if include_yearly:
+                        palace_lines.append(f"  流年: 流年{horoscope.get('yearly', {}).get('palaceNames', [])[i] if i < len(horoscope.get('yearly', {}).get('palaceNames', [])) else ''}")
+                        palace_lines.append(f"    流年星: {self.format_star_list(horoscope.get('yearly', {}).get('stars', [])[i] if i < len(horoscope.get('yearly', {}).get('stars', [])) else [])}")
                     
                     # 添加流月信息
-                if include_monthly:
-                    palace_lines.append(f"  流月: 流月{horoscope.get('monthly', {}).get('palaceNames', [])[i] if i < len(horoscope.get('monthly', {}).get('palaceNames', [])) else ''}")
-                    palace_lines.append(f"    流月星: {self.format_star_list(horoscope.get('monthly', {}).get('stars', [])[i] if i < len(horoscope.get('monthly', {}).get('stars', [])) else [])}")
+                    if include_monthly:
+                        palace_lines.append(f"  流月: 流月{horoscope.get('monthly', {}).get('palaceNames', [])[i] if i < len(horoscope.get('monthly', {}).get('palaceNames', [])) else ''}")
+                        palace_lines.append(f"    流月星: {self.format_star_list(horoscope.get('monthly', {}).get('stars', [])[i] if i < len(horoscope.get('monthly', {}).get('stars', [])) else [])}")
                     
                     # 添加流日信息
-                if include_daily:
-                    palace_lines.append(f"  流日: 流日{horoscope.get('daily', {}).get('palaceNames', [])[i] if i < len(horoscope.get('daily', {}).get('palaceNames', [])) else ''}")
-                    palace_lines.append(f"    流日星: {self.format_star_list(horoscope.get('daily', {}).get('stars', [])[i] if i < len(horoscope.get('daily', {}).get('stars', [])) else [])}")
+                    if include_daily:
+                        palace_lines.append(f"  流日: 流日{horoscope.get('daily', {}).get('palaceNames', [])[i] if i < len(horoscope.get('daily', {}).get('palaceNames', [])) else ''}")
+                        palace_lines.append(f"    流日星: {self.format_star_list(horoscope.get('daily', {}).get('stars', [])[i] if i < len(horoscope.get('daily', {}).get('stars', [])) else [])}")
                     
                     # 添加流时信息
-                if include_hourly:
-                    palace_lines.append(f"  流时: 流时{horoscope.get('hourly', {}).get('palaceNames', [])[i] if i < len(horoscope.get('hourly', {}).get('palaceNames', [])) else ''}")
-                    palace_lines.append(f"    流时星: {self.format_star_list(horoscope.get('hourly', {}).get('stars', [])[i] if i < len(horoscope.get('hourly', {}).get('stars', [])) else [])}")
+                    if include_hourly:
+                        palace_lines.append(f"  流时: 流时{horoscope.get('hourly', {}).get('palaceNames', [])[i] if i < len(horoscope.get('hourly', {}).get('palaceNames', [])) else ''}")
+                        palace_lines.append(f"    流时星: {self.format_star_list(horoscope.get('hourly', {}).get('stars', [])[i] if i < len(horoscope.get('hourly', {}).get('stars', [])) else [])}")
                 
-                lines.append("\n".join(palace_lines))
+                    lines.append("\n".join(palace_lines))
         
         return '\n'.join(lines)
 
@@ -1337,7 +1381,7 @@ class ZiweiAstro(Plugin):
             if self.py_iztro_available:
                 help_text += "状态：已安装py_iztro库，使用真实计算引擎\n"
             else:
-                help_text += "状态：未安装py_iztro库，使用模拟数据（可发送"安装紫薇斗数依赖"进行安装）\n"
+                help_text += "状态：未安装py_iztro库，使用模拟数据（可发送'安装紫薇斗数依赖'进行安装）\n"
         
         return help_text 
 
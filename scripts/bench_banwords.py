@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Banwords 敏感词匹配基准测试
+
+对比 WordsSearch(节点对象) 和 WordsSearchCompact(数组保存的自动机) 的构建耗时、
+从序列化文件加载的耗时，以及在长回复文本上 FindFirst/ContainsAny/Replace 的耗时。
+默认使用随机生成的词库，也可以用 --words 指定真实词库(每行一个词)。
+
+用法:
+    python scripts/bench_banwords.py --words-count 10000 --text-length 4000 --texts 50
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "plugins", "banwords", "lib"))
+
+from WordsSearch import WordsSearch
+from WordsSearchCompact import WordsSearchCompact
+
+# 常用汉字，用于生成词库和模拟回复
+CHARSET = "的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所民得经十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从业本去把性好应开它合还因由其些然前外天政四日那社义事平形相全表间样与关各重新线内数正心反你明看原又么利比或但质气第向道命此变条只没结解问意建月公无系军很情者最立代想已通并提直题党程展五果料象员革位入常文总次品式活设及管特件长求老头基资边流路级少图山统接知较将组见计别她手角期根论运农指几九区强放决西被干做必战先回则任取据处队南给色光门即保治北造百规热领七海口东导器压志世金增争济阶油思术极交受联什认六共权收证改清己美再采转更单风切打白教速花带安场身车例真务具万每目至达走积示议声报斗完类八离华名确才科张信马节话米整空元况今集温传土许步群广石记需段研界拉林律叫且究观越织装影算低持音众书布复容儿须际商非验连断深难近矿千周委素技备半办青省列习响约支般史感劳便团往酸历市克何除消构府称太准精值号率族维划选标写存候毛亲快效斯院查江型眼王按格养易置派层片始却专状育厂京识适属圆包火住调满县局照参红细引听该铁价严"
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(p / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def load_words(args):
+    if args.words:
+        with open(args.words, "r", encoding="utf-8") as f:
+            return [line.strip() for line in f if line.strip()]
+    words = set()
+    while len(words) < args.words_count:
+        # 词长3~6，随机文本中很少误命中，模拟大部分回复不含敏感词、需要扫描全文的情况
+        words.add("".join(random.choice(CHARSET) for _ in range(random.randint(3, 6))))
+    return list(words)
+
+
+def make_texts(args, words):
+    texts = []
+    for i in range(args.texts):
+        chars = [random.choice(CHARSET + "，。 \n") for _ in range(args.text_length)]
+        text = "".join(chars)
+        # 一半的文本在末尾插入敏感词
+        if i % 2 == 0:
+            text += random.choice(words)
+        texts.append(text)
+    return texts
+
+
+def timeit(func, texts):
+    latencies = []
+    for text in texts:
+        start = time.perf_counter()
+        func(text)
+        latencies.append(time.perf_counter() - start)
+    return sorted(latencies)
+
+
+def report(name, latencies):
+    print(
+        "  {:<12} p50={:.3f}ms  p99={:.3f}ms  total={:.1f}ms".format(
+            name, percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000, sum(latencies) * 1000
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Banwords matcher benchmark")
+    parser.add_argument("--words", help="词库文件，不指定时随机生成")
+    parser.add_argument("--words-count", type=int, default=10000, help="随机生成的词数")
+    parser.add_argument("--text-length", type=int, default=4000, help="每段回复的字数")
+    parser.add_argument("--texts", type=int, default=50, help="回复段数")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    words = load_words(args)
+    texts = make_texts(args, words)
+    print("words={} texts={} text_length={}".format(len(words), len(texts), args.text_length))
+
+    cache_file = os.path.join(tempfile.mkdtemp(), "banwords.dat")
+    engines = []
+    for name, cls in (("WordsSearch", WordsSearch), ("Compact", WordsSearchCompact)):
+        searcher = cls()
+        start = time.perf_counter()
+        if cls is WordsSearchCompact:
+            searcher.SetKeywords(words, cache_file)
+        else:
+            searcher.SetKeywords(words)
+        print("{:<12} build={:.1f}ms".format(name, (time.perf_counter() - start) * 1000))
+        engines.append((name, searcher))
+
+    start = time.perf_counter()
+    loaded = WordsSearchCompact()
+    loaded.SetKeywords(words, cache_file)
+    print("{:<12} load={:.1f}ms ({:.1f}KB)".format("Compact", (time.perf_counter() - start) * 1000, os.path.getsize(cache_file) / 1024))
+
+    for name, searcher in engines:
+        print(name)
+        report("FindFirst", timeit(searcher.FindFirst, texts))
+        report("ContainsAny", timeit(searcher.ContainsAny, texts))
+        report("Replace", timeit(searcher.Replace, texts))
+
+    # 两种实现的结果必须一致
+    base, compact = engines[0][1], engines[1][1]
+    for text in texts:
+        assert base.FindFirst(text) == compact.FindFirst(text)
+        assert base.Replace(text) == compact.Replace(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ChatChannel._compose_context 基准测试
+
+按给定规模生成前缀、关键词和群白名单配置，混合群聊(@机器人、前缀、关键词、未触发)和私聊消息，
+统计 _compose_context 的单条耗时(p50/p99)，并对比预编译匹配器与逐个扫描列表(check_prefix/check_contain)的耗时。
+
+用法:
+    python scripts/bench_compose_context.py --prefixes 20 --keywords 200 --groups 500 --messages 20000
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bridge.context import ContextType
+from channel.chat_channel import ChatChannel, check_contain, check_prefix
+from channel.chat_message import ChatMessage
+from channel.trigger_matcher import get_trigger_matcher
+from common.log import logger
+from config import conf
+
+
+class BenchChannel(ChatChannel):
+    def __init__(self):
+        # 不启动消费线程，只测试context的构造
+        self.name = "bot"
+        self.user_id = "bot_id"
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(p / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def setup_config(args):
+    config = conf()
+    config["group_chat_prefix"] = ["@bot"] + ["前缀{}".format(i) for i in range(args.prefixes - 1)]
+    config["single_chat_prefix"] = ["bot"] + ["私聊{}".format(i) for i in range(args.prefixes - 1)]
+    config["image_create_prefix"] = ["画"] + ["图片{}".format(i) for i in range(args.prefixes - 1)]
+    config["group_chat_keyword"] = ["关键词{}".format(i) for i in range(args.keywords)]
+    config["group_name_white_list"] = ["群{}".format(i) for i in range(args.groups)]
+    config["group_name_keyword_white_list"] = ["测试群{}".format(i) for i in range(args.keywords)]
+    config["group_chat_in_one_session"] = ["群{}".format(i) for i in range(0, args.groups, 2)]
+    config["nick_name_black_list"] = ["黑名单{}".format(i) for i in range(args.groups)]
+
+
+def make_message(i, args):
+    msg = ChatMessage(None)
+    kind = i % 5
+    isgroup = kind != 4
+    msg.msg_id = str(i)
+    msg.from_user_id = "user_{}".format(i % 100)
+    msg.from_user_nickname = "用户{}".format(i % 100)
+    msg.to_user_id = "bot_id"
+    msg.is_group = isgroup
+    msg.is_at = kind == 0
+    msg.at_list = ["用户{}".format(i % 7)] if kind == 0 else []
+    msg.self_display_name = ""
+    if isgroup:
+        msg.other_user_id = "group_{}".format(i % args.groups)
+        msg.other_user_nickname = "群{}".format(i % args.groups)
+        msg.actual_user_id = msg.from_user_id
+        msg.actual_user_nickname = msg.from_user_nickname
+    else:
+        msg.other_user_id = msg.from_user_id
+        msg.other_user_nickname = msg.from_user_nickname
+    # 0: @机器人 1: 命中末尾的前缀 2: 命中末尾的关键词 3: 未触发 4: 私聊前缀
+    padding = "今天天气怎么样" * 5
+    content = [
+        "@bot " + padding,
+        "前缀{} ".format(args.prefixes - 2) + padding,
+        padding + "关键词{}".format(args.keywords - 1),
+        padding,
+        "bot " + padding,
+    ][kind]
+    msg.content = content
+    return msg, isgroup, content
+
+
+def bench_compose(channel, messages):
+    latencies = []
+    for msg, isgroup, content in messages:
+        start = time.perf_counter()
+        channel._compose_context(ContextType.TEXT, content, isgroup=isgroup, msg=msg)
+        latencies.append(time.perf_counter() - start)
+    return sorted(latencies)
+
+
+def bench_match(contents, match):
+    start = time.perf_counter()
+    for content in contents:
+        match(content)
+    return (time.perf_counter() - start) / len(contents)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ChatChannel compose context benchmark")
+    parser.add_argument("--prefixes", type=int, default=20, help="每种前缀列表的长度")
+    parser.add_argument("--keywords", type=int, default=200, help="群聊关键词和群名关键词的数量")
+    parser.add_argument("--groups", type=int, default=500, help="群白名单和昵称黑名单的长度")
+    parser.add_argument("--messages", type=int, default=20000, help="消息数")
+    args = parser.parse_args()
+
+    logger.setLevel(logging.WARNING)  # 避免日志输出影响耗时
+    setup_config(args)
+    channel = BenchChannel()
+    messages = [make_message(i, args) for i in range(args.messages)]
+
+    start = time.perf_counter()
+    get_trigger_matcher()
+    print("matcher build={:.3f}ms".format((time.perf_counter() - start) * 1000))
+
+    bench_compose(channel, messages[:1000])  # 预热
+    latencies = bench_compose(channel, messages)
+    print("_compose_context n={} p50={:.3f}ms  p99={:.3f}ms  max={:.3f}ms".format(
+        len(latencies), percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000, latencies[-1] * 1000))
+
+    matcher = get_trigger_matcher()
+    contents = [content for _, _, content in messages]
+    group_names = [msg.other_user_nickname for msg, _, _ in messages]
+    config = conf()
+    cases = [
+        ("group prefix", contents,
+         lambda c: check_prefix(c, config.get("group_chat_prefix")), matcher.match_group_chat_prefix),
+        ("group keyword", contents,
+         lambda c: check_contain(c, config.get("group_chat_keyword")), matcher.contain_group_chat_keyword),
+        ("group whitelist", group_names,
+         lambda g: g in config.get("group_name_white_list") or check_contain(g, config.get("group_name_keyword_white_list")),
+         matcher.is_group_allowed),
+    ]
+    for name, values, scan, compiled in cases:
+        print("{:<16} scan={:.2f}us  compiled={:.2f}us".format(
+            name, bench_match(values, scan) * 1e6, bench_match(values, compiled) * 1e6))
+
+
+if __name__ == "__main__":
+    main()
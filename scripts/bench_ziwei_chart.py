@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+紫微斗数排盘缓存基准测试
+
+对同一批出生信息反复排盘，分别统计首次排盘(冷启动)和缓存命中后的耗时(p50/p99)。
+需要安装py_iztro，未安装时插件使用随机的模拟数据，不走缓存。
+
+用法:
+    python scripts/bench_ziwei_chart.py --charts 20 --rounds 50
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.lru_cache import get_cache_metrics
+from plugins import PluginManager
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(p / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def load_plugin():
+    plugin_manager = PluginManager()
+    plugin_manager.current_plugin_path = "./plugins/ziwei_astro"
+    import plugins.ziwei_astro.ziwei_astro  # noqa: F401 注册插件
+
+    return plugin_manager.plugins["ZIWEIASTRO"]()
+
+
+def report(name, latencies):
+    latencies = sorted(latencies)
+    print(
+        "{:<8} n={:<6} p50={:.3f}ms  p99={:.3f}ms  max={:.3f}ms".format(
+            name, len(latencies), percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000, latencies[-1] * 1000
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ZiweiAstro chart cache benchmark")
+    parser.add_argument("--charts", type=int, default=20, help="不同出生信息的数量")
+    parser.add_argument("--rounds", type=int, default=50, help="每个命盘重复请求的次数")
+    args = parser.parse_args()
+
+    plugin = load_plugin()
+    if not plugin.py_iztro_available:
+        print("py_iztro未安装，请先执行: pip install py-iztro")
+        return
+
+    births = [("男" if i % 2 else "女", "公历", "19{}-{}-{}".format(70 + i % 30, i % 12 + 1, i % 28 + 1), i % 12) for i in range(args.charts)]
+    requests = [
+        lambda birth: plugin.ziwei_full_chart_str(*birth),
+        lambda birth: plugin.natal_chart_str(*birth),
+        lambda birth: plugin.generate_custom_chart(*birth),
+    ]
+
+    cold, warm = [], []
+    for round_index in range(args.rounds):
+        for birth in births:
+            for request in requests:
+                start = time.perf_counter()
+                request(birth)
+                (cold if round_index == 0 else warm).append(time.perf_counter() - start)
+
+    report("cold", cold)
+    report("warm", warm)
+    for name, metrics in get_cache_metrics().items():
+        if name.startswith("ziwei"):
+            print("{:<18} {}".format(name, metrics))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from common.log import logger
+from config import conf
+
+
+class OcrQueueFullError(Exception):
+    """OCR任务队列已满"""
+    pass
+
+
+class OcrTimeoutError(Exception):
+    """OCR任务执行超时"""
+    pass
+
+
+class OcrJob:
+    def __init__(self, image_path):
+        self.image_path = image_path
+        self.future = Future()
+        self.submit_time = time.monotonic()
+
+
+def _get_rss_mb():
+    """当前进程的常驻内存(MB)，无法获取时返回None"""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    try:
+        import resource
+
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)  # 峰值内存，Linux下单位为KB
+    except ImportError:
+        return None
+
+
+def _worker_main(conn, ocr_kwargs):
+    """
+    OCR工作进程入口，每个进程加载一个模型实例，逐个处理主进程发来的图片路径
+    模型只在工作进程中加载，主进程导入渠道模块时不再加载模型
+    """
+    start = time.monotonic()
+    from paddleocr import PaddleOCR
+
+    ocr = PaddleOCR(**ocr_kwargs)
+    conn.send(("ready", {"load_seconds": time.monotonic() - start, "rss_mb": _get_rss_mb()}))
+    while True:
+        try:
+            image_path = conn.recv()
+        except EOFError:
+            return
+        if image_path is None:
+            return
+        try:
+            conn.send(("ok", ocr.ocr(image_path, cls=False)))
+        except Exception as e:
+            conn.send(("error", "{}: {}".format(type(e).__name__, e)))
+
+
+class OcrWorker:
+    """
+    主进程中代表一个OCR工作进程，由一个调度线程从任务队列取任务发给工作进程
+    任务超时或进程异常退出时重启工作进程
+    """
+
+    def __init__(self, service, index):
+        self.service = service
+        self.name = "ocr_worker_{}".format(index)
+        self.process = None
+        self.conn = None
+        self.busy = False
+        self.load_seconds = None  # 最近一次加载模型的耗时
+        self.rss_mb = None  # 最近一次加载模型后工作进程的常驻内存
+
+    def start(self, warmup=False):
+        """
+        :param warmup: 立即启动工作进程加载模型，否则在收到第一个任务时再启动
+        """
+        thread = threading.Thread(target=self._dispatch_loop, args=(warmup,), name=self.name, daemon=True)
+        thread.start()
+
+    def _spawn(self):
+        ctx = multiprocessing.get_context("spawn")  # 主进程是多线程的，fork不安全
+        parent_conn, child_conn = ctx.Pipe()
+        process = ctx.Process(target=_worker_main, args=(child_conn, self.service.ocr_kwargs), name=self.name, daemon=True)
+        process.start()
+        child_conn.close()
+        # 等待模型加载完成
+        try:
+            if not parent_conn.poll(self.service.load_timeout):
+                raise OcrTimeoutError("load ocr model timeout")
+            _, info = parent_conn.recv()
+        except Exception:
+            process.kill()
+            process.join()
+            parent_conn.close()
+            raise
+        self.load_seconds, self.rss_mb = info["load_seconds"], info["rss_mb"]
+        self.service.record_load(self.load_seconds)
+        logger.info("[OcrService] {} started, pid={}, load model cost {:.1f}s, rss={}MB".format(self.name, process.pid, self.load_seconds, self.rss_mb))
+        self.process, self.conn = process, parent_conn
+
+    def _kill(self):
+        if self.process:
+            self.process.kill()
+            self.process.join()
+        if self.conn:
+            self.conn.close()
+        self.process, self.conn = None, None
+
+    def _dispatch_loop(self, warmup):
+        if warmup:
+            try:
+                self._spawn()
+            except Exception as e:
+                logger.error("[OcrService] {} warmup failed, will retry on first job: {}".format(self.name, e))
+        while True:
+            job = self.service.jobs.get()
+            if not job.future.set_running_or_notify_cancel():
+                continue
+            self.busy = True
+            start = time.monotonic()
+            try:
+                if self.process is None or not self.process.is_alive():
+                    self._kill()
+                    self._spawn()
+                    start = time.monotonic()  # 加载模型的时间不计入任务执行时间
+                self.conn.send(job.image_path)
+                if not self.conn.poll(self.service.timeout):
+                    logger.warning("[OcrService] {} job timeout after {}s, restart worker".format(self.name, self.service.timeout))
+                    self._kill()
+                    raise OcrTimeoutError("ocr timeout after {}s".format(self.service.timeout))
+                status, result = self.conn.recv()
+                if status != "ok":
+                    raise RuntimeError(result)
+                self.service.record_done(job, start)
+                job.future.set_result(result)
+            except Exception as e:
+                if isinstance(e, (EOFError, OSError)):
+                    logger.error("[OcrService] {} crashed: {}".format(self.name, e))
+                    self._kill()
+                self.service.record_failed(job, e)
+                job.future.set_exception(e)
+            finally:
+                self.busy = False
+
+
+class OcrService:
+    """
+    OCR工作进程池，所有渠道共享
+    - ocr_workers个进程各加载一个模型，每个模型使用ocr_cpu_threads个线程
+    - 任务队列最多ocr_queue_size个任务，队列满时直接拒绝
+    - 单个任务执行超过ocr_timeout秒时重启对应的工作进程
+    """
+
+    def __init__(self, warmup=False):
+        """
+        :param warmup: 创建后立即在后台加载模型，否则每个工作进程在收到第一个任务时加载
+        """
+        self.worker_num = max(1, conf().get("ocr_workers", 2))
+        self.timeout = conf().get("ocr_timeout", 60)
+        self.load_timeout = 300
+        self.ocr_kwargs = dict(use_angle_cls=False, lang="ch", use_gpu=False, enable_mkldnn=False, cpu_threads=conf().get("ocr_cpu_threads", 2),
+                               det_limit_side_len=960, det_db_thresh=0.3, det_db_box_thresh=0.5)
+        self.jobs = queue.Queue(maxsize=conf().get("ocr_queue_size", 20))
+        self._stat_lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.total_run = 0.0
+        self.max_run = 0.0
+        self.loads = 0
+        self.total_load = 0.0
+        self.workers = [OcrWorker(self, i) for i in range(self.worker_num)]
+        for worker in self.workers:
+            worker.start(warmup)
+
+    def submit(self, image_path) -> Future:
+        """
+        提交OCR任务
+        :raises OcrQueueFullError: 队列已满
+        """
+        job = OcrJob(image_path)
+        try:
+            self.jobs.put_nowait(job)
+        except queue.Full:
+            with self._stat_lock:
+                self.rejected += 1
+            raise OcrQueueFullError("ocr queue is full, size={}".format(self.jobs.maxsize))
+        with self._stat_lock:
+            self.submitted += 1
+        return job.future
+
+    def estimate_wait(self) -> float:
+        """
+        估算新任务从提交到完成需要的时间(秒)
+        """
+        with self._stat_lock:
+            avg_run = self.total_run / self.completed if self.completed else 10.0
+        pending = self.jobs.qsize() + sum(1 for worker in self.workers if worker.busy)
+        return (pending // self.worker_num + 1) * avg_run
+
+    def record_done(self, job, start):
+        now = time.monotonic()
+        with self._stat_lock:
+            self.completed += 1
+            self.total_wait += start - job.submit_time
+            self.total_run += now - start
+            self.max_run = max(self.max_run, now - start)
+
+    def record_load(self, seconds):
+        with self._stat_lock:
+            self.loads += 1
+            self.total_load += seconds
+
+    def record_failed(self, job, exception):
+        with self._stat_lock:
+            self.failed += 1
+            if isinstance(exception, OcrTimeoutError):
+                self.timeouts += 1
+
+    def get_metrics(self) -> dict:
+        alive = [worker for worker in self.workers if worker.process is not None]
+        with self._stat_lock:
+            finished = self.completed
+            return {
+                "workers": self.worker_num,
+                "loaded": len(alive),
+                "loads": self.loads,
+                "avg_load_ms": round(self.total_load / self.loads * 1000, 2) if self.loads else 0.0,
+                "rss_mb": round(sum(worker.rss_mb or 0 for worker in alive), 1),
+                "queued": self.jobs.qsize(),
+                "busy": sum(1 for worker in self.workers if worker.busy),
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "timeouts": self.timeouts,
+                "rejected": self.rejected,
+                "avg_wait_ms": round(self.total_wait / finished * 1000, 2) if finished else 0.0,
+                "avg_run_ms": round(self.total_run / finished * 1000, 2) if finished else 0.0,
+                "max_run_ms": round(self.max_run * 1000, 2),
+            }
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_ocr_service(warmup=False) -> OcrService:
+    """获取OCR服务，首次使用时启动工作进程"""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = OcrService(warmup)
+    return _service
+
+
+def warmup_ocr_service():
+    """
+    在后台加载OCR模型，不阻塞启动
+    未开启聊天记录分析或ocr_warmup为false时不加载，模型在第一次识别图片时加载
+    """
+    if not conf().get("chat_record_analysis_enabled", False) or not conf().get("ocr_warmup", True):
+        return
+    get_ocr_service(warmup=True)
+    logger.info("[OcrService] warming up {} ocr workers in background".format(_service.worker_num))
+
+
+def get_ocr_metrics():
+    """OCR服务未启动时返回None"""
+    return _service.get_metrics() if _service else None
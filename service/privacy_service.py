@@ -1,22 +1,45 @@
-from channel.wechatmp.wechatmp_channel import WechatMPChannel
 from db.mysql.dao import user_dao
 from common.log import logger
+from common.lru_cache import LRUCache
+from config import conf
 
 
 class PrivacyService:
     """隐私协议同意状态管理服务"""
 
+    def __init__(self):
+        # 同意状态缓存，key为("id", user_id)或("openid", openid)
+        # 同意后不支持取消，已同意的结果长期缓存；未同意的结果可能被其他进程(隐私服务)更新，只短暂缓存
+        self.consent_cache = LRUCache(conf().get("privacy_cache_size", 10000), conf().get("privacy_cache_ttl", 3600), name="privacy")
+        self.unagreed_ttl = conf().get("privacy_cache_unagreed_ttl", 5)
+
     def check_privacy_agreed(self, user_id, openid):
         """检查用户是否已同意隐私协议"""
         if not user_id and not openid:
             return False
+        key = ("id", str(user_id)) if user_id else ("openid", openid)
+        agreed = self.consent_cache.get(key)
+        if agreed is not None:
+            return agreed
         if user_id:
             user = user_dao.get_user_by_id(user_id)
         else:
             user = user_dao.get_user_by_openid(openid)
         if not user:
             return False
-        return user.privacy_status > 0
+        agreed = user.privacy_status > 0
+        if agreed:
+            self.consent_cache.set(key, True)
+        else:
+            self.consent_cache.set(key, False, ttl=self.unagreed_ttl)
+        return agreed
+
+    def invalidate(self, user_id=None, openid=None):
+        """清除用户的同意状态缓存"""
+        if user_id:
+            self.consent_cache.pop(("id", str(user_id)))
+        if openid:
+            self.consent_cache.pop(("openid", openid))
 
     def update_privacy_status(self, user_id, openid, status):
         """更新用户隐私协议同意状态"""
@@ -32,6 +55,7 @@ class PrivacyService:
             return
         user.privacy_status = status
         user_dao.update_user(user)
+        self.invalidate(user.id, user.openid)
 
     # 向用户发送隐私协议确认消息
     def send_agree_notify(self, openid):
@@ -42,6 +66,8 @@ class PrivacyService:
         success_notify += "偶尔本神心情不错的时候，也会破例陪你聊个天🤷‍♀️ 不过先交代清楚➡️ 你是男是女？喜欢男的还是女的？"
 
         try:
+            # 渠道会调用本服务查询隐私状态，这里延迟导入避免循环导入
+            from channel.wechatmp.wechatmp_channel import WechatMPChannel
             channel = WechatMPChannel()
             # 发送消息
             channel._send_text_message(openid, success_notify)
@@ -1,3 +1,5 @@
+import io
+import os
 import shutil
 import wave
 
@@ -11,6 +13,7 @@ except ImportError:
 from pydub import AudioSegment
 
 sil_supports = [8000, 12000, 16000, 24000, 32000, 44100, 48000]  # slk转wav时，支持的采样率
+sil_formats = ("sil", "silk", "slk")
 
 
 def find_closest_sil_supports(sample_rate):
@@ -40,6 +43,86 @@ def get_pcm_from_wav(wav_path):
     return wav.readframes(wav.getnframes())
 
 
+def _get_format(path):
+    return os.path.splitext(path)[1][1:].lower() or None
+
+
+def load_audio(source, format=None) -> AudioSegment:
+    """
+    解码音频，silk格式先用pysilk解码为wav
+
+    :param source: 文件路径、bytes或文件对象
+    :param format: 音频格式，source为文件路径时默认取扩展名
+    """
+    if isinstance(source, str):
+        format = format or _get_format(source)
+        if format in sil_formats:
+            with open(source, "rb") as f:
+                source = f.read()
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    if format in sil_formats:
+        wav_data = pysilk.decode(source.read(), to_wav=True, sample_rate=24000)
+        return AudioSegment.from_file(io.BytesIO(wav_data), format="wav")
+    return AudioSegment.from_file(source, format=format)
+
+
+def export_audio(audio: AudioSegment, format) -> bytes:
+    """
+    在内存中编码音频
+    wav固定为16位pcm，由pydub直接写入，不需要调用ffmpeg
+    """
+    if format == "wav":
+        audio = audio.set_sample_width(2)
+    buffer = io.BytesIO()
+    audio.export(buffer, format=format)
+    return buffer.getvalue()
+
+
+def split_segments(audio: AudioSegment, max_segment_length_ms=60000):
+    """
+    按最大时长切分音频，返回AudioSegment列表
+    """
+    audio_length_ms = len(audio)
+    return [audio[start_ms : min(audio_length_ms, start_ms + max_segment_length_ms)] for start_ms in range(0, max(audio_length_ms, 1), max_segment_length_ms)]
+
+
+def transcode(source, format, src_format=None, frame_rate=None, max_segment_length_ms=None):
+    """
+    音频只解码一次，重采样、切分后各段直接在内存中编码，不产生临时文件
+    只有一段且格式不变、不需要重采样时直接返回原始数据
+
+    :param source: 文件路径、bytes或文件对象
+    :param format: 目标格式，如mp3、amr、wav
+    :param src_format: 源格式，source为文件路径时默认取扩展名
+    :param frame_rate: 目标采样率，None表示不变
+    :param max_segment_length_ms: 每段的最大时长，None表示不切分
+    :returns: (总时长ms, [每段编码后的bytes])
+    """
+    if isinstance(source, str):
+        src_format = src_format or _get_format(source)
+        with open(source, "rb") as f:
+            source = f.read()
+    elif not isinstance(source, (bytes, bytearray)):
+        source = source.read()
+    audio = load_audio(source, src_format)
+    audio_length_ms = len(audio)
+    if max_segment_length_ms is None or audio_length_ms <= max_segment_length_ms:
+        if src_format == format and (frame_rate is None or frame_rate == audio.frame_rate):
+            return audio_length_ms, [bytes(source)]
+        segments = [audio]
+    else:
+        segments = split_segments(audio, max_segment_length_ms)
+    if frame_rate:
+        segments = [segment.set_frame_rate(frame_rate) for segment in segments]
+    return audio_length_ms, [export_audio(segment, format) for segment in segments]
+
+
+def _write_file(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
 def any_to_mp3(any_path, mp3_path):
     """
     把任意格式转成mp3文件
@@ -47,11 +130,7 @@ def any_to_mp3(any_path, mp3_path):
     if any_path.endswith(".mp3"):
         shutil.copy2(any_path, mp3_path)
         return
-    if any_path.endswith(".sil") or any_path.endswith(".silk") or any_path.endswith(".slk"):
-        sil_to_wav(any_path, any_path)
-        any_path = mp3_path
-    audio = AudioSegment.from_file(any_path)
-    audio.export(mp3_path, format="mp3")
+    _write_file(mp3_path, export_audio(load_audio(any_path), "mp3"))
 
 
 def any_to_wav(any_path, wav_path):
@@ -61,30 +140,26 @@ def any_to_wav(any_path, wav_path):
     if any_path.endswith(".wav"):
         shutil.copy2(any_path, wav_path)
         return
-    if any_path.endswith(".sil") or any_path.endswith(".silk") or any_path.endswith(".slk"):
+    if _get_format(any_path) in sil_formats:
         return sil_to_wav(any_path, wav_path)
-    audio = AudioSegment.from_file(any_path)
-    audio.set_frame_rate(8000)    # 百度语音转写支持8000采样率, pcm_s16le, 单通道语音识别
-    audio.set_channels(1)
-    audio.export(wav_path, format="wav", codec='pcm_s16le')
+    _write_file(wav_path, export_audio(load_audio(any_path), "wav"))
 
 
 def any_to_sil(any_path, sil_path):
     """
     把任意格式转成sil文件
     """
-    if any_path.endswith(".sil") or any_path.endswith(".silk") or any_path.endswith(".slk"):
+    if _get_format(any_path) in sil_formats:
         shutil.copy2(any_path, sil_path)
         return 10000
-    audio = AudioSegment.from_file(any_path)
+    audio = load_audio(any_path)
     rate = find_closest_sil_supports(audio.frame_rate)
     # Convert to PCM_s16
     pcm_s16 = audio.set_sample_width(2)
     pcm_s16 = pcm_s16.set_frame_rate(rate)
     wav_data = pcm_s16.raw_data
     silk_data = pysilk.encode(wav_data, data_rate=rate, sample_rate=rate)
-    with open(sil_path, "wb") as f:
-        f.write(silk_data)
+    _write_file(sil_path, silk_data)
     return audio.duration_seconds * 1000
 
 
@@ -95,11 +170,9 @@ def any_to_amr(any_path, amr_path):
     if any_path.endswith(".amr"):
         shutil.copy2(any_path, amr_path)
         return
-    if any_path.endswith(".sil") or any_path.endswith(".silk") or any_path.endswith(".slk"):
-        raise NotImplementedError("Not support file type: {}".format(any_path))
-    audio = AudioSegment.from_file(any_path)
+    audio = load_audio(any_path)
     audio = audio.set_frame_rate(8000)  # only support 8000
-    audio.export(amr_path, format="amr")
+    _write_file(amr_path, export_audio(audio, "amr"))
     return audio.duration_seconds * 1000
 
 
@@ -108,27 +181,22 @@ def sil_to_wav(silk_path, wav_path, rate: int = 24000):
     silk 文件转 wav
     """
     wav_data = pysilk.decode_file(silk_path, to_wav=True, sample_rate=rate)
-    with open(wav_path, "wb") as f:
-        f.write(wav_data)
+    _write_file(wav_path, wav_data)
 
 
 def split_audio(file_path, max_segment_length_ms=60000):
     """
     分割音频文件
+    不需要写文件时使用transcode，直接得到每段的数据
     """
-    audio = AudioSegment.from_file(file_path)
+    audio = load_audio(file_path)
     audio_length_ms = len(audio)
     if audio_length_ms <= max_segment_length_ms:
         return audio_length_ms, [file_path]
-    segments = []
-    for start_ms in range(0, audio_length_ms, max_segment_length_ms):
-        end_ms = min(audio_length_ms, start_ms + max_segment_length_ms)
-        segment = audio[start_ms:end_ms]
-        segments.append(segment)
     file_prefix = file_path[: file_path.rindex(".")]
     format = file_path[file_path.rindex(".") + 1 :]
     files = []
-    for i, segment in enumerate(segments):
+    for i, segment in enumerate(split_segments(audio, max_segment_length_ms)):
         path = f"{file_prefix}_{i+1}" + f".{format}"
         segment.export(path, format=format)
         files.append(path)
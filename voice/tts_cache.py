@@ -0,0 +1,189 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+from cache.cache import CACHE_DIR
+from common.log import logger
+from common.lru_cache import LRUCache
+from common.tmp_dir import TmpDir
+from config import conf
+
+TTS_CACHE_DIR = os.path.join(CACHE_DIR, "tts")
+# 微信临时素材的有效期为3天，提前1小时过期
+MEDIA_ID_TTL = 3 * 24 * 3600 - 3600
+
+
+def _digest(value):
+    return hashlib.sha256(json.dumps(value, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def make_tts_key(voice_bot, text):
+    """
+    生成缓存key: (语音合成引擎, 音色, 模型, 引擎配置哈希, 文本哈希)
+    azure、百度等引擎的音色配置在各自的config.json中，整体参与计算
+    """
+    voice_id = conf().get("tts_voice_id") or conf().get("xi_voice_id")
+    engine_config = getattr(voice_bot, "config", None)
+    key = (
+        conf().get("text_to_voice"),
+        voice_id,
+        conf().get("text_to_voice_model"),
+        _digest(engine_config) if engine_config else None,
+        hashlib.sha256(text.encode("utf-8")).hexdigest(),
+    )
+    return _digest(key)
+
+
+class TtsCache:
+    """
+    语音合成结果的磁盘缓存，相同文本和音色直接复用之前合成的音频
+    - 文件名为缓存key，按最近使用顺序淘汰，总大小不超过max_bytes
+    - 渠道发送语音后会删除回复中的文件，命中时返回缓存文件的副本
+    - 上传到微信的media_id按音频内容缓存，有效期内不再重复上传
+    """
+
+    def __init__(self, cache_dir=TTS_CACHE_DIR, max_bytes=100 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.files = OrderedDict()  # key -> (扩展名, 文件大小)，按最近使用顺序
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.media_ids = LRUCache(maxsize=1000, ttl=MEDIA_ID_TTL, name="tts_media_id")
+        self._load()
+
+    def _load(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith(".tmp"):
+                os.remove(path)
+                continue
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, name, stat.st_size))
+        # 文件修改时间即最近使用时间
+        for _, name, size in sorted(entries):
+            key, ext = os.path.splitext(name)
+            self.files[key] = (ext, size)
+            self.total_bytes += size
+        with self.lock:
+            evicted = self._evict()
+        self._remove_files(evicted)
+        logger.debug("[tts_cache] loaded {} files, {:.1f}MB".format(len(self.files), self.total_bytes / 1024 / 1024))
+
+    def _path(self, key, ext):
+        return os.path.join(self.cache_dir, key + ext)
+
+    def get(self, key):
+        """
+        :return: 缓存音频副本的路径，未命中返回None
+        """
+        with self.lock:
+            item = self.files.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self.files.move_to_end(key)
+            self.hits += 1
+        ext = item[0]
+        path = self._path(key, ext)
+        reply_path = TmpDir().path() + "reply-tts-" + key[:16] + "-" + str(time.time_ns()) + ext
+        try:
+            shutil.copyfile(path, reply_path)
+            os.utime(path)
+        except OSError as e:
+            logger.warning("[tts_cache] read cached voice failed: {}".format(e))
+            with self.lock:
+                if self.files.pop(key, None):
+                    self.total_bytes -= item[1]
+            return None
+        return reply_path
+
+    def put(self, key, voice_file):
+        """
+        缓存合成的音频文件，超过总大小上限时淘汰最久未使用的文件
+        """
+        ext = os.path.splitext(voice_file)[1]
+        size = os.path.getsize(voice_file)
+        if size > self.max_bytes:
+            return
+        path = self._path(key, ext)
+        shutil.copyfile(voice_file, path + ".tmp")
+        os.replace(path + ".tmp", path)
+        with self.lock:
+            old = self.files.pop(key, None)
+            if old:
+                self.total_bytes -= old[1]
+            self.files[key] = (ext, size)
+            self.total_bytes += size
+            evicted = self._evict()
+        if old and old[0] != ext:
+            evicted.append((key, old[0]))
+        self._remove_files(evicted)
+
+    # 调用方需持有self.lock，返回被淘汰的文件
+    def _evict(self):
+        evicted = []
+        while self.total_bytes > self.max_bytes and self.files:
+            key, (ext, size) = self.files.popitem(last=False)
+            self.total_bytes -= size
+            evicted.append((key, ext))
+        return evicted
+
+    def _remove_files(self, evicted):
+        for key, ext in evicted:
+            try:
+                os.remove(self._path(key, ext))
+            except OSError:
+                pass
+
+    def get_media_id(self, channel_type, data):
+        """
+        :param channel_type: 渠道，不同渠道(公众号、企业微信)的media_id不通用
+        :param data: 上传的音频数据
+        """
+        return self.media_ids.get((channel_type, hashlib.sha256(data).hexdigest()))
+
+    def set_media_id(self, channel_type, data, media_id, ttl=MEDIA_ID_TTL):
+        self.media_ids.set((channel_type, hashlib.sha256(data).hexdigest()), media_id, ttl)
+
+    def get_metrics(self) -> dict:
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "files": len(self.files),
+                "size_mb": round(self.total_bytes / 1024 / 1024, 2),
+                "max_mb": round(self.max_bytes / 1024 / 1024, 2),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+_tts_cache = None
+_tts_cache_lock = threading.Lock()
+
+
+def get_tts_cache():
+    """
+    未开启tts_cache_enabled时返回None
+    """
+    global _tts_cache
+    if not conf().get("tts_cache_enabled", True):
+        return None
+    if _tts_cache is None:
+        with _tts_cache_lock:
+            if _tts_cache is None:
+                _tts_cache = TtsCache(max_bytes=conf().get("tts_cache_max_mb", 100) * 1024 * 1024)
+    return _tts_cache
+
+
+def get_tts_cache_metrics():
+    """缓存未创建时返回None"""
+    return _tts_cache.get_metrics() if _tts_cache else None